@@ -0,0 +1,178 @@
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from JackTokenizer import JackTokenizer
+from CompilationEngine import CompilationEngine
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOTS = os.path.join(DIRECTORY, "snapshots")
+GAMES = os.path.join(SNAPSHOTS, "games.json")
+APPLICATION = os.path.join(DIRECTORY, "..", "project_9_jack_application")
+INTERPRETER = os.path.join(DIRECTORY, "..", "project_8_virtual_machine_part_2")
+
+sys.path.append(INTERPRETER)
+from VMInterpreter import VMInterpreter  # noqa: E402
+
+# game -> lines of keyboard input; together they reach every ending
+# of TicTacToe as well as the invalid and taken position messages
+PLAYS = {
+    "x_wins": ["X", "1", "4", "2", "5", "3"],
+    "o_wins": ["O", "1", "1", "4", "2", "5", "3"],
+    "draw": ["X", "1", "2", "3", "5", "4", "6", "8", "7", "9"],
+}
+MAX_STEPS = 10_000_000
+# lines of a differing .vm file shown by 'check'
+DIFF_LINES = 40
+
+
+def compile_application(target) -> str:
+    """
+    Compile the Jack application of project 9 into 'target';
+    return the directory of the .vm files.
+    """
+    source = os.path.join(target, "TicTacToe")
+    shutil.copytree(APPLICATION, source)
+    for name in sorted(os.listdir(source)):
+        if name.endswith(".jack"):
+            tokenizer = JackTokenizer(os.path.join(source, name))
+            with CompilationEngine(tokenizer) as compiler:
+                compiler.parse()
+            tokenizer.file_obj.close()
+    return source
+
+
+def play(source, keys) -> dict:
+    """
+    Run the compiled application in the VM interpreter of project 8
+    with the keyboard input lines 'keys'; return the text on the
+    screen and a digest of the screen memory, or the error which
+    stopped the program from running.
+    """
+    try:
+        interpreter = VMInterpreter(
+            source, "".join(f"{key}\n" for key in keys))
+        interpreter.run(MAX_STEPS)
+    except Exception as error:
+        # broken code may fail anywhere in loading or running
+        return {"error": f"{type(error).__name__}: {error}"}
+    if not interpreter.stop_reason:
+        return {"error": f"no halt after {MAX_STEPS} commands"}
+    screen = interpreter.os.SCREEN
+    pixels = ",".join(map(str, interpreter.ram[screen:screen + 8192]))
+    return {
+        "text": interpreter.os.screen_text(),
+        "screen": hashlib.sha256(pixels.encode()).hexdigest()[:16],
+    }
+
+
+def record() -> tuple:
+    """
+    Compile the application and play every game;
+    return ({.vm file: code}, {game: result}).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        source = compile_application(tmp)
+        code = {}
+        for name in sorted(os.listdir(source)):
+            if name.endswith(".vm"):
+                with open(os.path.join(source, name), "rt") as fp:
+                    code[name] = fp.read()
+        games = {game: play(source, keys) for game, keys in PLAYS.items()}
+    return code, games
+
+
+def update() -> None:
+    """
+    Replace the snapshots with the output of the current compiler.
+    """
+    code, games = record()
+    if os.path.isdir(SNAPSHOTS):
+        shutil.rmtree(SNAPSHOTS)
+    os.makedirs(SNAPSHOTS)
+    for name, text in code.items():
+        with open(os.path.join(SNAPSHOTS, name), "wt") as fp:
+            fp.write(text)
+    with open(GAMES, "wt") as fp:
+        json.dump(games, fp, indent=2)
+        fp.write("\n")
+    print(f"snapshots: {len(code)} .vm files, {len(games)} games")
+
+
+def check() -> bool:
+    """
+    Compare the output of the current compiler with the snapshots;
+    print every difference and return True if there is none.
+    """
+    code, games = record()
+    expected = {
+        name: open(os.path.join(SNAPSHOTS, name), "rt").read()
+        for name in sorted(os.listdir(SNAPSHOTS))
+        if name.endswith(".vm")
+    }
+    with open(GAMES, "rt") as fp:
+        expected_games = json.load(fp)
+
+    same = True
+    for name in sorted(set(code) | set(expected)):
+        if code.get(name) == expected.get(name):
+            print(f"{name}: same")
+            continue
+        same = False
+        print(f"{name}: differs")
+        diff = difflib.unified_diff(
+            expected.get(name, "").splitlines(),
+            code.get(name, "").splitlines(),
+            f"snapshots/{name}",
+            name,
+            lineterm="",
+        )
+        for line in list(diff)[:DIFF_LINES]:
+            print(f"    {line}")
+    for game in sorted(set(games) | set(expected_games)):
+        if games.get(game) == expected_games.get(game):
+            print(f"game {game}: same")
+            continue
+        same = False
+        print(f"game {game}: differs")
+        print(f"    expected: {expected_games.get(game)}")
+        print(f"    current:  {games.get(game)}")
+    return same
+
+
+def main():
+    """
+    Guard the code generated by the compiler: compile the Jack
+    application of project 9, compare the .vm files with the
+    snapshots and play scripted games in the VM interpreter of
+    project 8, comparing the final screens.
+
+    check   compare with the snapshots; exits with status 1 on
+            any difference
+    update  rewrite the snapshots, after an intended change of
+            the generated code
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog="CodegenCheck",
+        description="Compare compiler output with recorded snapshots.")
+    arg_parser.add_argument("command", choices=("check", "update"))
+    args = arg_parser.parse_args()
+
+    if args.command == "update":
+        update()
+        return
+    if not check():
+        print("generated code changed; run 'CodegenCheck.py update' "
+              "if intended")
+        sys.exit(1)
+    print("no changes")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,6 @@ class CompilationEngine:
         self.routine_symbol_table = SymbolTable()
         self.class_name = ""
         self.function_name = ""
-        self.items_pushed_on_stack = 0
         self.label_counter = 0
         self.constructor = False
         self.method = False
@@ -216,95 +215,49 @@ class CompilationEngine:
         Compiles subroutine call.
         """
         token = self.tokenizer.token
-        next_token = next(self.tokenizer.tokens)
-        if next_token == "." and token in self.routine_symbol_table.table:
-            self.items_pushed_on_stack += 1
-            token_type = self.routine_symbol_table.type_of(token)
-            class_name = token_type
-            self._eat(token, advance=False, category="object", meaning="expression")
-            self.tokenizer.token = next_token
-            self._eat(".")
-            self.function_name = self.tokenizer.token
-            self._compile_subroutine_name()
-            self._eat("(")
-            self._compile_expression_list()
-            self.vmwriter.write_call(
-                f"{token_type}.{self.function_name}", self.items_pushed_on_stack
-            )
-            self.items_pushed_on_stack = 0
-            self._eat(")")
-        elif next_token == "." and token in self.class_symbol_table.table:
-            type = self.class_symbol_table.type_of(token)
-            class_name_copy = token
-            self._eat(token, advance=False, category="class", meaning="expression")
-            self.tokenizer.token = next_token
-            self._eat(".")
-            self.function_name = self.tokenizer.token
-            self._compile_subroutine_name()
-            self._eat("(")
-            self._compile_expression_list()
-            self.items_pushed_on_stack += 1
-            self.vmwriter.write_call(
-                f"{type}.{self.function_name}", self.items_pushed_on_stack
-            )
-            self.items_pushed_on_stack = 0
-            self._eat(")")
-        elif next_token == "." and token not in self.routine_symbol_table.table:
-            class_name_copy = token
-            self._eat(token, advance=False, category="class", meaning="expression")
-            self.tokenizer.token = next_token
+        next_token = self.tokenizer.peek()
+        if next_token == ".":
+            if self._search_for_category(token):
+                # method of the object held by the variable
+                class_name = self._search_for_type(token)
+                self._eat(token, category="object", meaning="expression")
+                n_args = 1
+            else:
+                class_name = token
+                self._eat(token, category="class", meaning="expression")
+                n_args = 0
             self._eat(".")
-            self.function_name = self.tokenizer.token
+            subroutine_name = self.tokenizer.token
             self._compile_subroutine_name()
-            self._eat("(")
-            self._compile_expression_list()
-            if token in self.class_symbol_table.table:
-                self.items_pushed_on_stack += 1
-                type = self.class_symbol_table.type_of(token)
-                self.vmwriter.write_call(
-                    f"{type}.{self.function_name}", self.items_pushed_on_stack
-                )
-            else:
-                self.vmwriter.write_call(
-                    f"{class_name_copy}.{self.function_name}", self.items_pushed_on_stack
-                )
-            self.items_pushed_on_stack = 0
-            self._eat(")")
-        elif next_token == "(":
-            function_name = token
-            self._eat(token, advance=False, category="method", meaning="expression")
-            self.tokenizer.token = next_token
-            self._eat("(")
+        else:
+            # method of the current object
+            class_name = self.class_name
+            subroutine_name = token
+            self._eat(token, category="method", meaning="expression")
             self.vmwriter.write_push("pointer", 0)
-            self.items_pushed_on_stack += 1
-            self._compile_expression_list()
-            self.vmwriter.write_call(
-                f"{self.class_name}.{function_name}", self.items_pushed_on_stack
-            )
-            self.items_pushed_on_stack = 0
-            self._eat(")")
-        elif next_token == "[":
-            self._eat(token, advance=False, category="class", meaning="expression")
-            self.tokenizer.token = next_token
-            self._eat("[")
-            self._compile_expression()
-            self._eat("]")
+            n_args = 1
+        self._eat("(")
+        n_args += self._compile_expression_list()
+        self._eat(")")
+        self.vmwriter.write_call(f"{class_name}.{subroutine_name}", n_args)
 
-    def _compile_expression_list(self, method=False) -> None:
+    def _compile_expression_list(self, method=False) -> int:
         """
-        Compiles expression list.
+        Compiles expression list. Returns the number of expressions.
         """
         self.file_obj.write(" " * self.indent + "<expressionList>\n")
         self._increase_indent()
+        count = 0
         if self.tokenizer.token != ")":
-            self.items_pushed_on_stack += 1
+            count += 1
             self._compile_expression()
             while self.tokenizer.token == ",":
                 self._eat(",")
-                self.items_pushed_on_stack += 1
+                count += 1
                 self._compile_expression()
         self._decrease_indent()
         self.file_obj.write(" " * self.indent + "</expressionList>\n")
+        return count
 
     def _compile_var_dec(self) -> None:
         """
@@ -397,22 +350,22 @@ class CompilationEngine:
             self._eat("[")
             self._compile_expression()
             self._eat("]")
-            self.vmwriter.write_push(varname_category, varname_index)
+            if varname_category == "field":
+                self.vmwriter.write_push("this", varname_index)
+            else:
+                self.vmwriter.write_push(varname_category, varname_index)
             self.vmwriter.write_arithmetic("+")
         self._eat("=")
         self._compile_expression()
         self._eat(";")
         self._decrease_indent()
-        if self.constructor:
-            self.vmwriter.write_pop("this", varname_index)
-        elif varname_category == "field":
-            self.vmwriter.write_pop("this", varname_index)
-        elif array_expression:
+        if array_expression:
             self.vmwriter.write_pop("temp", 0)
             self.vmwriter.write_pop("pointer", 1)
             self.vmwriter.write_push("temp", 0)
             self.vmwriter.write_pop("that", 0)
-            #self.vmwriter.write_pop(varname_category, varname_index)
+        elif varname_category == "field":
+            self.vmwriter.write_pop("this", varname_index)
         else:
             self.vmwriter.write_pop(varname_category, varname_index)
         self.file_obj.write(" " * self.indent + f"</letStatement>\n")
@@ -461,6 +414,7 @@ class CompilationEngine:
         label_endwhile = f"{self.function_name}{self.label_counter}"
         self.label_counter += 1
         label_while = f"{self.function_name}{self.label_counter}"
+        self.label_counter += 1
         self.vmwriter.write_label(label_while)
         self._eat("while")
         self._eat("(")
@@ -485,10 +439,11 @@ class CompilationEngine:
         self._increase_indent()
         self._compile_term()
         op = self.tokenizer.token
-        if op in {"+", "-", "*", "/", "&", "|", "<", ">", "="}:
+        while op in {"+", "-", "*", "/", "&", "|", "<", ">", "="}:
             self._eat(op)
             self._compile_term()
             self.vmwriter.write_arithmetic(op)
+            op = self.tokenizer.token
         self._decrease_indent()
         self.file_obj.write(" " * self.indent + "</expression>\n")
 
@@ -500,12 +455,11 @@ class CompilationEngine:
         self._increase_indent()
         varname = self.tokenizer.token
         varname_classification = self.tokenizer.get_token_classification()
-        next_token = next(self.tokenizer.tokens)
+        next_token = self.tokenizer.peek()
 
         if varname_classification == "integerConstant":
             self.vmwriter.write_push("constant", int(varname))
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
         elif varname_classification == "stringConstant":
             removed_quotes = varname.strip('"')
             string_length = len(removed_quotes)
@@ -515,42 +469,35 @@ class CompilationEngine:
                 ascii = ord(char)
                 self.vmwriter.write_push("constant", ascii)
                 self.vmwriter.write_call("String.appendChar", 2)
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
         elif varname == "null":
             self.vmwriter.write_push("constant", 0)
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
         elif varname == "this":
             self.vmwriter.write_push("pointer", 0)
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
         elif varname == "true":
             self.vmwriter.write_push("constant", 1)
             self.vmwriter.write_negation()
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
         elif varname == "false":
             self.vmwriter.write_push("constant", 0)
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
         elif varname == "(":
-            self._eat("(", advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat("(", classification=varname_classification)
             self._compile_expression()
             self._eat(")")
         elif varname == "-":
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
             self._compile_term()
             self.vmwriter.write_negation()
         elif varname == "~":
-            self._eat(varname, advance=False, classification=varname_classification)
-            self.tokenizer.token = next_token
+            self._eat(varname, classification=varname_classification)
             self._compile_term()
             self.vmwriter.write_arithmetic("~")
         elif varname_classification == "identifier" and next_token == "[":
-            self.tokenizer.token = next_token
+            # the variable is pushed after the index
+            self.tokenizer.advance()
             self._eat("[")
             self._compile_expression()
             self._eat("]")
@@ -564,52 +511,15 @@ class CompilationEngine:
             self.vmwriter.write_arithmetic("+")
             self.vmwriter.write_pop("pointer", 1)
             self.vmwriter.write_push("that", 0)
-        elif varname_classification == "identifier" and next_token == ".":
-            class_name = varname
-            self._eat(
-                varname,
-                advance=False,
-                classification="identifier",
-                category="class",
-                meaning="expression",
-            )
-            self.tokenizer.token = next_token
-            self._eat(".")
-            self.function_name = self.tokenizer.token
-            self._compile_subroutine_name()
-            self._eat("(")
-            self._compile_expression_list()
-            self._eat(")")
-            if class_name in self.class_symbol_table.table:
-                type = self.class_symbol_table.type_of(class_name)
-                self.items_pushed_on_stack += 1
-                self.vmwriter.write_call(f"{type}.{self.function_name}",
-                        self.items_pushed_on_stack)
-            else:
-                self.vmwriter.write_call(f"{class_name}.{self.function_name}",
-                        self.items_pushed_on_stack)
-            self.items_pushed_on_stack = 0
-        elif varname_classification == "identifier" and next_token == "(":
-            self._eat(
-                varname,
-                advance=False,
-                classification="identifier",
-                category="subroutine",
-                meaning="expression",
-            )
-            self.tokenizer.token = next_token
-            self._eat("(")
-            self._compile_expression_list()
-            self._eat(")")
+        elif varname_classification == "identifier" and next_token in {".", "("}:
+            self._compile_subroutine_call()
         elif varname_classification == "identifier":
             self._eat(
                 varname,
-                advance=False,
                 classification="identifier",
                 category="",
                 meaning="expression",
             )
-            self.tokenizer.token = next_token
 
         self._decrease_indent()
         self.file_obj.write(" " * self.indent + "</term>\n")
@@ -664,14 +574,8 @@ class CompilationEngine:
         if token in self.routine_symbol_table.table or \
                 token in self.class_symbol_table.table:
             meaning = kwargs.get("meaning")
-            category = (
-                self.class_symbol_table.kind_of(token)
-                or self.routine_symbol_table.kind_of(token)
-                or kwargs["category"]
-            )
-            running_index = self.class_symbol_table.index_of(
-                token
-            ) or self.routine_symbol_table.index_of(token)
+            category = self._search_for_category(token) or kwargs["category"]
+            running_index = self._search_for_index(token)
             self.file_obj.write(
                 " " * self.indent + f'<{classification} category="{category}" '
                 f'index="{running_index}" meaning="{meaning}">'
@@ -702,12 +606,17 @@ class CompilationEngine:
             varname
         ) or self.class_symbol_table.kind_of(varname)
 
+    def _search_for_type(self, varname: str):
+        if varname in self.routine_symbol_table.table:
+            return self.routine_symbol_table.type_of(varname)
+        return self.class_symbol_table.type_of(varname)
+
     def _show_tokens(self) -> None:
         """
         Prints list of tokens. This can be used for debugging purposes
         in order to inspect output of the JackTokenizer.
         """
-        print(list(self.tokenizer.tokens))
+        print(list(self.tokenizer.stream))
 
     def _increase_indent(self) -> None:
         """
@@ -1,7 +1,18 @@
+from collections import namedtuple
 from typing import Generator
 import re
 import os
 
+from exceptions import JackSyntaxError
+from TokenStream import TokenStream
+
+
+# kind   :: str, one of the token_type() constants
+# value  :: str, text of the token; string constants without quotes
+# line   :: int, 1-based line of the first character
+# column :: int, 1-based column of the first character
+Token = namedtuple("Token", ["kind", "value", "line", "column"])
+
 
 class JackTokenizer:
     """
@@ -12,20 +23,41 @@ class JackTokenizer:
     ----------
     file_obj      :: TextWrapper
                      reference to the opened input stream.
-    tokens        :: generator
-                     yielding next token(s)
+    stream        :: TokenStream
+                     classified tokens of the input stream.
     token         :: str
                      reference to the current token. In the beginning
                      token is None.
     """
 
+    KEYWORDS = frozenset({
+        "class", "constructor", "function", "method", "field", "static",
+        "var", "int", "char", "boolean", "void", "true", "false", "null",
+        "this", "let", "do", "if", "else", "while", "return",
+    })
+    SYMBOLS = frozenset("{}()[].,;+-*/&|<>=~")
+    # keyword/symbol -> token kind; other tokens are told apart by
+    # their characters
+    KINDS = dict.fromkeys(KEYWORDS, "KEYWORD")
+    KINDS.update(dict.fromkeys(SYMBOLS, "SYMBOL"))
+    # token kind -> classification in the XML output
+    CLASSIFICATIONS = {
+        "KEYWORD": "keyword",
+        "SYMBOL": "symbol",
+        "INT_CONST": "integerConstant",
+        "STRING_CONST": "stringConstant",
+        "IDENTIFIER": "identifier",
+    }
+    # translation table surrounding every symbol with spaces
+    PAD_SYMBOLS = str.maketrans({symbol: f" {symbol} " for symbol in SYMBOLS})
+
     def __init__(self, input_stream) -> None:
         """
         Opens the input .jack file and gets
         ready to tokenize it.
         """
         self.file_obj = open(input_stream, "rt")
-        self.tokens = self._generate_tokens()
+        self.stream = TokenStream(self._generate_tokens())
         self.token = None
 
     def _remove_comments(self) -> str:
@@ -50,10 +82,112 @@ class JackTokenizer:
 
         return "".join(no_comments)
 
-    def _generate_tokens(self) -> Generator[str, None, None]:
+    def scan(self) -> Generator[Token, None, None]:
+        """
+        Tokenize the input stream in a single pass over its lines,
+        yielding a Token with the kind, value and source position
+        of every token.
+
+        Every line is cut at string constants and comments with
+        str.find; the code between them is split into tokens by
+        padding the symbols with spaces (str.translate) and splitting
+        on whitespace, so the characters are walked by C code instead
+        of a Python loop. Comments are skipped wherever they start;
+        a '/* */' comment may start and end in the middle of a line.
+
+        Raises JackSyntaxError on an unterminated comment or string
+        and on text which is not a token.
+        """
+        kinds = self.KINDS
+        pad_symbols = self.PAD_SYMBOLS
+        # Token(...) runs a Python level __new__; build the tuple directly
+        new = tuple.__new__
+        # (line, column) where an unterminated block comment started
+        comment = None
+        for line_number, line in enumerate(self.file_obj, 1):
+            position = 0
+            if comment is not None:
+                position = line.find("*/")
+                if position < 0:
+                    continue
+                position += 2
+                comment = None
+            while True:
+                # code up to the next string constant or comment
+                cut = len(line)
+                marker = None
+                if '"' in line or "/" in line:
+                    for candidate in ('"', "//", "/*"):
+                        found = line.find(candidate, position, cut)
+                        if found >= 0:
+                            cut = found
+                            marker = candidate
+                code = line[position:cut]
+                find = code.find
+                base = position + 1
+                column = 0
+                for word in code.translate(pad_symbols).split():
+                    column = find(word, column)
+                    kind = kinds.get(word)
+                    if kind is None:
+                        if not word.isascii():
+                            kind = None
+                        elif word.isidentifier():
+                            kind = "IDENTIFIER"
+                        elif word.isdigit():
+                            kind = "INT_CONST"
+                        if kind is None:
+                            raise JackSyntaxError(
+                                f"invalid token {word!r} at line "
+                                f"{line_number}, column {base + column}"
+                            )
+                    yield new(Token, (kind, word, line_number, base + column))
+                    column += len(word)
+                if marker is None or marker == "//":
+                    break
+                if marker == "/*":
+                    end = line.find("*/", cut + 2)
+                    if end < 0:
+                        comment = (line_number, cut + 1)
+                        break
+                    position = end + 2
+                    continue
+                end = line.find('"', cut + 1)
+                if end < 0:
+                    raise JackSyntaxError(
+                        f"unterminated string at line {line_number}, "
+                        f"column {cut + 1}"
+                    )
+                yield new(Token, ("STRING_CONST", line[cut + 1:end],
+                                  line_number, cut + 1))
+                position = end + 1
+        if comment is not None:
+            raise JackSyntaxError(
+                f"unterminated comment at line {comment[0]}, "
+                f"column {comment[1]}"
+            )
+
+    def _generate_tokens(self) -> Generator[Token, None, None]:
         """
-        Tokenize (generate tokens from) the input
-        stream. Return list of tokens.
+        Tokenize (generate tokens from) the input stream;
+        yield every Token of scan(), string constants with
+        their double quotes as the compilation engine expects.
+        """
+        for token in self.scan():
+            if token.kind == "STRING_CONST":
+                yield token._replace(value=f'"{token.value}"')
+            else:
+                yield token
+
+    def _generate_regex_tokens(self) -> Generator[str, None, None]:
+        """
+        Tokenize the input stream with the original two-pass
+        scanner: _remove_comments() joins the lines without
+        comments, then a regex scanner splits them into tokens.
+        Source positions are lost, and a '/* */' comment is only
+        recognized at the start of a line.
+
+        Kept as the reference of TokenizerBenchmark.
         """
         strings = r"\"(.*?)\""
         names = r"[a-zA-Z_][a-zA-Z_0-9]*"
@@ -78,7 +212,7 @@ class JackTokenizer:
         """
         return self.advance()
 
-    def advance(self) -> None:
+    def advance(self) -> bool:
         """
         Gets the next token from the input,
         and makes it the current token.
@@ -88,72 +222,26 @@ class JackTokenizer:
 
         Initially there is no current token.
         """
-        try:
-            self.token = next(self.tokens)
-            return True
-        except StopIteration:
+        token = self.stream.advance()
+        if token is None:
             return False
+        self.token = token
+        return True
+
+    def peek(self, offset=1) -> str:
+        """
+        Returns the token 'offset' positions after
+        the current one without advancing, or None
+        past the end of the input.
+        """
+        return self.stream.peek(offset)
 
     def token_type(self) -> str:
         """
         Returns type of current token,
         as a constant.
         """
-        keywords = {
-            "class",
-            "constructor",
-            "function",
-            "method",
-            "field",
-            "static",
-            "var",
-            "int",
-            "char",
-            "boolean",
-            "void",
-            "true",
-            "true",
-            "false",
-            "null",
-            "this",
-            "let",
-            "do",
-            "if",
-            "else",
-            "while",
-            "return",
-        }
-        symbols = {
-            "{",
-            "}",
-            "(",
-            ")",
-            "[",
-            "]",
-            ".",
-            ",",
-            ";",
-            "+",
-            "-",
-            "*",
-            "/",
-            "&",
-            "|",
-            "<",
-            ">",
-            "=",
-            "~",
-        }
-        if self.token in keywords:
-            return "KEYWORD"
-        if self.token in symbols:
-            return "SYMBOL"
-        if self.token.startswith('"') and self.token.endswith('"'):
-            return "STRING_CONST"
-        if self.token.isnumeric():
-            return "INT_CONST"
-        else:
-            return "IDENTIFIER"
+        return self.stream.kind()
 
     def _keyword(self) -> str:
         """
@@ -204,16 +292,7 @@ class JackTokenizer:
         """
         Return classification needed for the XML output.
         """
-        if self.token_type() == "KEYWORD":
-            return "keyword"
-        if self.token_type() == "SYMBOL":
-            return "symbol"
-        if self.token_type() == "INT_CONST":
-            return "integerConstant"
-        if self.token_type() == "STRING_CONST":
-            return "stringConstant"
-        if self.token_type() == "IDENTIFIER":
-            return "identifier"
+        return self.CLASSIFICATIONS[self.stream.kind()]
 
     def test(self):
         """
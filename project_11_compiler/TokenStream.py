@@ -0,0 +1,114 @@
+from array import array
+
+
+class TokenStream:
+    """
+    Compact stream of the classified tokens of a source file.
+
+    Tokens are stored column-wise in parallel arrays: a kind code per
+    token (index into KINDS) and an index into a table of the distinct
+    token values, so every repeated keyword, symbol or name is stored
+    once. The current token and any token before or after it are
+    reached in O(1).
+
+    Attributes
+    ----------
+    kinds         :: array
+                     kind code of every token.
+    values        :: array
+                     position of the value of every token in 'table'.
+    lines         :: array
+                     line of every token.
+    columns       :: array
+                     column of every token.
+    table         :: list
+                     distinct token values, in order of first appearance.
+    size          :: int
+                     number of tokens.
+    position      :: int
+                     index of the current token; -1 before the first.
+    """
+
+    KINDS = ("KEYWORD", "SYMBOL", "INT_CONST", "STRING_CONST", "IDENTIFIER")
+
+    def __init__(self, tokens) -> None:
+        """
+        Store the (kind, value, line, column) tokens of an iterable,
+        e.g. JackTokenizer.scan().
+        """
+        codes = {kind: code for code, kind in enumerate(self.KINDS)}
+        self.kinds = array("B")
+        self.values = array("I")
+        self.lines = array("I")
+        self.columns = array("I")
+        self.table = []
+        # value -> position in table
+        interned = {}
+        add_kind = self.kinds.append
+        add_value = self.values.append
+        add_line = self.lines.append
+        add_column = self.columns.append
+        table = self.table
+        for kind, value, line, column in tokens:
+            add_kind(codes[kind])
+            index = interned.get(value)
+            if index is None:
+                index = interned[value] = len(table)
+                table.append(value)
+            add_value(index)
+            add_line(line)
+            add_column(column)
+        self.size = len(self.kinds)
+        self.position = -1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        """
+        Iterate over the values of all tokens.
+        """
+        table = self.table
+        return (table[index] for index in self.values)
+
+    def advance(self):
+        """
+        Make the next token the current one and return its value;
+        return None once the stream is exhausted.
+        """
+        if self.position < self.size:
+            self.position += 1
+        if self.position < self.size:
+            return self.table[self.values[self.position]]
+        return None
+
+    def peek(self, offset=0):
+        """
+        Return the value of the token 'offset' positions after the
+        current one (before it when negative), or None outside the
+        stream.
+        """
+        index = self.position + offset
+        if 0 <= index < self.size:
+            return self.table[self.values[index]]
+        return None
+
+    def kind(self, offset=0):
+        """
+        Return the kind (see KINDS) of the token 'offset' positions
+        after the current one, or None outside the stream.
+        """
+        index = self.position + offset
+        if 0 <= index < self.size:
+            return self.KINDS[self.kinds[index]]
+        return None
+
+    def location(self, offset=0):
+        """
+        Return the (line, column) of the token 'offset' positions
+        after the current one, or None outside the stream.
+        """
+        index = self.position + offset
+        if 0 <= index < self.size:
+            return self.lines[index], self.columns[index]
+        return None
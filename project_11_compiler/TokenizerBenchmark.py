@@ -0,0 +1,140 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from JackTokenizer import JackTokenizer
+from TokenStream import TokenStream
+
+
+def generate(path, classes, seed=0) -> None:
+    """
+    Write a synthetic Jack source made of 'classes' classes shaped
+    like compiler test programs: fields, subroutines with lets, ifs,
+    whiles, calls, string constants and comments of every style.
+
+    Block comments only start at the beginning of a line, so the
+    regex path tokenizes the corpus correctly too.
+    """
+    rng = random.Random(seed)
+    names = ["x", "y", "count", "index", "board", "player", "result", "i"]
+    ops = ["+", "-", "*", "/", "&", "|", "<", ">", "="]
+    with open(path, "wt") as fp:
+        for number in range(classes):
+            fp.write("/** Generated class for the tokenizer benchmark. */\n")
+            fp.write(f"class Bench{number} {{\n")
+            fp.write("    field int x, y, count; // the state\n")
+            fp.write("    static Array board;\n")
+            for routine in range(8):
+                fp.write("\n    /**\n     * Generated method.\n     */\n")
+                fp.write(f"    method int run{routine}(int index, "
+                         f"boolean player) {{\n")
+                fp.write("        var int i, result;\n")
+                for _ in range(12):
+                    a, b, c = rng.choice(names), rng.choice(names), \
+                        rng.choice(names)
+                    draw = rng.random()
+                    if draw < 0.4:
+                        fp.write(f"        let {a} = ({b} {rng.choice(ops)} "
+                                 f"{rng.randint(0, 32767)}) "
+                                 f"{rng.choice(ops)} {c};\n")
+                    elif draw < 0.55:
+                        fp.write(f"        let board[{a}] = board[{b} + 1];"
+                                 f"  // update\n")
+                    elif draw < 0.7:
+                        fp.write(f"        if ({a} < {b}) {{ let {c} = "
+                                 f"~{c}; }} else {{ let {c} = -{a}; }}\n")
+                    elif draw < 0.8:
+                        fp.write(f"        while ({a} > 0) {{ let {a} = "
+                                 f"{a} - 1; }}\n")
+                    elif draw < 0.9:
+                        fp.write(f'        do Output.printString("value of '
+                                 f'{a}");\n')
+                    else:
+                        fp.write(f"        do Bench{number}.run{routine}"
+                                 f"({a}, true);\n")
+                fp.write("        return result;\n    }\n")
+            fp.write("}\n")
+
+
+def measure(tokens) -> tuple:
+    """
+    Drain the token generator 'tokens'; return the number of
+    tokens and the elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    count = sum(1 for _ in tokens)
+    return count, time.perf_counter() - start
+
+
+def streamed(tokenizer):
+    """
+    Yield (kind, token) for the tokens of the scanner as the
+    compilation engine reads them: stored in a TokenStream, then
+    walked with advance() and token_type().
+    """
+    tokenizer.stream = TokenStream(tokenizer._generate_tokens())
+    while tokenizer.advance():
+        yield tokenizer.token_type(), tokenizer.token
+
+
+def run(path, repeat) -> None:
+    """
+    Measure tokens per second of the regex path (token strings only),
+    of the single-pass scanner (Token records with kind and position)
+    and of the scanner feeding a TokenStream read as the compilation
+    engine does; the token strings of the regex path and the stream
+    must be equal.
+    """
+    paths = (
+        ("regex (two passes)", JackTokenizer._generate_regex_tokens),
+        ("single pass (Token)", JackTokenizer.scan),
+        ("TokenStream", streamed),
+    )
+    rates = []
+    for name, generate_tokens in paths:
+        best = None
+        for _ in range(repeat):
+            tokenizer = JackTokenizer(path)
+            # the constructor already read the file into a stream
+            tokenizer.file_obj.seek(0)
+            count, elapsed = measure(generate_tokens(tokenizer))
+            tokenizer.file_obj.close()
+            best = elapsed if best is None else min(best, elapsed)
+        rates.append(count / best)
+        print(f"{name:<22}{count} tokens in {best:.2f}s "
+              f"({count / best:,.0f} tokens/s)")
+    print(f"relative to regex: single pass {rates[1] / rates[0]:.2f}x, "
+          f"TokenStream (built, walked, classified) "
+          f"{rates[2] / rates[0]:.2f}x")
+
+    tokenizer = JackTokenizer(path)
+    tokenizer.file_obj.seek(0)
+    identical = list(tokenizer._generate_regex_tokens()) == list(
+        tokenizer.stream)
+    tokenizer.file_obj.close()
+    print(f"tokens identical: {identical}")
+
+
+def main():
+    """
+    Benchmark Jack tokenizer throughput in tokens per second
+    on a generated Jack corpus.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description="Measure Jack tokenizer throughput.")
+    arg_parser.add_argument("--classes", type=int, default=2_000,
+                            help="number of generated classes")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="runs per tokenizer; the fastest counts")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Bench.jack")
+        generate(path, args.classes)
+        run(path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
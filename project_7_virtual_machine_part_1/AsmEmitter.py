@@ -0,0 +1,56 @@
+class AsmEmitter(list):
+    """
+    Buffered emission engine for the assembly produced by the Translator.
+
+    The emitter is used in place of the output file: every
+    'fp.write(line)' of the translator is a plain list.append (no Python
+    level call), and the collected lines are written to the real output
+    in large chunks.
+
+    The text of commands which always translate to the same assembly
+    (e.g. 'push local 2') is rendered once and kept in a template
+    cache; subsequent occurrences append the whole pre-formatted
+    block at once.
+
+    Attributes
+    ----------
+    target        :: TextWrapper
+                     reference to the real output file.
+    chunk_size    :: int
+                     number of buffered pieces which triggers a flush.
+    """
+
+    write = list.append
+
+    def __init__(self, target, chunk_size=8192):
+        super().__init__()
+        self.target = target
+        self.chunk_size = chunk_size
+
+    def emit(self, templates, key, render, *args) -> None:
+        """
+        Append the text cached in 'templates' under 'key'; on a miss
+        call render(*args) and cache what it wrote. Pass key=None
+        for commands which cannot be cached.
+        """
+        if key is None:
+            render(*args)
+        else:
+            text = templates.get(key)
+            if text is None:
+                start = len(self)
+                render(*args)
+                text = ''.join(self[start:])
+                del self[start:]
+                templates[key] = text
+            self.append(text)
+        if len(self) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all buffered text to the real output file.
+        """
+        if self:
+            self.target.write(''.join(self))
+            self.clear()
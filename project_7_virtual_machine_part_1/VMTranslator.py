@@ -1,6 +1,8 @@
 import sys
 import os
 
+from AsmEmitter import AsmEmitter
+
 
 def main():
     """
@@ -51,6 +53,7 @@ class Parser:
                                          self.source)
             finally:
                 fp.close()
+        translator.flush()
 
     def get_command_type(self, command: str) -> str:
         """
@@ -115,21 +118,46 @@ class Parser:
 
 class Translator:
 
-    def __init__(self, fp):
+    def __init__(self, fp, buffered=True):
         """
         Initialize Translator instance. Receive file pointer to output file.
+
+        When buffered is set (default), output goes through an AsmEmitter
+        which caches the text of context-free commands and writes to
+        'fp' in large chunks; call flush() once done.
         """
-        self.fp = fp
+        self.buffered = buffered
+        self.fp = AsmEmitter(fp) if buffered else fp
+        # rendered text of every command except comparisons, whose
+        # labels depend on the counter
+        self.templates = {}
 
     def translate(self, command_type, arg_1, arg_2, counter, filename) -> None:
         """
         Delegate translation of commands based on their command type.
         """
+        if self.buffered:
+            key = (command_type, arg_1, arg_2)
+            if arg_1 in {'eq', 'gt', 'lt'}:
+                key = None
+            self.fp.emit(self.templates, key, self._translate, command_type,
+                         arg_1, arg_2, counter, filename)
+        else:
+            self._translate(command_type, arg_1, arg_2, counter, filename)
+
+    def _translate(self, command_type, arg_1, arg_2, counter, filename) -> None:
         if command_type == 'C_ARITHMETIC':
             self.write_arithmetic(arg_1, counter)
         elif command_type in {'C_PUSH', 'C_POP'}:
             self.write_push_pop(command_type, arg_1, arg_2, filename)
 
+    def flush(self) -> None:
+        """
+        Write out everything buffered by the emission engine.
+        """
+        if self.buffered:
+            self.fp.flush()
+
     def write_push_pop(self, command_type, segment, index, filename) -> None:
         """
         Translate commands for PUSH/POP operations.
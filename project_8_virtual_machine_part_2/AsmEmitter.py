@@ -0,0 +1,96 @@
+from itertools import accumulate, repeat
+from operator import sub
+
+
+class AsmEmitter(list):
+    """
+    Buffered emission engine for the assembly produced by the Translator.
+
+    The emitter is used in place of the output file: every
+    'fp.write(line)' of the translator is a plain list.append (no Python
+    level call), and the collected lines are written to the real output
+    in large chunks.
+
+    The text of commands which always translate to the same assembly
+    (e.g. 'push local 2') is rendered once and kept in a template
+    cache; subsequent occurrences append the whole pre-formatted
+    block at once.
+
+    Attributes
+    ----------
+    target        :: TextWrapper
+                     reference to the real output file.
+    chunk_size    :: int
+                     number of buffered pieces which triggers a flush.
+    source_map    :: SourceMap
+                     map receiving the ROM range of every marked
+                     command (None when not mapping).
+    """
+
+    write = list.append
+
+    def __init__(self, target, chunk_size=8192, source_map=None):
+        super().__init__()
+        self.target = target
+        self.chunk_size = chunk_size
+        self.source_map = source_map
+        # (buffer position, entry) of the commands started since the
+        # last flush; 'entry' is the one code is currently added to
+        self.marks = []
+        self.entry = ('', 0, '', '')
+
+    def mark(self, entry) -> None:
+        """
+        Attribute everything written from now on to the source map
+        entry 'entry'.
+        """
+        self.marks.append((len(self), entry))
+
+    def emit(self, templates, key, render, *args) -> None:
+        """
+        Append the text cached in 'templates' under 'key'; on a miss
+        call render(*args) and cache what it wrote. Pass key=None
+        for commands which cannot be cached.
+        """
+        if key is None:
+            render(*args)
+        else:
+            text = templates.get(key)
+            if text is None:
+                start = len(self)
+                render(*args)
+                text = ''.join(self[start:])
+                del self[start:]
+                templates[key] = text
+            self.append(text)
+        if len(self) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all buffered text to the real output file.
+        """
+        if self.source_map is not None:
+            self._map()
+        if self:
+            self.target.write(''.join(self))
+            self.clear()
+
+    def _map(self) -> None:
+        """
+        Add the ROM ranges of the buffered commands to the source map;
+        label lines take no ROM word.
+        """
+        # instructions in the buffer before every piece
+        offsets = [0]
+        offsets.extend(accumulate(map(sub, map(str.count, self, repeat('\n')),
+                                      map(str.count, self, repeat('(')))))
+        add = self.source_map.add
+        start = 0
+        for end, entry in self.marks + [(len(self), None)]:
+            if end > start:
+                add(offsets[end] - offsets[start], self.entry)
+            start = end
+            if entry is not None:
+                self.entry = entry
+        self.marks.clear()
@@ -0,0 +1,244 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from CPUEmulator import CPUEmulator
+from HackAssembler import HackAssembler
+from VMTranslator import Parser, translator_version
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS = os.path.join(DIRECTORY, 'benchmarks')
+BASELINE = os.path.join(BENCHMARKS, 'baseline.json')
+COMPILER = os.path.join(DIRECTORY, '..', 'project_11_compiler')
+APPLICATION = os.path.join(DIRECTORY, '..', 'project_9_jack_application')
+
+# program -> RAM words expected after running it; None for programs
+# which need the Jack OS and are therefore translated, not emulated
+CORPUS = {
+    'Loop': {6: 26960},
+    'Fibonacci': {6: 2584},
+    'Arrays': {6: 2080, 3000: 1, 3063: 64},
+    'Compare': {5: -1, 6: 0, 7: 0, 8: -1, 9: -1, 10: -1, 11: -1, 12: 1},
+    'TicTacToe': None,
+}
+# translator options recorded in (and restored from) a baseline
+OPTIONS = ('shared_frames', 'shared_compare', 'top_of_stack', 'prologue',
+           'peephole', 'optimize', 'fuse_moves', 'simplify_jumps',
+           'fuse_branches', 'superinstructions', 'tail_calls', 'inline',
+           'eliminate_dead')
+# metrics compared by 'compare'; lower is better for all of them
+METRICS = ('instructions', 'cycles', 'translate_seconds')
+MAX_CYCLES = 50_000_000
+# translation time differences below this many seconds are noise
+TIME_FLOOR = 0.001
+
+
+def compile_application(target) -> str:
+    """
+    Compile the Jack application of project 9 with the compiler of
+    project 11 into 'target'; return the directory of the .vm files.
+    """
+    source = os.path.join(target, 'TicTacToe')
+    shutil.copytree(APPLICATION, source)
+    subprocess.run([sys.executable, 'JackCompiler.py', source],
+                   cwd=COMPILER, check=True, stdout=subprocess.DEVNULL)
+    return source
+
+
+def translate(source, target, options) -> float:
+    """
+    Translate the program 'source' into 'target'; return the elapsed
+    time in seconds. The translator reports are discarded.
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with Parser(source, output=target, bootstrap=True,
+                    **options) as vmtranslator:
+            vmtranslator.parse()
+    return time.perf_counter() - start
+
+
+def measure(name, source, workdir, options, repeat) -> dict:
+    """
+    Return the metrics of a single program: emitted instructions,
+    best translation time of 'repeat' runs and emulated cycles.
+    """
+    target = os.path.join(workdir, f'{name}.asm')
+    seconds = min(translate(source, target, options) for _ in range(repeat))
+    with open(target, 'rt') as fp:
+        rom = HackAssembler().assemble(fp.read().splitlines())
+    result = {'instructions': len(rom), 'cycles': None,
+              'translate_seconds': round(seconds, 6)}
+    expected = CORPUS[name]
+    if expected is None:
+        return result
+    emulator = CPUEmulator(rom)
+    result['cycles'] = emulator.run(MAX_CYCLES)
+    if not emulator.halted:
+        raise RuntimeError(f'{name}: no halt after {MAX_CYCLES} cycles')
+    for address, value in expected.items():
+        if emulator.peek(address) != value:
+            raise RuntimeError(f'{name}: RAM[{address}] = '
+                               f'{emulator.peek(address)}, expected {value}')
+    return result
+
+
+def run(options, repeat=3) -> dict:
+    """
+    Measure every program of the corpus; return the baseline record.
+    """
+    programs = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in CORPUS:
+            if name == 'TicTacToe':
+                source = compile_application(workdir)
+            else:
+                source = os.path.join(BENCHMARKS, name)
+            programs[name] = measure(name, source, workdir, options, repeat)
+    return {
+        'translator': translator_version(),
+        'python': platform.python_version(),
+        'options': options,
+        'programs': programs,
+    }
+
+
+def report(record) -> None:
+    print(f'{"program":<12}{"instructions":>14}{"cycles":>12}'
+          f'{"translate":>12}')
+    for name, metrics in record['programs'].items():
+        cycles = metrics['cycles']
+        print(f'{name:<12}{metrics["instructions"]:>14}'
+              f'{"-" if cycles is None else cycles:>12}'
+              f'{metrics["translate_seconds"] * 1000:>10.1f}ms')
+
+
+def compare(baseline, current, threshold, time_threshold) -> list:
+    """
+    Print the change of every metric between two records; return the
+    (program, metric) pairs which grew by more than the threshold
+    (in percent; translation time uses the separate, looser
+    time_threshold since it depends on the machine).
+    """
+    if baseline['options'] != current['options']:
+        print(f'note: options differ: {baseline["options"]} -> '
+              f'{current["options"]}')
+    regressions = []
+    print(f'{"program":<12}{"metric":<19}{"baseline":>12}{"current":>12}'
+          f'{"change":>9}')
+    for name, metrics in baseline['programs'].items():
+        for metric in METRICS:
+            old = metrics.get(metric)
+            new = current['programs'].get(name, {}).get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            limit = threshold
+            if metric == 'translate_seconds':
+                limit = time_threshold
+                if new - old < TIME_FLOOR:
+                    change = min(change, 0.0)
+            flag = ''
+            if change > limit:
+                flag = '  REGRESSION'
+                regressions.append((name, metric))
+            elif change < 0:
+                flag = '  improved'
+            print(f'{name:<12}{metric:<19}{old:>12}{new:>12}'
+                  f'{change:>+8.1f}%{flag}')
+    return regressions
+
+
+def main():
+    """
+    Benchmark the code generated by the VM translator on a corpus of
+    VM programs, write the results as a JSON baseline and compare
+    later runs against it.
+
+    run      measure the corpus (optionally writing the baseline)
+    compare  measure the corpus with the options of a baseline (or
+             load a second result file) and flag regressions; exits
+             with status 1 when there are any
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog='Benchmark',
+        description='Measure instruction counts, translation time and '
+                    'emulated cycles of the VM translator output.')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='measure the corpus')
+    run_parser.add_argument('-o', '--output', metavar='FILE',
+                            help='write the results to FILE (e.g. '
+                                 'benchmarks/baseline.json)')
+    run_parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                            help='translate every program N times and keep '
+                                 'the best time (default: 3)')
+    run_parser.add_argument('--shared-frames', action='store_true')
+    run_parser.add_argument('--shared-compare', action='store_true')
+    run_parser.add_argument('--top-of-stack', action='store_true')
+    run_parser.add_argument('--prologue', choices=('speed', 'size'))
+    run_parser.add_argument('--peephole', action='store_true')
+    run_parser.add_argument('--optimize', action='store_true')
+    run_parser.add_argument('--fuse-moves', action='store_true')
+    run_parser.add_argument('--simplify-jumps', action='store_true')
+    run_parser.add_argument('--fuse-branches', action='store_true')
+    run_parser.add_argument('--superinstructions', action='store_true')
+    run_parser.add_argument('--tail-calls', action='store_true')
+    run_parser.add_argument('--inline', type=int, default=0, metavar='N')
+    run_parser.add_argument('--eliminate-dead', action='store_true')
+
+    compare_parser = commands.add_parser(
+        'compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline', nargs='?', default=BASELINE,
+                                help='baseline file (default: '
+                                     'benchmarks/baseline.json)')
+    compare_parser.add_argument('current', nargs='?',
+                                help='results to compare (default: measure '
+                                     'now with the options of the baseline)')
+    compare_parser.add_argument('--repeat', type=int, default=3, metavar='N')
+    compare_parser.add_argument('--threshold', type=float, default=1.0,
+                                metavar='PCT',
+                                help='allowed growth of instructions and '
+                                     'cycles in percent (default: 1)')
+    compare_parser.add_argument('--time-threshold', type=float, default=25.0,
+                                metavar='PCT',
+                                help='allowed growth of the translation time '
+                                     'in percent (default: 25)')
+    args = arg_parser.parse_args()
+
+    if args.command == 'run':
+        options = {option: getattr(args, option) for option in OPTIONS}
+        record = run(options, args.repeat)
+        report(record)
+        if args.output:
+            with open(args.output, 'wt') as fp:
+                json.dump(record, fp, indent=2)
+                fp.write('\n')
+        return
+
+    with open(args.baseline, 'rt') as fp:
+        baseline = json.load(fp)
+    if args.current:
+        with open(args.current, 'rt') as fp:
+            current = json.load(fp)
+    else:
+        current = run(baseline['options'], args.repeat)
+    regressions = compare(baseline, current, args.threshold,
+                          args.time_threshold)
+    if regressions:
+        print(f'{len(regressions)} regression(s)')
+        sys.exit(1)
+    print('no regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import argparse
+import itertools
+import time
+
+from HackAssembler import HackAssembler
+
+
+class Halt(Exception):
+    """
+    Raised when the emulated program stops (halt loop, end of the ROM,
+    Sys.halt, ...); the argument tells why.
+    """
+
+
+class CPUEmulator:
+    """
+    Hack CPU emulator for running the output of the translator.
+
+    Every distinct machine word is decoded once into a small Python
+    function (generated source compiled in one go) which executes the
+    instruction and returns the next program counter; the ROM becomes
+    a dispatch table of these functions indexed by address, so running
+    a cycle is a single indexed call:
+
+        pc = code[pc](pc)
+
+    Registers live in closure cells shared by all instruction functions;
+    RAM is a plain list of unsigned 16-bit values.
+
+    The standard halt loop '(END) @END 0;JMP' and addresses outside of
+    the program stop the emulation.
+
+    Attributes
+    ----------
+    rom           :: list
+                     machine words of the program.
+    ram           :: list
+                     RAM contents (unsigned 16-bit values).
+    pc            :: int
+                     program counter.
+    cycles        :: int
+                     number of instructions executed so far.
+    halted        :: bool
+                     True once the program reached its halt loop.
+    """
+
+    # A is a 16-bit register; RAM covers every address it can hold
+    RAM_SIZE = 0x10000
+    ROM_SIZE = 32768
+    # machine word of '0;JMP'
+    JMP = 0b1110101010000111
+
+    # comp mnemonic -> expression over the unsigned 16-bit A, D and M
+    EXPRESSIONS = {
+        '0': '0',
+        '1': '1',
+        '-1': '0xFFFF',
+        'D': 'D',
+        'A': 'A',
+        '!D': 'D ^ 0xFFFF',
+        '!A': 'A ^ 0xFFFF',
+        '-D': '-D & 0xFFFF',
+        '-A': '-A & 0xFFFF',
+        'D+1': '(D + 1) & 0xFFFF',
+        'A+1': '(A + 1) & 0xFFFF',
+        'D-1': '(D - 1) & 0xFFFF',
+        'A-1': '(A - 1) & 0xFFFF',
+        'D+A': '(D + A) & 0xFFFF',
+        'D-A': '(D - A) & 0xFFFF',
+        'A-D': '(A - D) & 0xFFFF',
+        'D&A': 'D & A',
+        'D|A': 'D | A',
+    }
+    # jump bits -> condition on the unsigned result 'v'
+    CONDITIONS = {
+        1: '0 < v < 0x8000',
+        2: 'v == 0',
+        3: 'v < 0x8000',
+        4: 'v >= 0x8000',
+        5: 'v != 0',
+        6: 'v == 0 or v >= 0x8000',
+        7: 'True',
+    }
+
+    def __init__(self, rom):
+        self.rom = list(rom)
+        if len(self.rom) > self.ROM_SIZE:
+            raise ValueError(f'program does not fit into ROM: '
+                             f'{len(self.rom)} words')
+        self.ram = [0] * self.RAM_SIZE
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        self.code, self._registers = self._decode()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return an emulator running the .asm or .hack file 'path', or
+        the .bin file of packed big-endian words written by
+        'VMTranslator --emit hack --packed'.
+        """
+        if path.endswith('.bin'):
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            return cls(int.from_bytes(data[position:position + 2], 'big')
+                       for position in range(0, len(data), 2))
+        with open(path, 'rt') as fp:
+            lines = fp.read().splitlines()
+        if path.endswith('.hack'):
+            return cls(int(line, 2) for line in map(str.strip, lines) if line)
+        return cls(HackAssembler().assemble(lines))
+
+    def run(self, max_cycles=None) -> int:
+        """
+        Execute at most 'max_cycles' instructions (no limit with None)
+        or until the program halts; return the number executed.
+        """
+        code = self.code
+        pc = self.pc
+        steps = itertools.count() if max_cycles is None else range(max_cycles)
+        cycle = -1
+        try:
+            for cycle in steps:
+                pc = code[pc](pc)
+            cycle += 1
+        except Halt:
+            self.halted = True
+        self.pc = pc
+        self.cycles += cycle
+        return cycle
+
+    @property
+    def registers(self) -> tuple:
+        """
+        Current (A, D) register values.
+        """
+        return self._registers()
+
+    def peek(self, address) -> int:
+        """
+        Return RAM[address] as a signed 16-bit value.
+        """
+        value = self.ram[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+    def poke(self, address, value) -> None:
+        """
+        Store a (signed or unsigned) 16-bit value in RAM[address].
+        """
+        self.ram[address] = value & 0xFFFF
+
+    def _decode(self):
+        """
+        Compile one function per distinct machine word; return the
+        dispatch table and a function reading the registers.
+        """
+        words = sorted(set(self.rom))
+        source = ['def build(ram, Halt):',
+                  '    A = 0',
+                  '    D = 0',
+                  '    def halt(pc):',
+                  '        raise Halt',
+                  '    def registers():',
+                  '        return A, D']
+        for word in words:
+            source.extend(f'    {line}' for line in self._compile(word))
+        source.append('    return {%s}, halt, registers' % ', '.join(
+            f'{word}: op_{word}' for word in words))
+        namespace = {}
+        exec(compile('\n'.join(source), '<hack rom>', 'exec'), namespace)
+        ops, halt, registers = namespace['build'](self.ram, Halt)
+
+        code = [ops[word] for word in self.rom]
+        for address, word in enumerate(self.rom[:-1]):
+            if word == address and self.rom[address + 1] == self.JMP:
+                code[address] = halt
+        # A (and hence a jump target) may hold any 16-bit value
+        code.extend([halt] * (0x10000 - len(code)))
+        return code, registers
+
+    def _compile(self, word) -> list:
+        """
+        Return the source lines of the function executing 'word'.
+        """
+        lines = [f'def op_{word}(pc):']
+        if not word & 0x8000:
+            lines.append('    nonlocal A')
+            lines.append(f'    A = {word}')
+            lines.append('    return pc + 1')
+            return lines
+        comp = (word >> 6) & 0x7F
+        dest = (word >> 3) & 0x7
+        jump = word & 0x7
+        mnemonic = self._mnemonic(comp)
+        expression = self.EXPRESSIONS[mnemonic.replace('M', 'A')]
+        if 'M' in mnemonic:
+            expression = expression.replace('A', 'M')
+        names = [name for bit, name in ((4, 'A'), (2, 'D')) if dest & bit]
+        if names:
+            lines.append(f'    nonlocal {", ".join(names)}')
+        if 'M' in mnemonic:
+            lines.append('    M = ram[A]')
+        lines.append(f'    v = {expression}')
+        target = 'A'
+        if dest & 4 and jump:
+            # the jump goes to the address held by A before this cycle
+            lines.append('    a = A')
+            target = 'a'
+        if dest & 1:
+            lines.append('    ram[A] = v')
+        if dest & 2:
+            lines.append('    D = v')
+        if dest & 4:
+            lines.append('    A = v')
+        if jump:
+            lines.append(f'    if {self.CONDITIONS[jump]}:')
+            lines.append(f'        return {target}')
+        lines.append('    return pc + 1')
+        return lines
+
+    @staticmethod
+    def _mnemonic(comp) -> str:
+        """
+        Return the canonical mnemonic of the comp bits.
+        """
+        for mnemonic, bits in HackAssembler.COMP.items():
+            if int(bits, 2) == comp:
+                return mnemonic
+        raise ValueError(f'invalid comp bits: {comp:07b}')
+
+
+def main():
+    """
+    Run a .asm/.hack program and report the cycle count and RAM state.
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog='CPUEmulator',
+        description='Run Hack programs produced by the VM translator.')
+    arg_parser.add_argument('program',
+                            help='<program.asm>/<program.hack>/<program.bin>')
+    arg_parser.add_argument('--cycles', type=int, metavar='N',
+                            help='stop after N instructions '
+                                 '(default: run until the halt loop)')
+    arg_parser.add_argument('--set', action='append', default=[],
+                            metavar='ADDRESS=VALUE',
+                            help='initialize a RAM word before running')
+    arg_parser.add_argument('--ram', action='append', default=[],
+                            metavar='START[:END]',
+                            help='RAM words to print after running')
+    args = arg_parser.parse_args()
+
+    emulator = CPUEmulator.load(args.program)
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        emulator.poke(int(address), int(value))
+
+    start = time.perf_counter()
+    cycles = emulator.run(args.cycles)
+    elapsed = time.perf_counter() - start
+
+    state = 'halted' if emulator.halted else 'cycle limit reached'
+    print(f'cycles: {cycles} ({state}, pc={emulator.pc})')
+    print(f'time: {elapsed:.3f}s ({cycles / max(elapsed, 1e-9) / 1e6:.2f} '
+          f'million instructions/s)')
+    a, d = emulator.registers
+    print(f'A={a} D={d}')
+    for address, name in enumerate(('SP', 'LCL', 'ARG', 'THIS', 'THAT')):
+        print(f'RAM[{address}] {name} = {emulator.peek(address)}')
+    stack_pointer = emulator.peek(0)
+    if 256 < stack_pointer <= 2048:
+        stack = [emulator.peek(address)
+                 for address in range(256, min(stack_pointer, 256 + 32))]
+        print(f'RAM[256:{stack_pointer}] stack = {stack}')
+    for span in args.ram:
+        start, _, end = span.partition(':')
+        start = int(start)
+        end = int(end) if end else start + 1
+        for address in range(start, end):
+            print(f'RAM[{address}] = {emulator.peek(address)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import json
+
+from CPUEmulator import CPUEmulator
+from VMCommand import Opcode
+
+
+class CallCounters:
+    """
+    RAM layout of the call counters of a program translated with
+    --profile, and decoder of the counts it leaves in memory.
+
+    Every function of the index owns WORDS consecutive RAM words from
+    base + WORDS * position on: a 32-bit count of the times it was
+    entered (incremented by its 'function' prologue) and a 32-bit count
+    of the calls made to it (incremented at every 'call' site, so it
+    also counts functions the program does not define, e.g. those of a
+    built-in OS). Counters are stored low word first.
+
+    The index is written next to the program as JSON, so the counters
+    can be decoded from the RAM of any Hack emulator.
+
+    Attributes
+    ----------
+    functions     :: tuple
+                     names of the counted functions, in index order.
+    base          :: int
+                     RAM address of the first counter.
+    positions     :: dict
+                     function name -> position in the index.
+    """
+
+    VERSION = 1
+    WORDS = 4
+    # by default the counters take the top of the heap, which the Jack
+    # OS allocates last
+    HEAP_END = 16384
+
+    def __init__(self, functions, base=None):
+        self.functions = tuple(functions)
+        if base is None:
+            base = self.HEAP_END - self.WORDS * len(self.functions)
+        self.base = base
+        self.positions = {name: position
+                          for position, name in enumerate(self.functions)}
+
+    @classmethod
+    def from_commands(cls, commands, base=None):
+        """
+        Return the counters of every function defined or called by
+        'commands', in sorted order.
+        """
+        names = set()
+        for opcode, arg_1, _ in commands:
+            if opcode in (Opcode.FUNCTION, Opcode.CALL):
+                names.add(arg_1)
+        return cls(sorted(names), base)
+
+    @property
+    def size(self) -> int:
+        """
+        Number of RAM words taken by the counters.
+        """
+        return self.WORDS * len(self.functions)
+
+    def entries(self, name) -> int:
+        """
+        Return the address of the entry counter of 'name'.
+        """
+        return self.base + self.WORDS * self.positions[name]
+
+    def calls(self, name) -> int:
+        """
+        Return the address of the call counter of 'name'.
+        """
+        return self.entries(name) + 2
+
+    def decode(self, words) -> list:
+        """
+        Return (name, entries, calls) of every function from the RAM
+        words of the counter region (signed or unsigned values).
+        """
+        words = [word & 0xFFFF for word in words]
+        if len(words) < self.size:
+            raise ValueError(f'{self.size} counter words needed, '
+                             f'got {len(words)}')
+        counts = []
+        for position, name in enumerate(self.functions):
+            low = self.WORDS * position
+            counts.append((name,
+                           words[low] | words[low + 1] << 16,
+                           words[low + 2] | words[low + 3] << 16))
+        return counts
+
+    def save(self, path) -> None:
+        """
+        Write the function index as JSON.
+        """
+        with open(path, 'wt') as fp:
+            json.dump({'version': self.VERSION, 'base': self.base,
+                       'words': self.WORDS,
+                       'functions': list(self.functions)}, fp, indent=1)
+            fp.write('\n')
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save().
+        """
+        with open(path, 'rt') as fp:
+            data = json.load(fp)
+        if data['version'] != cls.VERSION or data['words'] != cls.WORDS:
+            raise ValueError(f'unsupported counter index: version '
+                             f'{data["version"]}, {data["words"]} words')
+        return cls(data['functions'], data['base'])
+
+
+def report(counts, limit=None) -> None:
+    """
+    Print the counts of the called functions, most entered first.
+    """
+    counts = sorted((count for count in counts if count[1] or count[2]),
+                    key=lambda count: (-count[1], -count[2], count[0]))
+    total = sum(entries for _, entries, _ in counts) or 1
+    print(f'{"function":<40}{"entries":>12}{"calls":>12}{"share":>8}')
+    for name, entries, calls in counts[:limit]:
+        print(f'{name:<40}{entries:>12}{calls:>12}'
+              f'{entries / total * 100:>7.1f}%')
+
+
+def main():
+    """
+    Decode the call counters of a program translated with --profile,
+    either by running it on the CPUEmulator or from a RAM dump.
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog='CallCounters',
+        description='Report the call counts of an instrumented program.')
+    arg_parser.add_argument('index', help='<program.counters.json>')
+    source = arg_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--run', metavar='PROGRAM',
+                        help='run the .asm/.hack/.bin program on the '
+                             'CPUEmulator and read its RAM')
+    source.add_argument('--dump', metavar='FILE',
+                        help='file of RAM words (one per line) starting '
+                             'at the base address of the index')
+    arg_parser.add_argument('--cycles', type=int, metavar='N',
+                            help='with --run, stop after N instructions')
+    arg_parser.add_argument('--top', type=int, metavar='N',
+                            help='only print the N most entered functions')
+    args = arg_parser.parse_args()
+
+    counters = CallCounters.load(args.index)
+    if args.run:
+        emulator = CPUEmulator.load(args.run)
+        cycles = emulator.run(args.cycles)
+        state = 'halted' if emulator.halted else 'cycle limit reached'
+        print(f'cycles: {cycles} ({state})')
+        words = emulator.ram[counters.base:counters.base + counters.size]
+    else:
+        with open(args.dump, 'rt') as fp:
+            words = [int(word) for word in fp.read().split()]
+    report(counters.decode(words), args.top)
+
+
+if __name__ == '__main__':
+    main()
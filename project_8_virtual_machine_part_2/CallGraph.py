@@ -0,0 +1,69 @@
+from VMCommand import Opcode
+
+
+class CallGraph:
+    """
+    Whole-program call graph of the VM functions.
+
+    Built from the 'function' / 'call' commands of every file of the
+    program; used to find the functions which can never run because no
+    chain of calls leads to them from the entry point (Sys.init).
+
+    Attributes
+    ----------
+    calls         :: dict
+                     function name -> set of called function names.
+    files         :: dict
+                     function name -> file defining the function.
+    """
+
+    ENTRY_POINT = 'Sys.init'
+
+    def __init__(self):
+        self.calls = {}
+        self.files = {}
+
+    def add_file(self, file_, commands) -> None:
+        """
+        Record the functions defined in 'file_' and the calls they make.
+        """
+        callees = None
+        for command in commands:
+            if command.opcode == Opcode.FUNCTION:
+                callees = self.calls.setdefault(command.arg_1, set())
+                self.files[command.arg_1] = file_
+            elif command.opcode == Opcode.CALL and callees is not None:
+                callees.add(command.arg_1)
+
+    def reachable(self, root=ENTRY_POINT) -> set:
+        """
+        Return the names of all functions reachable from 'root'.
+        """
+        seen = {root}
+        stack = [root]
+        while stack:
+            for callee in self.calls.get(stack.pop(), ()):
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.append(callee)
+        return seen
+
+    def dead(self, root=ENTRY_POINT) -> set:
+        """
+        Return the names of the defined functions unreachable from 'root'.
+        """
+        return set(self.calls) - self.reachable(root)
+
+    @staticmethod
+    def select(commands, names, keep=True):
+        """
+        Yield the commands of the functions in 'names' (keep=True)
+        or of all the other functions (keep=False). Commands preceding
+        the first 'function' command are kept only with keep=False.
+        """
+        selected = not keep
+        for command in commands:
+            if command.opcode == Opcode.FUNCTION:
+                selected = (command.arg_1 in names) == keep
+            if selected:
+                yield command
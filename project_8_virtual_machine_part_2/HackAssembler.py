@@ -0,0 +1,277 @@
+from array import array
+import sys
+
+
+class HackAssembler:
+    """
+    Two-pass assembler translating Hack assembly into 16-bit
+    machine words.
+
+    The first pass (feed) records the ROM address of every label and
+    encodes every instruction which does not refer to a symbol; the
+    second one (finish) resolves the symbols and allocates RAM (from
+    address 16 on) for every symbol which is not a label. Lines are
+    encoded once: repeated lines are looked up in a cache.
+
+    Attributes
+    ----------
+    symbols       :: dict
+                     symbol -> address (predefined symbols, labels
+                     and variables).
+    variables     :: list
+                     variable names in allocation order.
+    instructions  :: list
+                     machine words, or symbols still to be resolved,
+                     of the instructions fed so far.
+    """
+
+    PREDEFINED = {
+        'SP': 0,
+        'LCL': 1,
+        'ARG': 2,
+        'THIS': 3,
+        'THAT': 4,
+        'SCREEN': 16384,
+        'KBD': 24576,
+        **{f'R{register}': register for register in range(16)},
+    }
+    # first RAM address given to variables
+    VARIABLE_BASE = 16
+
+    # comp mnemonic -> a-bit + c1..c6
+    COMP = {
+        '0': '0101010',
+        '1': '0111111',
+        '-1': '0111010',
+        'D': '0001100',
+        'A': '0110000',
+        '!D': '0001101',
+        '!A': '0110001',
+        '-D': '0001111',
+        '-A': '0110011',
+        'D+1': '0011111',
+        'A+1': '0110111',
+        'D-1': '0001110',
+        'A-1': '0110010',
+        'D+A': '0000010',
+        'D-A': '0010011',
+        'A-D': '0000111',
+        'D&A': '0000000',
+        'D|A': '0010101',
+        'M': '1110000',
+        '!M': '1110001',
+        '-M': '1110011',
+        'M+1': '1110111',
+        'M-1': '1110010',
+        'D+M': '1000010',
+        'D-M': '1010011',
+        'M-D': '1000111',
+        'D&M': '1000000',
+        'D|M': '1010101',
+    }
+    # commutative spellings accepted as well
+    COMP.update({
+        'A+D': COMP['D+A'],
+        'A&D': COMP['D&A'],
+        'A|D': COMP['D|A'],
+        'M+D': COMP['D+M'],
+        'M&D': COMP['D&M'],
+        'M|D': COMP['D|M'],
+    })
+    JUMP = {
+        '': 0,
+        'JGT': 1,
+        'JEQ': 2,
+        'JGE': 3,
+        'JLT': 4,
+        'JNE': 5,
+        'JLE': 6,
+        'JMP': 7,
+    }
+
+    def __init__(self):
+        self.symbols = dict(self.PREDEFINED)
+        self.variables = []
+        self.instructions = []
+        # line -> machine word; lines referring to a symbol map to
+        # WORDS + the position of the symbol in 'references'
+        self.cache = {}
+        self.references = []
+
+    # number of distinct machine words
+    WORDS = 0x10000
+    # lines looked up at once by feed
+    CHUNK = 4096
+
+    def assemble(self, lines) -> list:
+        """
+        Return the machine words of the assembly 'lines'.
+        """
+        self.feed(lines)
+        return self.finish()
+
+    def feed(self, lines) -> None:
+        """
+        First pass over more assembly 'lines'.
+
+        Known lines are looked up all at once; only the first occurrence
+        of a line and label declarations are handled one by one.
+        """
+        if not isinstance(lines, list):
+            lines = list(lines)
+        if len(lines) > self.CHUNK:
+            # new lines only become known to the cache chunk by chunk
+            for start in range(0, len(lines), self.CHUNK):
+                self.feed(lines[start:start + self.CHUNK])
+            return
+        cache = self.cache
+        instructions = self.instructions
+        words = list(map(cache.get, lines))
+        start = 0
+        while True:
+            try:
+                position = words.index(None, start)
+            except ValueError:
+                break
+            instructions.extend(words[start:position])
+            start = position + 1
+            line = lines[position]
+            instruction = line.split('//')[0].strip()
+            if not instruction:
+                continue
+            if instruction.startswith('('):
+                self.symbols[instruction[1:-1]] = len(instructions)
+                continue
+            if instruction.startswith('@') and not instruction[1:].isdigit():
+                word = self.WORDS + len(self.references)
+                self.references.append(instruction[1:])
+            else:
+                word = self.encode(instruction)
+            cache[line] = word
+            instructions.append(word)
+        instructions.extend(words[start:])
+
+    def finish(self) -> list:
+        """
+        Second pass: return the machine words of everything fed so far.
+
+        Symbols are resolved in order of first appearance, so variables
+        are allocated in the same order as by a line-by-line pass.
+        """
+        table = list(range(self.WORDS))
+        table.extend(map(self.address, self.references))
+        return list(map(table.__getitem__, self.instructions))
+
+    def address(self, symbol) -> int:
+        """
+        Return the address of 'symbol'; unknown symbols become
+        variables.
+        """
+        address = self.symbols.get(symbol)
+        if address is None:
+            address = self.VARIABLE_BASE + len(self.variables)
+            self.symbols[symbol] = address
+            self.variables.append(symbol)
+        return address
+
+    def encode(self, instruction) -> int:
+        """
+        Return the machine word of a single instruction; labels must
+        be known already, unknown symbols become variables.
+        """
+        if instruction.startswith('@'):
+            value = instruction[1:]
+            if value.isdigit():
+                return int(value)
+            return self.address(value)
+        dest = ''
+        jump = ''
+        comp = instruction
+        if '=' in comp:
+            dest, comp = comp.split('=', 1)
+        if ';' in comp:
+            comp, jump = comp.split(';', 1)
+        try:
+            bits = int(self.COMP[comp], 2)
+            jump = self.JUMP[jump]
+        except KeyError:
+            raise ValueError(f'invalid instruction: {instruction}') from None
+        dest = ((4 if 'A' in dest else 0) | (2 if 'D' in dest else 0)
+                | (1 if 'M' in dest else 0))
+        return 0b111 << 13 | bits << 6 | dest << 3 | jump
+
+
+class HackWriter:
+    """
+    File-like sink assembling the text written into it, used in place
+    of the .asm output file by 'VMTranslator --emit hack'.
+
+    The translator output is fed to a HackAssembler as it is written;
+    once the program is complete, finish() resolves the symbols and
+    writes the machine words either as binary text (one 16-bit word
+    per line, the .hack format) or packed into big-endian 16-bit words.
+
+    Attributes
+    ----------
+    fp            :: TextWrapper / BufferedWriter
+                     reference to the real output file (binary mode
+                     when packed).
+    packed        :: bool
+                     write packed 16-bit words instead of binary text.
+    assembler     :: HackAssembler
+                     assembler collecting the program.
+    words         :: list
+                     machine words, once finish() was called.
+    """
+
+    # size of the instruction memory of the Hack computer
+    ROM_SIZE = 32768
+
+    def __init__(self, fp, packed=False):
+        self.fp = fp
+        self.packed = packed
+        self.assembler = HackAssembler()
+        self.pending = ''
+        self.words = None
+
+    def write(self, text: str) -> None:
+        """
+        Feed one or more lines of assembly.
+        """
+        lines = (self.pending + text).split('\n')
+        self.pending = lines.pop()
+        self.assembler.feed(lines)
+
+    def flush(self) -> None:
+        """
+        Nothing can be written before all labels are known.
+        """
+
+    def finish(self) -> None:
+        """
+        Resolve the symbols and write the machine words.
+        """
+        self.assembler.feed((self.pending,))
+        self.pending = ''
+        self.words = self.assembler.finish()
+        if self.packed:
+            words = array('H', self.words)
+            if sys.byteorder == 'little':
+                words.byteswap()
+            self.fp.write(words.tobytes())
+        else:
+            text = {word: f'{word:016b}\n' for word in set(self.words)}
+            self.fp.write(''.join(map(text.__getitem__, self.words)))
+
+    def report(self) -> None:
+        """
+        Print the ROM and variable RAM footprint of the program.
+        """
+        rom = len(self.words)
+        variables = len(self.assembler.variables)
+        print(f'hack: {rom} ROM words ({rom / self.ROM_SIZE:.1%} of '
+              f'{self.ROM_SIZE}), {variables} variables in RAM '
+              f'[{HackAssembler.VARIABLE_BASE}, '
+              f'{HackAssembler.VARIABLE_BASE + variables})')
+        if rom > self.ROM_SIZE:
+            print('hack: warning: program does not fit into ROM')
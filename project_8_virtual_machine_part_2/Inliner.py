@@ -0,0 +1,245 @@
+from VMCommand import Opcode, Segment, Command
+
+
+class Inliner:
+    """
+    Inlining stage sitting between the Parser and the Translator.
+
+    Calls to small functions are replaced with the body of the function,
+    so that the frame protocol of 'call' / 'return' is not executed.
+    The inlined body keeps working on the caller's stack: arguments are
+    the entries pushed before the call, locals are pushed on top of them
+    and every argument/local access is remapped to a Segment.STACK entry
+    at a statically known distance from SP. 'return' becomes an
+    INLINE_RETURN which moves the result over the first argument.
+
+    THIS/THAT are saved on the stack and restored on return when the
+    body changes them. Labels are renamed per call site, so several
+    copies of a body can live in the same caller.
+
+    A function is inlined only if its body has at most 'threshold'
+    commands and the stack depth is known at every command (jumps agree
+    on the depth at their target, nothing is popped below the arguments
+    and no path falls off the end of the body).
+
+    Attributes
+    ----------
+    threshold     :: int
+                     largest number of commands of an inlined body.
+    functions     :: dict
+                     function name -> analysed body (see _analyse).
+    inlined       :: dict
+                     function name -> number of inlined call sites.
+    """
+
+    # stack depth change of the commands allowed in an inlined body
+    DEPTH = {
+        Opcode.ADD: -1, Opcode.SUB: -1, Opcode.NEG: 0, Opcode.EQ: -1,
+        Opcode.GT: -1, Opcode.LT: -1, Opcode.AND: -1, Opcode.OR: -1,
+        Opcode.NOT: 0, Opcode.PUSH: 1, Opcode.POP: -1, Opcode.LABEL: 0,
+        Opcode.GOTO: 0, Opcode.IF: -1,
+    }
+
+    def __init__(self, threshold=8, functions=()):
+        self.threshold = threshold
+        self.functions = dict(functions)
+        self.inlined = {}
+
+    def add_file(self, file_, commands) -> None:
+        """
+        Record the inlinable functions defined in 'file_'.
+        """
+        function = None
+        body = []
+        for command in commands:
+            if command.opcode == Opcode.FUNCTION:
+                self._add_function(file_, function, body)
+                function = command
+                body = []
+            elif function is not None:
+                body.append(command)
+                if len(body) > self.threshold:
+                    function = None
+        self._add_function(file_, function, body)
+
+    def inline(self, commands, file_):
+        """
+        Yield 'commands' of 'file_' with calls to inlinable functions
+        replaced by the function bodies.
+        """
+        site = 0
+        for command in commands:
+            if command.opcode == Opcode.CALL \
+                    and self._can_inline(command.arg_1, command.arg_2, file_):
+                site += 1
+                self.inlined[command.arg_1] = \
+                    self.inlined.get(command.arg_1, 0) + 1
+                yield from self._expand(command.arg_1, command.arg_2, site)
+            else:
+                yield command
+
+    def merge(self, inlined) -> None:
+        """
+        Add call site counts of another inliner (e.g. from a worker
+        process).
+        """
+        for name, count in inlined.items():
+            self.inlined[name] = self.inlined.get(name, 0) + count
+
+    def glue(self, name) -> list:
+        """
+        Return the commands executed by an inlined call of 'name' on top
+        of the body itself: saving/restoring THIS/THAT and INLINE_RETURN.
+        """
+        (file_, n_locals, body, labels, max_argument, pointers, uses_static,
+         return_depth) = self.functions[name]
+        commands = [Command(Opcode.PUSH, Segment.POINTER, pointer)
+                    for pointer in pointers]
+        saved = len(pointers)
+        commands.extend(self._restore(pointers, n_locals, return_depth))
+        commands.append(Command(Opcode.INLINE_RETURN, '',
+                                max_argument + 1 + saved + n_locals
+                                + return_depth - 1))
+        return commands
+
+    def _add_function(self, file_, function, body) -> None:
+        if function is None or len(body) > self.threshold:
+            return
+        analysis = self._analyse(body)
+        if analysis is not None:
+            self.functions[function.arg_1] = (file_, function.arg_2,
+                                              tuple(body)) + analysis
+
+    def _analyse(self, body):
+        """
+        Follow the stack depth through 'body'. Return (label depths,
+        highest argument index, popped pointers, uses static segment,
+        depth at the first return) or None if the body cannot be inlined.
+        """
+        depth = 0
+        labels = {}
+        jumps = {}
+        max_argument = -1
+        pointers = set()
+        uses_static = False
+        return_depth = None
+        for command in body:
+            opcode, arg_1, arg_2 = command
+            if opcode == Opcode.LABEL:
+                if depth is None:
+                    depth = jumps.get(arg_1)
+                    if depth is None:
+                        return None
+                elif jumps.get(arg_1, depth) != depth:
+                    return None
+                labels[arg_1] = depth
+                continue
+            if depth is None:
+                # unreachable code
+                return None
+            if opcode == Opcode.RETURN:
+                if depth < 1:
+                    return None
+                if return_depth is None:
+                    return_depth = depth
+                depth = None
+                continue
+            if opcode == Opcode.CALL:
+                depth += 1 - arg_2
+            elif opcode in self.DEPTH:
+                depth += self.DEPTH[opcode]
+            else:
+                return None
+            if depth < 0:
+                return None
+            if opcode in (Opcode.GOTO, Opcode.IF):
+                if labels.get(arg_1, depth) != depth \
+                        or jumps.get(arg_1, depth) != depth:
+                    return None
+                jumps[arg_1] = depth
+                if opcode == Opcode.GOTO:
+                    depth = None
+            elif opcode in (Opcode.PUSH, Opcode.POP):
+                if arg_1 == Segment.ARGUMENT:
+                    max_argument = max(max_argument, arg_2)
+                elif arg_1 == Segment.STATIC:
+                    uses_static = True
+                elif arg_1 == Segment.POINTER and opcode == Opcode.POP:
+                    pointers.add(arg_2)
+        if depth is not None or return_depth is None:
+            return None
+        if any(label not in labels for label in jumps):
+            return None
+        return (labels, max_argument, tuple(sorted(pointers)), uses_static,
+                return_depth)
+
+    def _can_inline(self, name, num_args, file_) -> bool:
+        function = self.functions.get(name)
+        if function is None:
+            return False
+        callee_file, _, _, _, max_argument, _, uses_static, _ = function
+        if max_argument >= num_args:
+            return False
+        # static entries belong to the file defining the function
+        return not uses_static or callee_file == file_
+
+    def _expand(self, name, num_args, site) -> list:
+        """
+        Return the body of 'name' remapped for a call site with
+        'num_args' arguments; labels get a per-site prefix.
+        """
+        (file_, n_locals, body, labels, max_argument, pointers, uses_static,
+         return_depth) = self.functions[name]
+        saved = len(pointers)
+        prefix = f'{name}.inline{site}.'
+        commands = [Command(Opcode.PUSH, Segment.POINTER, pointer)
+                    for pointer in pointers]
+        commands.extend(Command(Opcode.PUSH, Segment.CONSTANT, 0)
+                        for _ in range(n_locals))
+        end = False
+        depth = 0
+        for position, command in enumerate(body):
+            opcode, arg_1, arg_2 = command
+            if opcode == Opcode.LABEL:
+                depth = labels[arg_1]
+                commands.append(Command(opcode, prefix + arg_1, ''))
+            elif opcode in (Opcode.GOTO, Opcode.IF):
+                commands.append(Command(opcode, prefix + arg_1, ''))
+            elif opcode == Opcode.RETURN:
+                commands.extend(self._restore(pointers, n_locals, depth))
+                commands.append(Command(Opcode.INLINE_RETURN, '',
+                                        num_args + saved + n_locals
+                                        + depth - 1))
+                if position < len(body) - 1:
+                    commands.append(Command(Opcode.GOTO, prefix + 'END', ''))
+                    end = True
+            elif opcode in (Opcode.PUSH, Opcode.POP) \
+                    and arg_1 in (Segment.ARGUMENT, Segment.LOCAL):
+                # distance of the entry from SP before this command
+                offset = n_locals + depth - arg_2
+                if arg_1 == Segment.ARGUMENT:
+                    offset += num_args + saved
+                commands.append(Command(opcode, Segment.STACK, offset))
+            else:
+                commands.append(command)
+            if opcode == Opcode.CALL:
+                depth += 1 - arg_2
+            elif opcode in self.DEPTH:
+                depth += self.DEPTH[opcode]
+        if end:
+            commands.append(Command(Opcode.LABEL, prefix + 'END', ''))
+        return commands
+
+    @staticmethod
+    def _restore(pointers, n_locals, depth) -> list:
+        """
+        Return commands restoring THIS/THAT saved below the locals;
+        'depth' is the number of entries above the locals.
+        """
+        commands = []
+        saved = len(pointers)
+        for position, pointer in enumerate(pointers):
+            offset = saved - position + n_locals + depth
+            commands.append(Command(Opcode.PUSH, Segment.STACK, offset))
+            commands.append(Command(Opcode.POP, Segment.POINTER, pointer))
+        return commands
@@ -0,0 +1,316 @@
+import math
+
+from CPUEmulator import Halt
+
+
+def wrap(value: int) -> int:
+    """
+    Wrap value to a signed 16-bit integer (Hack word).
+    """
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+class JackOS:
+    """
+    Headless implementation of the Jack OS classes in Python, used by
+    the VMInterpreter for programs which call the OS without providing
+    its .vm files.
+
+    Heap objects (arrays, strings) live in the interpreter RAM with the
+    same layout as in the real OS, so pointers handed to the program
+    behave as usual. Output goes to a 23x64 character grid, Screen
+    draws into the memory-mapped screen and Keyboard reads from a
+    scripted list of keys.
+
+    Attributes
+    ----------
+    ram           :: array
+                     RAM of the interpreter (signed 16-bit words).
+    keys          :: list
+                     pending keyboard input (character codes).
+    text          :: list
+                     rows of the character grid written by Output.
+    functions     :: dict
+                     Jack function name -> Python callable.
+    """
+
+    HEAP_BASE = 2048
+    HEAP_END = 16384
+    SCREEN = 16384
+    ROWS = 23
+    COLUMNS = 64
+    WIDTH = 512
+    HEIGHT = 256
+    # Jack character set codes of the special keys
+    NEWLINE = 128
+    BACKSPACE = 129
+
+    def __init__(self, ram, keys=''):
+        self.ram = ram
+        self.keys = [self.NEWLINE if key == '\n' else ord(key)
+                     for key in keys]
+        self.text = [[' '] * self.COLUMNS for _ in range(self.ROWS)]
+        self.row = 0
+        self.column = 0
+        self.color = True
+        # free heap blocks as (address, size); the size of an allocated
+        # block is kept in the word before it, as in Memory.jack
+        self.free = [(self.HEAP_BASE + 1, self.HEAP_END - self.HEAP_BASE - 1)]
+        self.functions = {
+            'Math.multiply': lambda x, y: wrap(x * y),
+            'Math.divide': self.divide,
+            'Math.min': min,
+            'Math.max': max,
+            'Math.abs': lambda x: wrap(abs(x)),
+            'Math.sqrt': lambda x: math.isqrt(x) if x > 0 else 0,
+            'Memory.peek': lambda address: self.ram[address],
+            'Memory.poke': self.poke,
+            'Memory.alloc': self.alloc,
+            'Memory.deAlloc': self.de_alloc,
+            'Array.new': self.alloc,
+            'Array.dispose': self.de_alloc,
+            'String.new': self.string_new,
+            'String.dispose': self.de_alloc,
+            'String.length': lambda string: self.ram[string + 1],
+            'String.charAt': lambda string, index: self.ram[string + 2 + index],
+            'String.setCharAt': self.string_set_char_at,
+            'String.appendChar': self.string_append_char,
+            'String.eraseLastChar': self.string_erase_last_char,
+            'String.intValue': self.string_int_value,
+            'String.setInt': self.string_set_int,
+            'String.newLine': lambda: self.NEWLINE,
+            'String.backSpace': lambda: self.BACKSPACE,
+            'String.doubleQuote': lambda: 34,
+            'Output.moveCursor': self.move_cursor,
+            'Output.printChar': self.print_char,
+            'Output.printString': self.print_string,
+            'Output.printInt': self.print_int,
+            'Output.println': lambda: self.print_char(self.NEWLINE),
+            'Output.backSpace': lambda: self.print_char(self.BACKSPACE),
+            'Screen.clearScreen': self.clear_screen,
+            'Screen.setColor': self.set_color,
+            'Screen.drawPixel': self.draw_pixel,
+            'Screen.drawLine': self.draw_line,
+            'Screen.drawRectangle': self.draw_rectangle,
+            'Screen.drawCircle': self.draw_circle,
+            'Keyboard.keyPressed': lambda: self.keys[0] if self.keys else 0,
+            'Keyboard.readChar': self.read_char,
+            'Keyboard.readLine': self.read_line,
+            'Keyboard.readInt': self.read_int,
+            'Sys.halt': self.halt,
+            'Sys.error': self.error,
+            'Sys.wait': lambda duration: 0,
+        }
+
+    def screen_text(self) -> str:
+        """
+        Return the character grid without trailing blank rows.
+        """
+        rows = [''.join(row).rstrip() for row in self.text]
+        while rows and not rows[-1]:
+            rows.pop()
+        return '\n'.join(rows)
+
+    # Math, Memory
+
+    def divide(self, x, y) -> int:
+        if y == 0:
+            self.error(3)
+        return wrap(int(x / y))
+
+    def poke(self, address, value) -> int:
+        self.ram[address] = value
+        return 0
+
+    def alloc(self, size) -> int:
+        """
+        First-fit allocation of 'size' words on the heap.
+        """
+        if size <= 0:
+            self.error(5)
+        for position, (address, free) in enumerate(self.free):
+            if free >= size + 1:
+                self.free[position] = (address + size + 1, free - size - 1)
+                self.ram[address] = size
+                return address + 1
+        self.error(6)
+
+    def de_alloc(self, address) -> int:
+        self.free.append((address - 1, self.ram[address - 1] + 1))
+        return 0
+
+    # String
+
+    def string_new(self, max_length) -> int:
+        if max_length < 0:
+            self.error(14)
+        string = self.alloc(max_length + 2)
+        self.ram[string] = max_length
+        self.ram[string + 1] = 0
+        return string
+
+    def string_set_char_at(self, string, index, character) -> int:
+        self.ram[string + 2 + index] = character
+        return 0
+
+    def string_append_char(self, string, character) -> int:
+        length = self.ram[string + 1]
+        if length >= self.ram[string]:
+            self.error(17)
+        self.ram[string + 2 + length] = character
+        self.ram[string + 1] = length + 1
+        return string
+
+    def string_erase_last_char(self, string) -> int:
+        if self.ram[string + 1] > 0:
+            self.ram[string + 1] -= 1
+        return 0
+
+    def string_int_value(self, string) -> int:
+        text = self._text(string)
+        digits = text[1:] if text.startswith('-') else text
+        value = 0
+        for digit in digits:
+            if not digit.isdigit():
+                break
+            value = value * 10 + int(digit)
+        return wrap(-value if text.startswith('-') else value)
+
+    def string_set_int(self, string, number) -> int:
+        self.ram[string + 1] = 0
+        for character in str(number):
+            self.string_append_char(string, ord(character))
+        return 0
+
+    def _text(self, string) -> str:
+        length = self.ram[string + 1]
+        return ''.join(chr(self.ram[string + 2 + index])
+                       for index in range(length))
+
+    # Output
+
+    def move_cursor(self, row, column) -> int:
+        if not (0 <= row < self.ROWS and 0 <= column < self.COLUMNS):
+            self.error(20)
+        self.row = row
+        self.column = column
+        return 0
+
+    def print_char(self, character) -> int:
+        if character == self.NEWLINE:
+            self.row = (self.row + 1) % self.ROWS
+            self.column = 0
+        elif character == self.BACKSPACE:
+            if self.column > 0:
+                self.column -= 1
+                self.text[self.row][self.column] = ' '
+        else:
+            self.text[self.row][self.column] = chr(character)
+            self.column += 1
+            if self.column == self.COLUMNS:
+                self.print_char(self.NEWLINE)
+        return 0
+
+    def print_string(self, string) -> int:
+        for character in self._text(string):
+            self.print_char(ord(character))
+        return 0
+
+    def print_int(self, number) -> int:
+        for character in str(number):
+            self.print_char(ord(character))
+        return 0
+
+    # Screen
+
+    def clear_screen(self) -> int:
+        for address in range(self.SCREEN, self.SCREEN + 8192):
+            self.ram[address] = 0
+        return 0
+
+    def set_color(self, color) -> int:
+        self.color = color != 0
+        return 0
+
+    def draw_pixel(self, x, y) -> int:
+        if not (0 <= x < self.WIDTH and 0 <= y < self.HEIGHT):
+            self.error(7)
+        address = self.SCREEN + y * 32 + x // 16
+        word = self.ram[address] & 0xFFFF
+        if self.color:
+            word |= 1 << (x % 16)
+        else:
+            word &= ~(1 << (x % 16))
+        self.ram[address] = wrap(word)
+        return 0
+
+    def draw_line(self, x1, y1, x2, y2) -> int:
+        """
+        Bresenham line from (x1, y1) to (x2, y2).
+        """
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        step_x = 1 if x1 < x2 else -1
+        step_y = 1 if y1 < y2 else -1
+        error = dx + dy
+        while True:
+            self.draw_pixel(x1, y1)
+            if x1 == x2 and y1 == y2:
+                return 0
+            double = 2 * error
+            if double >= dy:
+                error += dy
+                x1 += step_x
+            if double <= dx:
+                error += dx
+                y1 += step_y
+
+    def draw_rectangle(self, x1, y1, x2, y2) -> int:
+        for y in range(y1, y2 + 1):
+            for x in range(x1, x2 + 1):
+                self.draw_pixel(x, y)
+        return 0
+
+    def draw_circle(self, x, y, r) -> int:
+        if r > 181:
+            self.error(13)
+        for dy in range(-r, r + 1):
+            half = math.isqrt(r * r - dy * dy)
+            for dx in range(-half, half + 1):
+                self.draw_pixel(x + dx, y + dy)
+        return 0
+
+    # Keyboard
+
+    def read_char(self) -> int:
+        if not self.keys:
+            raise Halt('keyboard input exhausted')
+        character = self.keys.pop(0)
+        self.print_char(character)
+        return character
+
+    def read_line(self, message) -> int:
+        self.print_string(message)
+        string = self.string_new(self.COLUMNS)
+        while True:
+            character = self.read_char()
+            if character == self.NEWLINE:
+                return string
+            if character == self.BACKSPACE:
+                self.string_erase_last_char(string)
+            else:
+                self.string_append_char(string, character)
+
+    def read_int(self, message) -> int:
+        string = self.read_line(message)
+        value = self.string_int_value(string)
+        self.de_alloc(string)
+        return value
+
+    # Sys
+
+    def halt(self) -> int:
+        raise Halt('Sys.halt')
+
+    def error(self, code) -> int:
+        raise Halt(f'Sys.error {code}')
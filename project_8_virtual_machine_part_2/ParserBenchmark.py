@@ -0,0 +1,110 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from VMTranslator import Parser, Translator
+
+
+def generate(path, lines, seed=0) -> None:
+    """
+    Write a synthetic VM program with the given number of lines.
+    The command mix roughly follows compiler output: mostly push/pop
+    and arithmetic, with some branching and calls.
+    """
+    rng = random.Random(seed)
+    segments = ['local', 'argument', 'this', 'that', 'temp', 'static',
+                'pointer', 'constant']
+    arithmetic = ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']
+    with open(path, 'wt') as fp:
+        fp.write('function Bench.main 8\n')
+        for counter in range(1, lines):
+            draw = rng.random()
+            if draw < 0.45:
+                segment = rng.choice(segments)
+                index = rng.randint(0, 1 if segment == 'pointer' else 7)
+                fp.write(f'push {segment} {index}\n')
+            elif draw < 0.70:
+                segment = rng.choice(segments[:-1])
+                index = rng.randint(0, 1 if segment == 'pointer' else 7)
+                fp.write(f'pop {segment} {index}\n')
+            elif draw < 0.85:
+                fp.write(f'{rng.choice(arithmetic)}\n')
+            elif draw < 0.88:
+                fp.write(f'label L{counter}\n')
+            elif draw < 0.91:
+                fp.write(f'if-goto L{counter}\n')
+            elif draw < 0.93:
+                fp.write(f'goto L{counter}\n')
+            elif draw < 0.97:
+                fp.write(f'call Bench.main {rng.randint(0, 3)}\n')
+            elif draw < 0.99:
+                fp.write('return\n')
+            else:
+                fp.write(f'function Bench.f{counter} 2\n')
+
+
+def translate(parser, path, target, buffered) -> float:
+    """
+    Translate 'path' into 'target'; return elapsed time in seconds.
+    """
+    with open(target, 'wt') as fp:
+        translator = Translator(fp, buffered=buffered)
+        translator.current_file = path
+        translate = translator.translate
+        start = time.perf_counter()
+        for counter, command in enumerate(parser.read_commands(path)):
+            translate(command, counter, path)
+        translator.flush()
+        return time.perf_counter() - start
+
+
+def run(path, lines) -> None:
+    """
+    Measure parser and parser + translator throughput on 'path';
+    translation is measured both with and without the emission engine
+    (AsmEmitter), whose output must be identical.
+    """
+    parser = Parser(path)
+
+    start = time.perf_counter()
+    count = sum(1 for _ in parser.read_commands(path))
+    elapsed = time.perf_counter() - start
+    print(f'parse:                        {count} commands in {elapsed:.2f}s '
+          f'({lines / elapsed:,.0f} lines/s)')
+
+    direct = f'{path}.direct.asm'
+    buffered = f'{path}.buffered.asm'
+    elapsed_direct = translate(parser, path, direct, buffered=False)
+    print(f'parse + translate (direct):   {count} commands in '
+          f'{elapsed_direct:.2f}s ({lines / elapsed_direct:,.0f} lines/s)')
+    elapsed_buffered = translate(parser, path, buffered, buffered=True)
+    print(f'parse + translate (buffered): {count} commands in '
+          f'{elapsed_buffered:.2f}s ({lines / elapsed_buffered:,.0f} lines/s)')
+    print(f'emission engine speedup: {elapsed_direct / elapsed_buffered:.2f}x')
+
+    with open(direct, 'rb') as fp_direct, open(buffered, 'rb') as fp_buffered:
+        identical = fp_direct.read() == fp_buffered.read()
+    print(f'output identical: {identical}')
+
+
+def main():
+    """
+    Benchmark VM translator throughput in lines per second
+    on a generated multi-million-line VM program.
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Measure VM parser/translator throughput.')
+    arg_parser.add_argument('--lines', type=int, default=2_000_000,
+                            help='number of generated VM lines')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'Bench.vm')
+        generate(path, args.lines)
+        run(path, args.lines)
+
+
+if __name__ == '__main__':
+    main()
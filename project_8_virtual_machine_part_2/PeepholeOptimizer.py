@@ -0,0 +1,231 @@
+class PeepholeOptimizer:
+    """
+    Post-emission optimization stage for the Hack assembly produced
+    by the Translator.
+
+    The optimizer behaves like a writable file object: the Translator
+    writes its instructions into it, the stream is buffered and every
+    time the buffer grows past the window size a rule table is applied
+    to it. Lines which can no longer take part in a match are flushed
+    to the real output file.
+
+    Labels are never removed or moved; since a rule only matches
+    consecutive lines, code reachable through a jump is left intact.
+
+    Attributes
+    ----------
+    fp            :: TextWrapper
+                     reference to the real output file.
+    window        :: int
+                     number of buffered lines which triggers optimization.
+    hits          :: dict
+                     number of times each rule fired.
+    file_stats    :: list
+                     (file name, instructions in, instructions out)
+                     for every finished file.
+    """
+
+    # lines kept in the buffer after optimizing a window, so that
+    # patterns crossing the window boundary can still be matched
+    OVERLAP = 16
+
+    def __init__(self, fp, window=256):
+        self.fp = fp
+        self.window = window
+        self.buffer = []
+        self.rules = [
+            ('push_pop_round_trip', self._push_pop_round_trip),
+            ('sp_inc_dec', self._sp_inc_dec),
+            ('redundant_reload', self._redundant_reload),
+            ('dead_d_load', self._dead_d_load),
+        ]
+        self.hits = {name: 0 for name, _ in self.rules}
+        self.file_stats = []
+        self.instructions_in = 0
+        self.instructions_out = 0
+
+    def write(self, text: str) -> None:
+        """
+        Buffer one or more lines of assembly.
+        """
+        for line in text.splitlines():
+            self.buffer.append(line)
+            if not line.startswith('('):
+                self.instructions_in += 1
+        if len(self.buffer) >= self.window:
+            self._optimize()
+            self._flush(len(self.buffer) - self.OVERLAP)
+
+    def end_file(self, name: str) -> None:
+        """
+        Optimize and flush everything emitted for the file 'name'
+        and record its instruction-count delta.
+        """
+        self.flush()
+        self.file_stats.append((name, self.instructions_in,
+                                self.instructions_out))
+        self.instructions_in = 0
+        self.instructions_out = 0
+
+    def flush(self) -> None:
+        """
+        Optimize and write out the whole buffer.
+        """
+        self._optimize()
+        self._flush(len(self.buffer))
+
+    def close(self) -> None:
+        """
+        Flush remaining lines and close the real output file.
+        """
+        self.flush()
+        self.fp.close()
+
+    def merge(self, hits, file_stats) -> None:
+        """
+        Add rule hits and per-file statistics collected by another
+        optimizer (e.g. from a worker process).
+        """
+        for name, count in hits.items():
+            self.hits[name] += count
+        self.file_stats.extend(file_stats)
+
+    def report(self) -> None:
+        """
+        Print per-file instruction-count deltas and rule hit counters.
+        """
+        total_in = 0
+        total_out = 0
+        for name, count_in, count_out in self.file_stats:
+            total_in += count_in
+            total_out += count_out
+            print(f'peephole: {name}: {count_in} -> {count_out} '
+                  f'({count_out - count_in:+d})')
+        print(f'peephole: total: {total_in} -> {total_out} '
+              f'({total_out - total_in:+d})')
+        for name, hits in self.hits.items():
+            print(f'peephole: rule {name}: {hits} hits')
+
+    def _flush(self, count: int) -> None:
+        """
+        Write the first 'count' buffered lines to the output file.
+        """
+        if count <= 0:
+            return
+        lines = self.buffer[:count]
+        del self.buffer[:count]
+        self.instructions_out += sum(1 for line in lines
+                                     if not line.startswith('('))
+        self.fp.write('\n'.join(lines) + '\n')
+
+    def _optimize(self) -> None:
+        """
+        Apply the rule table to the buffer until no rule fires.
+        """
+        lines = self.buffer
+        changed = True
+        while changed:
+            changed = False
+            i = 0
+            while i < len(lines):
+                for name, rule in self.rules:
+                    if rule(lines, i):
+                        self.hits[name] += 1
+                        changed = True
+                        break
+                else:
+                    i += 1
+
+    @staticmethod
+    def _is_c_instruction(line: str) -> bool:
+        return not line.startswith(('@', '('))
+
+    @staticmethod
+    def _dest(line: str) -> str:
+        """
+        Return the dest part of a C-instruction ('' if there is none).
+        """
+        return line.split('=')[0] if '=' in line else ''
+
+    @staticmethod
+    def _comp(line: str) -> str:
+        """
+        Return the comp part of a C-instruction.
+        """
+        comp = line.split('=')[-1]
+        return comp.split(';')[0]
+
+    def _push_pop_round_trip(self, lines, i) -> bool:
+        """
+        *SP = D; SP++; SP--; D = *SP  ->  (nothing)
+
+        Only applied when the following line reloads A (or is a label),
+        since the removed code leaves A pointing at the stack.
+        """
+        if lines[i:i + 3] != ['@SP', 'A=M', 'M=D']:
+            return False
+        if lines[i + 3:i + 5] not in (['@SP', 'M=M+1'], ['@SP', 'AM=M+1']):
+            return False
+        if lines[i + 5:i + 8] != ['@SP', 'AM=M-1', 'D=M']:
+            return False
+        if i + 8 >= len(lines) or not lines[i + 8].startswith(('@', '(')):
+            return False
+        del lines[i:i + 8]
+        return True
+
+    def _sp_inc_dec(self, lines, i) -> bool:
+        """
+        SP++; SP--  ->  A = SP
+        """
+        if lines[i:i + 4] not in (['@SP', 'M=M+1', '@SP', 'AM=M-1'],
+                                  ['@SP', 'AM=M+1', '@SP', 'AM=M-1']):
+            return False
+        lines[i:i + 4] = ['@SP', 'A=M']
+        return True
+
+    def _redundant_reload(self, lines, i) -> bool:
+        """
+        @X; <instruction not writing A>; @X  ->  @X; <instruction>
+        """
+        if not lines[i].startswith('@') or i + 2 >= len(lines):
+            return False
+        if lines[i + 2] != lines[i]:
+            return False
+        middle = lines[i + 1]
+        if not self._is_c_instruction(middle) or 'A' in self._dest(middle):
+            return False
+        del lines[i + 2]
+        return True
+
+    def _dead_d_load(self, lines, i) -> bool:
+        """
+        @X; M=D; D=M                      ->  @X; M=D
+        D=M; [@X]; D=<comp not using D>  ->  [@X]; D=<comp>
+
+        The first form is what the Translator leaves behind when a
+        value is stored to a register and pushed again right away
+        (e.g. 'pop pointer 1' followed by a push of THAT, once
+        redundant_reload dropped the second @THAT): D already holds
+        the stored value. @KBD is excluded, since the keyboard reads
+        back its own state.
+
+        The Translator never emits the second form, since
+        push_pop_round_trip already removes such loads; it only
+        fires on hand-written or externally produced assembly.
+        """
+        if lines[i] != 'D=M':
+            return False
+        if (i >= 2 and lines[i - 1] == 'M=D'
+                and lines[i - 2].startswith('@')
+                and lines[i - 2] not in ('@KBD', '@24576')):
+            del lines[i]
+            return True
+        j = i + 1
+        if j < len(lines) and lines[j].startswith('@'):
+            j += 1
+        if j >= len(lines) or not self._is_c_instruction(lines[j]):
+            return False
+        if 'D' not in self._dest(lines[j]) or 'D' in self._comp(lines[j]):
+            return False
+        del lines[i]
+        return True
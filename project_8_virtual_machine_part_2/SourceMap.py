@@ -0,0 +1,200 @@
+from bisect import bisect_right
+import argparse
+import json
+import os
+
+from VMCommand import Opcode, Segment, COMMANDS, SEGMENTS, ARITHMETIC
+
+
+class SourceMap:
+    """
+    Map from ROM addresses of a translated program back to the VM
+    commands which produced them.
+
+    The program is covered by consecutive address ranges; each range
+    carries the (file, VM line, VM command, function) it was translated
+    from. Ranges of code which does not come from a VM command (the
+    bootstrap, shared routines) have an empty file and line 0.
+
+    The sidecar file is JSON in columnar form: one array per field, with
+    file, function and command strings interned in tables, so it stays
+    small and loads with a single json.load. Lookups bisect the array
+    of range starts.
+
+    While translating, entries hold the path of the file, which is
+    reduced to its base name once per file when the map is saved.
+
+    Attributes
+    ----------
+    starts        :: list
+                     first ROM address of every range.
+    entries       :: list
+                     (file, line, function, command) of every range.
+    size          :: int
+                     number of ROM words covered so far.
+    """
+
+    VERSION = 1
+    # keyword of every opcode / segment, for rendering commands
+    KEYWORDS = {opcode: keyword for keyword, (opcode, _) in COMMANDS.items()}
+    SEGMENT_NAMES = {segment: name for name, segment in SEGMENTS.items()}
+    SEGMENT_NAMES[Segment.STACK] = 'stack'
+
+    def __init__(self):
+        self.starts = []
+        self.entries = []
+        self.size = 0
+        # Command -> VM text
+        self.texts = {}
+
+    def text(self, command) -> str:
+        """
+        Return the VM text of 'command', rendered once per distinct
+        command. Entries keep only strings and ints, which the garbage
+        collector does not need to track.
+        """
+        text = self.texts.get(command)
+        if text is None:
+            text = self.texts[command] = self.describe(command)
+        return text
+
+    def add(self, length, entry) -> None:
+        """
+        Append a range of 'length' ROM words translated from 'entry'.
+        """
+        if length <= 0:
+            return
+        if self.entries and self.entries[-1] is entry:
+            # more code of the same command, e.g. after a flush
+            self.size += length
+            return
+        self.starts.append(self.size)
+        self.entries.append(entry)
+        self.size += length
+
+    def extend(self, other) -> None:
+        """
+        Append the ranges of another map (e.g. of a file translated
+        in a worker process) after the ones of this map.
+        """
+        self.starts.extend(start + self.size for start in other.starts)
+        self.entries.extend(other.entries)
+        self.size += other.size
+
+    def lookup(self, address):
+        """
+        Return the (file, line, function, command) entry covering
+        'address', or None.
+        """
+        position = bisect_right(self.starts, address) - 1
+        if position < 0 or address >= self.size:
+            return None
+        return self.entries[position]
+
+    @staticmethod
+    def _file_name(path) -> str:
+        return os.path.basename(path)
+
+    @classmethod
+    def describe(cls, command) -> str:
+        """
+        Return the VM text of a command as it was translated.
+        """
+        opcode, arg_1, arg_2 = command
+        if opcode in ARITHMETIC or opcode == Opcode.RETURN:
+            return cls.KEYWORDS[opcode]
+        if opcode in (Opcode.PUSH, Opcode.POP):
+            return f'{cls.KEYWORDS[opcode]} {cls.SEGMENT_NAMES[arg_1]} {arg_2}'
+        if opcode == Opcode.MOVE:
+            return (f'push {cls.SEGMENT_NAMES[arg_1[0]]} {arg_1[1]}; '
+                    f'pop {cls.SEGMENT_NAMES[arg_2[0]]} {arg_2[1]}')
+        if opcode == Opcode.INLINE_RETURN:
+            return f'return (inlined, {arg_2})'
+        if opcode == Opcode.COMPARE_IF:
+            return f'if-goto {arg_1} ({arg_2})'
+        if opcode == Opcode.INCREMENT:
+            index, delta = arg_2
+            return f'{cls.SEGMENT_NAMES[arg_1]} {index} += {delta}'
+        if opcode == Opcode.ARRAY_READ:
+            return (f'push that[{cls.SEGMENT_NAMES[arg_1[0]]} {arg_1[1]} + '
+                    f'{cls.SEGMENT_NAMES[arg_2[0]]} {arg_2[1]}]')
+        if opcode == Opcode.ARRAY_WRITE:
+            return 'pop that[address]'
+        if opcode == Opcode.CALL_DISCARD:
+            return f'call {arg_1} {arg_2}; pop temp 0'
+        if opcode == Opcode.TAIL_CALL:
+            return f'call {arg_1} {arg_2}; return'
+        if opcode in (Opcode.FUNCTION, Opcode.CALL):
+            return f'{cls.KEYWORDS[opcode]} {arg_1} {arg_2}'
+        return f'{cls.KEYWORDS[opcode]} {arg_1}'
+
+    def save(self, path) -> None:
+        """
+        Write the map as a columnar JSON sidecar file.
+        """
+        files, lines, functions, commands = (
+            zip(*self.entries) if self.entries else ((), (), (), ()))
+        data = {'version': self.VERSION, 'size': self.size,
+                'start': self.starts, 'line': list(lines)}
+        for column, table, values, render in (
+                ('file', 'files', files, self._file_name),
+                ('function', 'functions', functions, str),
+                ('command', 'commands', commands, str)):
+            # intern: distinct values in order of first appearance
+            distinct = dict.fromkeys(values)
+            index = {value: position
+                     for position, value in enumerate(distinct)}
+            data[table] = [render(value) for value in distinct]
+            data[column] = list(map(index.__getitem__, values))
+        with open(path, 'wt') as fp:
+            fp.write(json.dumps(data, separators=(',', ':')))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a map written by save().
+        """
+        with open(path, 'rt') as fp:
+            data = json.load(fp)
+        if data['version'] != cls.VERSION:
+            raise ValueError(f'unsupported source map version: '
+                             f'{data["version"]}')
+        source_map = cls()
+        source_map.size = data['size']
+        source_map.starts = data['start']
+        files = data['files']
+        functions = data['functions']
+        commands = data['commands']
+        source_map.entries = [
+            (files[file_], line, functions[function], commands[command])
+            for file_, line, function, command in zip(
+                data['file'], data['line'], data['function'],
+                data['command'])]
+        return source_map
+
+
+def main():
+    """
+    Print the VM origin of ROM addresses using a source map.
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog='SourceMap',
+        description='Map ROM addresses back to VM commands.')
+    arg_parser.add_argument('map', help='<program.map>')
+    arg_parser.add_argument('addresses', nargs='+', type=int,
+                            metavar='ADDRESS')
+    args = arg_parser.parse_args()
+
+    source_map = SourceMap.load(args.map)
+    for address in args.addresses:
+        entry = source_map.lookup(address)
+        if entry is None:
+            print(f'{address}: not mapped')
+            continue
+        file_, line, function, command = entry
+        where = f'{file_}:{line}' if file_ else '(runtime)'
+        print(f'{address}: {where} {function} {command}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import pickle
+
+
+class TranslationCache:
+    """
+    Persistent on-disk cache of translated .vm files.
+
+    Every entry holds the assembly fragment of one .vm file together
+    with the statistics collected while translating it, so that
+    unchanged files can be spliced into the output without being
+    translated again. Entries are keyed by a hash of the file contents,
+    its name, the translator version and the translation options.
+
+    Least recently used entries are evicted once the cache grows past
+    'max_bytes'; the modification time of an entry file is its last use.
+
+    Attributes
+    ----------
+    directory     :: str
+                     directory holding the cache entries.
+    version       :: str
+                     translator version; entries of other versions
+                     are never hit.
+    max_bytes     :: int
+                     size limit of the cache directory.
+    hits          :: int
+                     number of files spliced in from the cache.
+    misses        :: int
+                     number of files which had to be translated.
+    evictions     :: int
+                     number of entries removed by LRU eviction.
+    """
+
+    SUFFIX = '.fragment'
+
+    def __init__(self, directory, version, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.version = version
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file_, source, options) -> str:
+        """
+        Return the cache key of translating 'file_' (part of 'source')
+        with the given options.
+        """
+        digest = hashlib.sha256()
+        with open(file_, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+        digest.update(repr((self.version, file_, source,
+                            sorted(options.items()))).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Return the entry stored under 'key' or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                entry = pickle.load(fp)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry) -> None:
+        """
+        Store 'entry' under 'key' and evict old entries if the cache
+        is over its size limit.
+        """
+        path = self._path(key)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as fp:
+            pickle.dump(entry, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove least recently used entries until the cache fits
+        into max_bytes.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def report(self) -> None:
+        """
+        Print hit/miss statistics of this run.
+        """
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0
+        print(f'translation cache: {self.hits} hits, {self.misses} misses '
+              f'({rate:.0f}% hit rate), {self.evictions} evictions')
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, f'{key}{self.SUFFIX}')
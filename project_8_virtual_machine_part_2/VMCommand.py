@@ -0,0 +1,146 @@
+from collections import namedtuple
+from enum import IntEnum
+
+
+class Opcode(IntEnum):
+    """
+    Pre-decoded VM command; used as an index into
+    the Translator's handler table.
+    """
+    ADD = 0
+    SUB = 1
+    NEG = 2
+    EQ = 3
+    GT = 4
+    LT = 5
+    AND = 6
+    OR = 7
+    NOT = 8
+    PUSH = 9
+    POP = 10
+    LABEL = 11
+    GOTO = 12
+    IF = 13
+    FUNCTION = 14
+    CALL = 15
+    RETURN = 16
+    # push/pop pair fused by the VMOptimizer
+    MOVE = 17
+    # return from a function body inlined by the Inliner; arg_2 is the
+    # number of stack entries below the result to discard
+    INLINE_RETURN = 18
+    # comparison (optionally negated) fused with the following if-goto
+    # by the VMOptimizer; arg_1 is the label, arg_2 the Hack jump
+    # mnemonic taking the branch
+    COMPARE_IF = 19
+    # superinstructions recognized by the VMOptimizer:
+    # 'push s i / push constant c / add|sub / pop s i'; arg_1 is the
+    # segment, arg_2 the (index, delta) pair
+    INCREMENT = 20
+    # 'push x / push y / add / pop pointer 1 / push that 0'; arg_1 and
+    # arg_2 are the (segment, index) pairs of x and y
+    ARRAY_READ = 21
+    # 'pop temp 0 / pop pointer 1 / push temp 0 / pop that 0'
+    ARRAY_WRITE = 22
+    # 'call f n / pop temp 0'; arguments as for call
+    CALL_DISCARD = 23
+    # 'call f n / return' recognized by the VMOptimizer; arguments as
+    # for call
+    TAIL_CALL = 24
+
+
+class Segment(IntEnum):
+    """
+    Memory segment of a push/pop command.
+    """
+    CONSTANT = 0
+    LOCAL = 1
+    ARGUMENT = 2
+    THIS = 3
+    THAT = 4
+    TEMP = 5
+    POINTER = 6
+    STATIC = 7
+    # SP-relative entry (address SP - index) used by inlined function
+    # bodies; has no VM keyword
+    STACK = 8
+
+
+# opcode :: Opcode
+# arg_1  :: Segment (push/pop), str (label/goto/if-goto/function/call)
+#           or '' (arithmetic/return)
+# arg_2  :: int (push/pop/function/call), str (compare-if jump) or ''
+Command = namedtuple('Command', ['opcode', 'arg_1', 'arg_2'])
+
+
+class TracedCommand(Command):
+    """
+    Command which also carries the number of the source line it was
+    read from (for source maps); compares and hashes like the plain
+    Command.
+    """
+
+    def __new__(cls, command, line):
+        self = super().__new__(cls, *command)
+        self.line = line
+        return self
+
+    def __getnewargs__(self):
+        return Command(*self), self.line
+
+# argument layouts of the VM commands
+NO_ARGS = 0
+LABEL_ARG = 1
+SEGMENT_ARGS = 2
+NAME_ARGS = 3
+
+# VM keyword -> (opcode, argument layout)
+COMMANDS = {
+    'add': (Opcode.ADD, NO_ARGS),
+    'sub': (Opcode.SUB, NO_ARGS),
+    'neg': (Opcode.NEG, NO_ARGS),
+    'eq': (Opcode.EQ, NO_ARGS),
+    'gt': (Opcode.GT, NO_ARGS),
+    'lt': (Opcode.LT, NO_ARGS),
+    'and': (Opcode.AND, NO_ARGS),
+    'or': (Opcode.OR, NO_ARGS),
+    'not': (Opcode.NOT, NO_ARGS),
+    'push': (Opcode.PUSH, SEGMENT_ARGS),
+    'pop': (Opcode.POP, SEGMENT_ARGS),
+    'label': (Opcode.LABEL, LABEL_ARG),
+    'goto': (Opcode.GOTO, LABEL_ARG),
+    'if-goto': (Opcode.IF, LABEL_ARG),
+    'function': (Opcode.FUNCTION, NAME_ARGS),
+    'call': (Opcode.CALL, NAME_ARGS),
+    'return': (Opcode.RETURN, NO_ARGS),
+}
+
+SEGMENTS = {
+    'constant': Segment.CONSTANT,
+    'local': Segment.LOCAL,
+    'argument': Segment.ARGUMENT,
+    'this': Segment.THIS,
+    'that': Segment.THAT,
+    'temp': Segment.TEMP,
+    'pointer': Segment.POINTER,
+    'static': Segment.STATIC,
+}
+
+# VM keyword of the arithmetic/logical opcodes
+ARITHMETIC = {
+    Opcode.ADD: 'add',
+    Opcode.SUB: 'sub',
+    Opcode.NEG: 'neg',
+    Opcode.EQ: 'eq',
+    Opcode.GT: 'gt',
+    Opcode.LT: 'lt',
+    Opcode.AND: 'and',
+    Opcode.OR: 'or',
+    Opcode.NOT: 'not',
+}
+
+# commands without arguments are shared instead of rebuilt for every line
+NO_ARG_COMMANDS = {
+    opcode: Command(opcode, '', '')
+    for opcode, layout in COMMANDS.values() if layout == NO_ARGS
+}
@@ -0,0 +1,352 @@
+from array import array
+import argparse
+import itertools
+import os
+import time
+
+from CPUEmulator import Halt
+from JackOS import JackOS
+from VMCommand import Opcode, Segment
+from VMTranslator import Parser
+
+
+class VMInterpreter:
+    """
+    Interpreter executing .vm files directly, without translating
+    them to assembly.
+
+    The program is read with the Parser of the translator and every
+    command is compiled once into a Python function (threaded code):
+    it executes the command and returns the index of the next one, so
+    the main loop is a single indexed call:
+
+        ip = code[ip]()
+
+    The stack and segments live in an array-backed RAM laid out as on
+    the Hack platform; SP, LCL, ARG, THIS and THAT are kept in closure
+    cells shared by all command functions and written back to RAM[0..4]
+    when the interpreter stops. 'call' / 'function' / 'return' follow
+    the standard frame protocol.
+
+    Calls to functions the program does not define go to the headless
+    JackOS, which implements the OS classes in Python.
+
+    Attributes
+    ----------
+    ram           :: array
+                     RAM contents (signed 16-bit words).
+    os            :: JackOS
+                     OS functions available to the program.
+    functions     :: dict
+                     function name -> index of its first command.
+    ip            :: int
+                     index of the next command to execute.
+    steps         :: int
+                     number of commands executed so far.
+    stop_reason   :: str
+                     why the last run stopped ('' when it did not).
+    """
+
+    RAM_SIZE = 32768
+    STACK_BASE = 256
+    STATIC_BASE = 16
+    # entry points tried in order
+    ENTRY_POINTS = ('Sys.init', 'Main.main')
+
+    def __init__(self, source, keys=''):
+        self.ram = array('h', [0]) * self.RAM_SIZE
+        self.os = JackOS(self.ram, keys)
+        self.functions = {}
+        self.statics = {}
+        self.steps = 0
+        self.stop_reason = ''
+        commands = self._load(source)
+        self.code, self._registers, self._set_registers = \
+            self._compile(commands)
+        self._bootstrap()
+
+    def run(self, max_steps=None) -> int:
+        """
+        Execute at most 'max_steps' commands (no limit with None) or
+        until the program halts; return the number executed.
+        """
+        code = self.code
+        ip = self.ip
+        steps = itertools.count() if max_steps is None else range(max_steps)
+        step = -1
+        try:
+            for step in steps:
+                ip = code[ip]()
+            step += 1
+        except Halt as halt:
+            self.stop_reason = str(halt)
+        self.ip = ip
+        self.steps += step
+        self.ram[0:5] = array('h', self._registers())
+        return step
+
+    def _load(self, source) -> list:
+        """
+        Return (function, command) pairs of every .vm file of 'source'
+        and record the functions and static variables they define.
+        """
+        if os.path.isdir(source):
+            files = [os.path.join(source, name)
+                     for name in sorted(os.listdir(source))
+                     if name.endswith('.vm')]
+        else:
+            files = [source]
+        parser = Parser(source)
+        commands = []
+        for file_ in files:
+            stem = os.path.basename(file_).split('.')[0]
+            function = None
+            for command in parser.read_commands(file_):
+                if command.opcode == Opcode.FUNCTION:
+                    function = command.arg_1
+                elif command.opcode in (Opcode.PUSH, Opcode.POP) \
+                        and command.arg_1 == Segment.STATIC:
+                    key = (stem, command.arg_2)
+                    if key not in self.statics:
+                        self.statics[key] = \
+                            self.STATIC_BASE + len(self.statics)
+                commands.append((stem, function, command))
+        return commands
+
+    def _compile(self, commands):
+        """
+        Generate and compile the command functions; return the dispatch
+        table and functions reading/writing the registers.
+        """
+        # labels and functions do not execute; they name the index
+        # of the next command that does
+        labels = {}
+        index = 0
+        for stem, function, command in commands:
+            if command.opcode == Opcode.FUNCTION:
+                self.functions[command.arg_1] = index
+            elif command.opcode == Opcode.LABEL:
+                labels[(function, command.arg_1)] = index
+                continue
+            index += 1
+        if index >= 0x8000:
+            raise ValueError(f'program too large: {index} commands')
+
+        builtins = []
+        builtin_index = {}
+        zeros = {}
+        source = ['def build(ram, builtins, zeros, Halt):',
+                  '    SP = LCL = ARG = THIS = THAT = 0',
+                  '    def registers():',
+                  '        return SP, LCL, ARG, THIS, THAT',
+                  '    def set_registers(sp, lcl, arg, this, that):',
+                  '        nonlocal SP, LCL, ARG, THIS, THAT',
+                  '        SP, LCL, ARG, THIS, THAT = sp, lcl, arg, this, that']
+        index = 0
+        for stem, function, command in commands:
+            opcode, arg_1, arg_2 = command
+            if opcode == Opcode.LABEL:
+                continue
+            following = index + 1
+            if opcode == Opcode.CALL and arg_1 not in self.functions:
+                if arg_1 not in self.os.functions:
+                    raise ValueError(f'undefined function: {arg_1}')
+                if arg_1 not in builtin_index:
+                    builtin_index[arg_1] = len(builtins)
+                    builtins.append(self.os.functions[arg_1])
+                body = self._builtin_call(builtin_index[arg_1], arg_2)
+            elif opcode == Opcode.FUNCTION:
+                zeros[arg_2] = array('h', [0]) * arg_2
+                body = self._function(arg_2)
+            elif opcode in (Opcode.GOTO, Opcode.IF):
+                target = labels[(function, arg_1)]
+                if opcode == Opcode.IF:
+                    body = ['nonlocal SP',
+                            'SP -= 1',
+                            'if ram[SP]:',
+                            f'    return {target}']
+                elif target == index:
+                    body = ["raise Halt('halt loop')"]
+                else:
+                    body = [f'return {target}']
+            elif opcode == Opcode.CALL:
+                body = self._call(self.functions[arg_1], arg_2, following)
+            else:
+                body = self._command(stem, command)
+            source.append(f'    def c_{index}():')
+            source.extend(f'        {line}' for line in body)
+            if not body or not body[-1].startswith(('return', 'raise')):
+                source.append(f'        return {following}')
+            index += 1
+        # return address of the entry point
+        source.append(f'    def c_{index}():')
+        source.append("        raise Halt('entry point returned')")
+        self.halt_ip = index
+        source.append('    return [%s], registers, set_registers' % ', '.join(
+            f'c_{position}' for position in range(index + 1)))
+        namespace = {}
+        exec(compile('\n'.join(source), '<vm program>', 'exec'), namespace)
+        return namespace['build'](self.ram, builtins, zeros, Halt)
+
+    def _bootstrap(self) -> None:
+        """
+        Set up the frame of a 'call' to the entry point returning
+        into a halt.
+        """
+        for entry_point in self.ENTRY_POINTS:
+            if entry_point in self.functions:
+                break
+        else:
+            raise ValueError('no entry point: Sys.init or Main.main needed')
+        stack = self.STACK_BASE
+        self.ram[stack] = self.halt_ip
+        self.ram[stack + 1:stack + 5] = array('h', [0]) * 4
+        self._set_registers(stack + 5, stack + 5, stack, 0, 0)
+        self.ip = self.functions[entry_point]
+
+    def _command(self, stem, command) -> list:
+        """
+        Return the body of a push/pop/arithmetic/return function.
+        """
+        opcode, segment, index = command
+        if opcode == Opcode.PUSH:
+            return ['nonlocal SP',
+                    f'ram[SP] = {self._value(stem, segment, index)}',
+                    'SP += 1']
+        if opcode == Opcode.POP:
+            if segment == Segment.POINTER:
+                register = 'THIS' if index == 0 else 'THAT'
+                return [f'nonlocal SP, {register}',
+                        'SP -= 1',
+                        f'{register} = ram[SP]']
+            return ['nonlocal SP',
+                    'SP -= 1',
+                    f'ram[{self._address(stem, segment, index)}] = ram[SP]']
+        if opcode == Opcode.RETURN:
+            return ['nonlocal SP, LCL, ARG, THIS, THAT',
+                    'frame = LCL',
+                    # read before *ARG is overwritten (nArgs = 0)
+                    'ip = ram[frame - 5]',
+                    'ram[ARG] = ram[SP - 1]',
+                    'SP = ARG + 1',
+                    'THAT = ram[frame - 1]',
+                    'THIS = ram[frame - 2]',
+                    'ARG = ram[frame - 3]',
+                    'LCL = ram[frame - 4]',
+                    'return ip']
+        if opcode in (Opcode.NEG, Opcode.NOT):
+            operation = ('-ram[SP - 1]' if opcode == Opcode.NEG
+                         else '~ram[SP - 1]')
+            return [f'v = {operation}',
+                    'ram[SP - 1] = ((v + 0x8000) & 0xFFFF) - 0x8000']
+        expression = {
+            Opcode.ADD: '((x + y + 0x8000) & 0xFFFF) - 0x8000',
+            Opcode.SUB: '((x - y + 0x8000) & 0xFFFF) - 0x8000',
+            Opcode.AND: 'x & y',
+            Opcode.OR: 'x | y',
+            Opcode.EQ: '-1 if x == y else 0',
+            # as the translated code: sign of x - y wrapped to 16 bits
+            Opcode.GT: '-1 if 0 < (x - y) & 0xFFFF < 0x8000 else 0',
+            Opcode.LT: '-1 if (x - y) & 0x8000 else 0',
+        }[opcode]
+        return ['nonlocal SP',
+                'SP -= 1',
+                'x = ram[SP - 1]',
+                'y = ram[SP]',
+                f'ram[SP - 1] = {expression}']
+
+    def _value(self, stem, segment, index) -> str:
+        if segment == Segment.CONSTANT:
+            return str(index)
+        if segment == Segment.POINTER:
+            return 'THIS' if index == 0 else 'THAT'
+        return f'ram[{self._address(stem, segment, index)}]'
+
+    def _address(self, stem, segment, index) -> str:
+        if segment == Segment.TEMP:
+            return str(5 + index)
+        if segment == Segment.STATIC:
+            return str(self.statics[(stem, index)])
+        register = {Segment.LOCAL: 'LCL', Segment.ARGUMENT: 'ARG',
+                    Segment.THIS: 'THIS', Segment.THAT: 'THAT'}[segment]
+        return f'{register} + {index}' if index else register
+
+    @staticmethod
+    def _function(num_locals) -> list:
+        if not num_locals:
+            return []
+        return ['nonlocal SP',
+                f'ram[SP:SP + {num_locals}] = zeros[{num_locals}]',
+                f'SP += {num_locals}']
+
+    @staticmethod
+    def _call(target, num_args, return_ip) -> list:
+        return ['nonlocal SP, LCL, ARG',
+                f'ram[SP] = {return_ip}',
+                'ram[SP + 1] = LCL',
+                'ram[SP + 2] = ARG',
+                'ram[SP + 3] = THIS',
+                'ram[SP + 4] = THAT',
+                f'ARG = SP - {num_args}',
+                'SP += 5',
+                'LCL = SP',
+                f'return {target}']
+
+    @staticmethod
+    def _builtin_call(builtin, num_args) -> list:
+        if not num_args:
+            return ['nonlocal SP',
+                    f'ram[SP] = builtins[{builtin}]()',
+                    'SP += 1']
+        return ['nonlocal SP',
+                f'SP -= {num_args}',
+                f'ram[SP] = builtins[{builtin}](*ram[SP:SP + {num_args}])',
+                'SP += 1']
+
+
+def main():
+    """
+    Run a VM program (file or directory) and report the number of
+    executed commands, the registers and the text output.
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog='VMInterpreter',
+        description='Execute .vm files directly.')
+    arg_parser.add_argument('source', help='<input_file.vm>/<input_folder>')
+    arg_parser.add_argument('--input', action='append', default=[],
+                            metavar='LINE',
+                            help='line of keyboard input (repeatable)')
+    arg_parser.add_argument('--steps', type=int, metavar='N',
+                            help='stop after N commands '
+                                 '(default: run until the program halts)')
+    arg_parser.add_argument('--ram', action='append', default=[],
+                            metavar='START[:END]',
+                            help='RAM words to print after running')
+    args = arg_parser.parse_args()
+
+    keys = ''.join(f'{line}\n' for line in args.input)
+    interpreter = VMInterpreter(args.source, keys)
+    start = time.perf_counter()
+    steps = interpreter.run(args.steps)
+    elapsed = time.perf_counter() - start
+
+    state = interpreter.stop_reason or 'step limit reached'
+    print(f'steps: {steps} ({state})')
+    print(f'time: {elapsed:.3f}s ({steps / max(elapsed, 1e-9) / 1e6:.2f} '
+          f'million commands/s)')
+    for address, name in enumerate(('SP', 'LCL', 'ARG', 'THIS', 'THAT')):
+        print(f'RAM[{address}] {name} = {interpreter.ram[address]}')
+    for span in args.ram:
+        start, _, end = span.partition(':')
+        start = int(start)
+        end = int(end) if end else start + 1
+        for address in range(start, end):
+            print(f'RAM[{address}] = {interpreter.ram[address]}')
+    text = interpreter.os.screen_text()
+    if text:
+        print('output:')
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,575 @@
+from collections import deque
+
+from VMCommand import Opcode, Segment, Command, NO_ARG_COMMANDS
+
+
+class VMOptimizer:
+    """
+    Optimization stage sitting between the Parser and the Translator.
+
+    Works on the stream of parsed commands of a single file; every
+    command is a Command record exactly as produced by the Parser.
+    The optimizer folds arithmetic on constants and removes algebraic
+    identities, so that e.g.
+
+        push constant 3
+        push constant 4
+        add
+
+    is translated as a single 'push constant 7'.
+
+    With fuse_moves enabled, adjacent 'push x i' / 'pop y j' pairs are
+    replaced with a single Command(MOVE, (x, i), (y, j)) which the
+    Translator turns into a direct memory-to-memory move.
+
+    With simplify_jumps enabled, the body of every function is split
+    into basic blocks; jumps are threaded through blocks which only
+    jump on, jumps to the next block are removed, 'cmp / not / if-goto
+    A / goto B / label A' is inverted into 'cmp / if-goto B / label A',
+    and blocks no path reaches are dropped, together with the labels
+    no jump refers to any more. A whole function is held in memory
+    while it is simplified.
+
+    With fuse_branches enabled, a comparison feeding straight into
+    'if-goto' (possibly through a 'not') is replaced with a single
+    Command(COMPARE_IF, label, jump) which the Translator turns into
+    one conditional jump, without materializing the boolean.
+
+    With superinstructions enabled, fixed idioms of the Jack compiler
+    output are replaced with single commands the Translator has
+    hand-written code for (see SUPERINSTRUCTIONS).
+
+    With tail_calls enabled, a 'call' immediately followed by 'return'
+    is replaced with a single Command(TAIL_CALL, name, num_args) which
+    the Translator turns into a jump reusing the frame of the caller.
+
+    Attributes
+    ----------
+    eliminated    :: int
+                     number of VM commands removed so far.
+    moves         :: int
+                     number of push/pop pairs fused into moves.
+    branches      :: int
+                     number of comparisons fused with an if-goto.
+    hits          :: dict
+                     superinstruction -> number of idioms replaced.
+    tail_calls    :: int
+                     number of call/return pairs turned into tail calls.
+    jumps         :: dict
+                     jump simplification -> number of times applied
+                     (commands dropped for 'unreachable').
+    """
+
+    BINARY = {
+        Opcode.ADD: lambda x, y: x + y,
+        Opcode.SUB: lambda x, y: x - y,
+        Opcode.AND: lambda x, y: x & y,
+        Opcode.OR: lambda x, y: x | y,
+        Opcode.EQ: lambda x, y: -1 if x == y else 0,
+        # like the emitted D=M-D; D;JGT / D;JLT, gt and lt decide by the
+        # sign of x - y wrapped to 16 bits (so -20000 > 20000)
+        Opcode.GT: lambda x, y: -1 if 0 < (x - y) & 0xFFFF < 0x8000 else 0,
+        Opcode.LT: lambda x, y: -1 if (x - y) & 0x8000 else 0,
+    }
+    UNARY = {
+        Opcode.NEG: lambda x: -x,
+        Opcode.NOT: lambda x: ~x,
+    }
+    # (constant, opcode) pairs which leave the stack untouched
+    IDENTITIES = {(0, Opcode.ADD), (0, Opcode.SUB), (0, Opcode.OR),
+                  (-1, Opcode.AND)}
+    # unary opcodes which cancel out when applied twice
+    INVOLUTIONS = {Opcode.NEG, Opcode.NOT}
+    # comparison -> (jump taken when true, jump taken when false)
+    JUMPS = {
+        Opcode.EQ: ('JEQ', 'JNE'),
+        Opcode.GT: ('JGT', 'JLE'),
+        Opcode.LT: ('JLT', 'JGE'),
+    }
+    # number of trailing commands kept open for folding
+    WINDOW = 32
+    # superinstruction -> opcode replacing the idiom
+    SUPERINSTRUCTIONS = {
+        # push s i / push constant c / add|sub / pop s i
+        # (or push constant c / push s i / add / pop s i)
+        'increment': Opcode.INCREMENT,
+        # push x / push y / add / pop pointer 1 / push that 0
+        'array_read': Opcode.ARRAY_READ,
+        # pop temp 0 / pop pointer 1 / push temp 0 / pop that 0
+        'array_write': Opcode.ARRAY_WRITE,
+        # call f n / pop temp 0
+        'call_discard': Opcode.CALL_DISCARD,
+    }
+    # jump simplifications, in report order
+    JUMP_SIMPLIFICATIONS = ('threaded', 'to next removed', 'inverted',
+                            'unreachable')
+    # commands after which control never falls through
+    TERMINATORS = {Opcode.GOTO, Opcode.RETURN}
+    # longest idiom, in commands
+    IDIOM_LENGTH = 5
+    # segments a superinstruction can read or write directly
+    DIRECT = {Segment.LOCAL, Segment.ARGUMENT, Segment.THIS, Segment.THAT,
+              Segment.TEMP, Segment.POINTER, Segment.STATIC}
+    ARRAY_WRITE_TAIL = (
+        Command(Opcode.POP, Segment.TEMP, 0),
+        Command(Opcode.POP, Segment.POINTER, 1),
+        Command(Opcode.PUSH, Segment.TEMP, 0),
+        Command(Opcode.POP, Segment.THAT, 0),
+    )
+
+    def __init__(self, fold=True, fuse_moves=False, fuse_branches=False,
+                 superinstructions=False, tail_calls=False,
+                 simplify_jumps=False):
+        self.fold = fold
+        self.fuse_moves = fuse_moves
+        self.fuse_branches = fuse_branches
+        self.superinstructions = superinstructions
+        self.fuse_tail_calls = tail_calls
+        self.simplify_jumps = simplify_jumps
+        self.eliminated = 0
+        self.moves = 0
+        self.branches = 0
+        self.hits = dict.fromkeys(self.SUPERINSTRUCTIONS, 0)
+        self.tail_calls = 0
+        self.jumps = dict.fromkeys(self.JUMP_SIMPLIFICATIONS, 0)
+
+    def optimize(self, commands):
+        """
+        Return a generator of the optimized commands. The input is
+        consumed lazily and only a small window of commands is held
+        in memory at any time.
+        """
+        if self.fold:
+            commands = self._fold_constants(commands)
+        if self.simplify_jumps:
+            commands = self._simplify_jumps(commands)
+        if self.fuse_branches:
+            commands = self._fuse_branches(commands)
+        if self.fuse_tail_calls:
+            commands = self._fuse_tail_calls(commands)
+        if self.superinstructions:
+            commands = self._recognize_idioms(commands)
+        if self.fuse_moves:
+            commands = self._fuse_moves(commands)
+        return commands
+
+    def merge(self, other) -> None:
+        """
+        Add statistics of another optimizer (e.g. from a worker process).
+        """
+        self.eliminated += other.eliminated
+        self.moves += other.moves
+        self.branches += other.branches
+        for name, count in other.hits.items():
+            self.hits[name] += count
+        self.tail_calls += other.tail_calls
+        for name, count in other.jumps.items():
+            self.jumps[name] += count
+
+    def report(self) -> None:
+        """
+        Print number of VM commands eliminated by the optimizer.
+        """
+        print(f'vm optimizer: {self.eliminated} commands eliminated')
+        if self.simplify_jumps:
+            threaded, removed, inverted, unreachable = self.jumps.values()
+            print(f'vm optimizer: {threaded} jumps threaded, {removed} '
+                  f'jumps to the next block removed, {inverted} not/if-goto '
+                  f'pairs inverted, {unreachable} unreachable commands '
+                  f'dropped')
+        if self.fuse_moves:
+            print(f'vm optimizer: {self.moves} push/pop pairs fused')
+        if self.fuse_branches:
+            print(f'vm optimizer: {self.branches} comparisons fused '
+                  f'with if-goto')
+        if self.superinstructions:
+            for name, count in self.hits.items():
+                print(f'vm optimizer: superinstruction {name}: '
+                      f'{count} hits')
+        if self.fuse_tail_calls:
+            print(f'vm optimizer: {self.tail_calls} tail calls')
+
+    def _fold_constants(self, commands):
+        """
+        Fold arithmetic on constants and drop identities. Commands which
+        fall out of the last WINDOW commands can no longer be folded
+        and are passed on.
+        """
+        window = deque()
+        count_in = 0
+        count_out = 0
+        for command in commands:
+            count_in += 1
+            opcode = command.opcode
+            if opcode in self.BINARY or opcode in self.UNARY:
+                if self._fold(window, opcode):
+                    continue
+            elif self._is_constant(command):
+                command = self._constant(self._to_signed(command.arg_2))
+            window.append(command)
+            while len(window) > self.WINDOW:
+                for folded in self._materialize(window.popleft()):
+                    count_out += 1
+                    yield folded
+        while window:
+            for folded in self._materialize(window.popleft()):
+                count_out += 1
+                yield folded
+        self.eliminated += count_in - count_out
+
+    def _fuse_moves(self, commands):
+        """
+        Replace adjacent push/pop pairs with MOVE commands.
+        """
+        pending = None
+        for command in commands:
+            if pending is not None:
+                # SP-relative entries move with SP and cannot be fused
+                if command.opcode == Opcode.POP \
+                        and Segment.STACK not in (pending.arg_1, command.arg_1):
+                    _, segment, index = pending
+                    pending = None
+                    self.moves += 1
+                    yield Command(Opcode.MOVE, (segment, index),
+                                  (command.arg_1, command.arg_2))
+                    continue
+                yield pending
+                pending = None
+            if command.opcode == Opcode.PUSH:
+                pending = command
+            else:
+                yield command
+        if pending is not None:
+            yield pending
+
+    def _simplify_jumps(self, commands):
+        """
+        Simplify the control flow of every function; commands before
+        the first 'function' command are simplified as one body too.
+        """
+        body = []
+        for command in commands:
+            if command.opcode == Opcode.FUNCTION:
+                yield from self._simplify_body(body)
+                yield command
+                body = []
+            else:
+                body.append(command)
+        yield from self._simplify_body(body)
+
+    def _simplify_body(self, body) -> list:
+        """
+        Return the commands of a function body with its jumps
+        simplified until nothing changes any more.
+        """
+        while True:
+            blocks = self._basic_blocks(body)
+            changed = self._simplify_blocks(blocks)
+            # labels no jump refers to only split blocks; drop them
+            targets = {command.arg_1 for _, block in blocks
+                       for command in block
+                       if command.opcode in (Opcode.GOTO, Opcode.IF)}
+            body = [command for labels, block in blocks
+                    for command in [label for label in labels
+                                    if label.arg_1 in targets] + block]
+            if not changed:
+                return body
+
+    def _basic_blocks(self, body) -> list:
+        """
+        Split a function body into basic blocks: [labels, commands]
+        pairs, where a block starts at its labels and ends after
+        a goto, an if-goto or a return.
+        """
+        blocks = [[[], []]]
+        for command in body:
+            labels, block = blocks[-1]
+            if command.opcode == Opcode.LABEL:
+                if block:
+                    blocks.append([[command], []])
+                else:
+                    labels.append(command)
+                continue
+            block.append(command)
+            if command.opcode in self.TERMINATORS \
+                    or command.opcode == Opcode.IF:
+                blocks.append([[], []])
+        if blocks[-1] == [[], []]:
+            blocks.pop()
+        return blocks
+
+    def _simplify_blocks(self, blocks) -> bool:
+        """
+        Apply one round of the jump simplifications to 'blocks' in
+        place; return whether anything changed.
+        """
+        where = {label.arg_1: position
+                 for position, (labels, _) in enumerate(blocks)
+                 for label in labels}
+        for _, block in blocks:
+            if block and block[-1].opcode in (Opcode.GOTO, Opcode.IF) \
+                    and block[-1].arg_1 not in where:
+                # a jump out of the body; leave it alone
+                return False
+        changed = False
+        for position, (_, block) in enumerate(blocks):
+            if not block or block[-1].opcode not in (Opcode.GOTO, Opcode.IF):
+                continue
+            if self._invert(position, blocks, where):
+                changed = True
+            jump = block[-1]
+            target = self._thread(jump.arg_1, blocks, where)
+            if target != jump.arg_1:
+                jump = block[-1] = Command(jump.opcode, target, '')
+                self.jumps['threaded'] += 1
+                changed = True
+            if jump.opcode == Opcode.GOTO and where[target] == position + 1:
+                block.pop()
+                self.jumps['to next removed'] += 1
+                changed = True
+        reachable = self._reachable(blocks, where)
+        for position in reversed(range(len(blocks))):
+            if position not in reachable:
+                self.jumps['unreachable'] += len(blocks[position][1])
+                del blocks[position]
+                changed = True
+        return changed
+
+    def _invert(self, position, blocks, where) -> bool:
+        """
+        Turn 'cmp / not / if-goto A' ending the block at 'position',
+        followed by a block made of 'goto B' and then by label A,
+        into 'cmp / if-goto B'; return whether it did.
+        """
+        block = blocks[position][1]
+        if len(block) < 3 or block[-1].opcode != Opcode.IF \
+                or block[-2].opcode != Opcode.NOT \
+                or block[-3].opcode not in self.JUMPS \
+                or where[block[-1].arg_1] != position + 2:
+            return False
+        labels, following = blocks[position + 1]
+        if labels or len(following) != 1 \
+                or following[0].opcode != Opcode.GOTO:
+            return False
+        # a comparison yields 0 or -1, so 'not / if-goto A' is taken
+        # exactly when the comparison is false
+        block[-2:] = [Command(Opcode.IF, following[0].arg_1, '')]
+        following.clear()
+        self.jumps['inverted'] += 1
+        return True
+
+    def _thread(self, label, blocks, where) -> str:
+        """
+        Return the label a jump to 'label' ends up at when following
+        the blocks which consist of a single goto.
+        """
+        seen = {label}
+        while True:
+            block = blocks[where[label]][1]
+            if len(block) != 1 or block[0].opcode != Opcode.GOTO \
+                    or block[0].arg_1 in seen:
+                return label
+            label = block[0].arg_1
+            seen.add(label)
+
+    def _reachable(self, blocks, where) -> set:
+        """
+        Return the positions of the blocks reachable from the first one.
+        """
+        reachable = set()
+        pending = [0] if blocks else []
+        while pending:
+            position = pending.pop()
+            if position in reachable or position >= len(blocks):
+                continue
+            reachable.add(position)
+            block = blocks[position][1]
+            last = block[-1].opcode if block else None
+            if last in (Opcode.GOTO, Opcode.IF):
+                pending.append(where[block[-1].arg_1])
+            if last not in self.TERMINATORS:
+                pending.append(position + 1)
+        return reachable
+
+    def _fuse_branches(self, commands):
+        """
+        Replace 'eq/gt/lt [not] if-goto' sequences with COMPARE_IF
+        commands.
+        """
+        pending = []
+        for command in commands:
+            opcode = command.opcode
+            if pending and opcode == Opcode.IF:
+                jump = self.JUMPS[pending[0].opcode][len(pending) - 1]
+                pending.clear()
+                self.branches += 1
+                yield Command(Opcode.COMPARE_IF, command.arg_1, jump)
+                continue
+            if len(pending) == 1 and opcode == Opcode.NOT:
+                pending.append(command)
+                continue
+            yield from pending
+            pending.clear()
+            if opcode in self.JUMPS:
+                pending.append(command)
+            else:
+                yield command
+        yield from pending
+
+    def _fuse_tail_calls(self, commands):
+        """
+        Replace 'call f n / return' pairs with TAIL_CALL commands.
+        """
+        pending = None
+        for command in commands:
+            if pending is not None:
+                if command.opcode == Opcode.RETURN:
+                    _, name, num_args = pending
+                    pending = None
+                    self.tail_calls += 1
+                    yield Command(Opcode.TAIL_CALL, name, num_args)
+                    continue
+                yield pending
+                pending = None
+            if command.opcode == Opcode.CALL:
+                pending = command
+            else:
+                yield command
+        if pending is not None:
+            yield pending
+
+    def _recognize_idioms(self, commands):
+        """
+        Replace the idioms of SUPERINSTRUCTIONS with single commands.
+        Every idiom ends the window it is matched in, so the tail of
+        the last IDIOM_LENGTH commands is checked after each command.
+        """
+        window = []
+        for command in commands:
+            window.append(command)
+            superinstruction = self._match_idiom(window)
+            if superinstruction is not None:
+                yield from window
+                window.clear()
+                if superinstruction.opcode != Opcode.INCREMENT \
+                        or superinstruction.arg_2[1]:
+                    yield superinstruction
+            elif len(window) > self.IDIOM_LENGTH:
+                yield window.pop(0)
+        yield from window
+
+    def _match_idiom(self, window):
+        """
+        Return the superinstruction replacing the idiom at the end of
+        'window' (and drop the idiom from it), or None.
+        """
+        last = window[-1]
+        if last.opcode == Opcode.POP and len(window) >= 2 \
+                and last.arg_1 == Segment.TEMP and last.arg_2 == 0 \
+                and window[-2].opcode == Opcode.CALL:
+            _, name, num_args = window[-2]
+            del window[-2:]
+            self.hits['call_discard'] += 1
+            return Command(Opcode.CALL_DISCARD, name, num_args)
+        if len(window) < 4:
+            return None
+        tail = window[-5:]
+        if tuple(tail[-4:]) == self.ARRAY_WRITE_TAIL:
+            del window[-4:]
+            self.hits['array_write'] += 1
+            return Command(Opcode.ARRAY_WRITE, '', '')
+        if last.opcode == Opcode.POP and last.arg_1 in self.DIRECT:
+            delta = self._increment(tail[-4:], last)
+            if delta is not None:
+                del window[-4:]
+                self.hits['increment'] += 1
+                return Command(Opcode.INCREMENT, last.arg_1,
+                               (last.arg_2, delta))
+        if len(tail) == 5 and last == (Opcode.PUSH, Segment.THAT, 0) \
+                and tail[3] == (Opcode.POP, Segment.POINTER, 1) \
+                and tail[2].opcode == Opcode.ADD \
+                and all(command.opcode == Opcode.PUSH
+                        and command.arg_1 in self.DIRECT
+                        | {Segment.CONSTANT} for command in tail[:2]):
+            del window[-5:]
+            self.hits['array_read'] += 1
+            return Command(Opcode.ARRAY_READ, tuple(tail[0][1:]),
+                           tuple(tail[1][1:]))
+        return None
+
+    def _increment(self, commands, pop):
+        """
+        Return the amount added to the target of 'pop' if 'commands'
+        are an increment of it, otherwise None.
+        """
+        first, second, operation, _ = commands
+        variable = (Opcode.PUSH, pop.arg_1, pop.arg_2)
+        if operation.opcode == Opcode.ADD:
+            if first == variable and self._is_constant(second):
+                return second.arg_2
+            if second == variable and self._is_constant(first):
+                return first.arg_2
+        elif operation.opcode == Opcode.SUB:
+            if first == variable and self._is_constant(second):
+                return -second.arg_2
+        return None
+
+    def _fold(self, output, opcode) -> bool:
+        """
+        Try to fold arithmetic 'opcode' into the tail of 'output'.
+        Return True if the command was absorbed.
+        """
+        if opcode in self.BINARY:
+            if len(output) >= 2 and self._is_constant(output[-1]) \
+                    and self._is_constant(output[-2]):
+                y = output.pop()[2]
+                x = output.pop()[2]
+                value = self._to_signed(self.BINARY[opcode](x, y))
+                output.append(self._constant(value))
+                return True
+            if output and self._is_constant(output[-1]) \
+                    and (output[-1][2], opcode) in self.IDENTITIES:
+                output.pop()
+                return True
+        elif opcode in self.UNARY:
+            if output and self._is_constant(output[-1]):
+                x = output.pop()[2]
+                value = self._to_signed(self.UNARY[opcode](x))
+                output.append(self._constant(value))
+                return True
+            if opcode in self.INVOLUTIONS and output \
+                    and output[-1].opcode == opcode:
+                output.pop()
+                return True
+        return False
+
+    def _materialize(self, command) -> tuple:
+        """
+        'push constant' only accepts 0..32767; rewrite folded constants
+        outside of that range as 'push constant' + 'neg' / 'not'.
+        """
+        if not self._is_constant(command) or command.arg_2 >= 0:
+            return (command,)
+        value = command.arg_2
+        if value == -32768:
+            return self._constant(32767), NO_ARG_COMMANDS[Opcode.NOT]
+        if value == -1:
+            return self._constant(0), NO_ARG_COMMANDS[Opcode.NOT]
+        return self._constant(-value), NO_ARG_COMMANDS[Opcode.NEG]
+
+    @staticmethod
+    def _is_constant(command) -> bool:
+        return command.opcode == Opcode.PUSH \
+            and command.arg_1 == Segment.CONSTANT
+
+    @staticmethod
+    def _constant(value: int) -> Command:
+        return Command(Opcode.PUSH, Segment.CONSTANT, value)
+
+    @staticmethod
+    def _to_signed(value: int) -> int:
+        """
+        Wrap value to a signed 16-bit integer (Hack word).
+        """
+        value &= 0xFFFF
+        return value - 0x10000 if value & 0x8000 else value
@@ -1,6 +1,25 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import contextlib
+import hashlib
+import io
+import mmap
 import sys
 import os
 
+from AsmEmitter import AsmEmitter
+from CallCounters import CallCounters
+from CallGraph import CallGraph
+from HackAssembler import HackWriter
+from Inliner import Inliner
+from PeepholeOptimizer import PeepholeOptimizer
+from SourceMap import SourceMap
+from TranslationCache import TranslationCache
+from VMOptimizer import VMOptimizer
+from VMCommand import (Opcode, Segment, Command, TracedCommand, COMMANDS,
+                       SEGMENTS, ARITHMETIC, NO_ARG_COMMANDS, NO_ARGS,
+                       LABEL_ARG, SEGMENT_ARGS)
+
 
 def main():
     """
@@ -8,162 +27,1132 @@ def main():
     into assembly code.
     <file.vm> -> <file.asm>
     """
-    if len(sys.argv) != 2:
-        print('Translate .vm files into assembly instruction')
-        print('Incorrent number of arguments (1 required).\n')
-        print('usage: python3 VMTranslator <input_file.vm>/<input_folder>\n')
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(
+        prog='VMTranslator',
+        description='Translate .vm files into assembly instructions.')
+    arg_parser.add_argument('source',
+                            help='<input_file.vm>/<input_folder> '
+                                 'or - for stdin')
+    arg_parser.add_argument('-o', '--output', metavar='FILE',
+                            help='output .asm file or - for stdout '
+                                 '(default: next to the source; stdout '
+                                 'when reading stdin)')
+    arg_parser.add_argument('--emit', choices=('asm', 'hack'), default='asm',
+                            help='write assembly (default) or assemble '
+                                 'in-process into a .hack file')
+    arg_parser.add_argument('--packed', action='store_true',
+                            help='with --emit hack, write packed big-endian '
+                                 '16-bit words (.bin) instead of binary text')
+    arg_parser.add_argument('--source-map', nargs='?', const=True,
+                            metavar='FILE',
+                            help='write a map from ROM addresses to VM '
+                                 'commands (default FILE: <output>.map)')
+    arg_parser.add_argument('--profile', nargs='?', const=True,
+                            metavar='FILE',
+                            help='count the calls of every function in RAM '
+                                 'and write the function index to FILE '
+                                 '(default: <output>.counters.json)')
+    arg_parser.add_argument('--profile-base', type=int, metavar='ADDRESS',
+                            help='RAM address of the call counters (default: '
+                                 'the top of the heap)')
+    arg_parser.add_argument('--bootstrap', action='store_true',
+                            help='always write the bootstrap code '
+                                 '(default: only for directories)')
+    arg_parser.add_argument('--mmap', action='store_true',
+                            help='read .vm files through memory maps')
+    arg_parser.add_argument('--shared-frames', action='store_true',
+                            help='emit one shared $CALL/$RETURN routine '
+                                 'instead of inlining the frame protocol')
+    arg_parser.add_argument('--shared-compare', action='store_true',
+                            help='emit one shared routine per comparison '
+                                 'kind instead of inlining eq/gt/lt')
+    arg_parser.add_argument('--top-of-stack', action='store_true',
+                            help='keep the top of the stack in the D '
+                                 'register across straight-line code')
+    arg_parser.add_argument('--prologue', choices=('speed', 'size'),
+                            help='zero the locals of every function with '
+                                 'the fastest or the smallest code (default: '
+                                 'one push per local)')
+    arg_parser.add_argument('--peephole', action='store_true',
+                            help='run the peephole optimizer over the '
+                                 'emitted assembly')
+    arg_parser.add_argument('--optimize', action='store_true',
+                            help='fold constant arithmetic and simplify '
+                                 'identities before translation')
+    arg_parser.add_argument('--fuse-moves', action='store_true',
+                            help='translate adjacent push/pop pairs into '
+                                 'direct memory-to-memory moves')
+    arg_parser.add_argument('--simplify-jumps', action='store_true',
+                            help='thread jumps and drop jumps to the next '
+                                 'command and unreachable code')
+    arg_parser.add_argument('--fuse-branches', action='store_true',
+                            help='translate comparisons feeding an if-goto '
+                                 'into a single conditional jump')
+    arg_parser.add_argument('--superinstructions', action='store_true',
+                            help='translate common idioms of compiled Jack '
+                                 '(increments, array reads/writes, discarded '
+                                 'call results) with hand-written code')
+    arg_parser.add_argument('--tail-calls', action='store_true',
+                            help='translate a call followed by return into '
+                                 'a jump reusing the frame of the caller')
+    arg_parser.add_argument('--inline', type=int, default=0, metavar='N',
+                            help='inline functions of at most N VM '
+                                 'commands at their call sites')
+    arg_parser.add_argument('--eliminate-dead', action='store_true',
+                            help='omit functions unreachable from Sys.init')
+    arg_parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                            help='translate the .vm files of a directory '
+                                 'in N worker processes')
+    arg_parser.add_argument('--cache', metavar='DIR',
+                            help='reuse translations of unchanged .vm files '
+                                 'stored in DIR')
+    arg_parser.add_argument('--cache-size', type=int, default=64, metavar='MB',
+                            help='size limit of the translation cache '
+                                 '(default: 64)')
+    args = arg_parser.parse_args()
+    if args.source_map and args.peephole:
+        arg_parser.error('--source-map cannot be combined with --peephole')
+    if args.profile and args.source == '-':
+        arg_parser.error('--profile needs a file or directory to index')
+
+    cache = None
+    if args.cache:
+        cache = TranslationCache(args.cache, translator_version(),
+                                 max_bytes=args.cache_size * 1024 * 1024)
+    with Parser(args.source, shared_frames=args.shared_frames,
+                shared_compare=args.shared_compare,
+                top_of_stack=args.top_of_stack, prologue=args.prologue,
+                peephole=args.peephole, optimize=args.optimize,
+                fuse_moves=args.fuse_moves,
+                fuse_branches=args.fuse_branches,
+                simplify_jumps=args.simplify_jumps,
+                superinstructions=args.superinstructions,
+                tail_calls=args.tail_calls, output=args.output,
+                use_mmap=args.mmap, bootstrap=args.bootstrap,
+                eliminate_dead=args.eliminate_dead, inline=args.inline,
+                cache=cache, emit=args.emit, packed=args.packed,
+                source_map=args.source_map, profile=args.profile,
+                profile_base=args.profile_base) as vmtranslator:
+        # keep the reports out of the program when writing to stdout
+        log = sys.stderr if vmtranslator.to_stdout else sys.stdout
+        with contextlib.redirect_stdout(log):
+            vmtranslator.parse(jobs=args.jobs)
+
+
+def translator_version() -> str:
+    """
+    Return a version string of the translator: a hash of the source
+    of every module taking part in translation, so cached translations
+    are invalidated whenever the translator changes.
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in ('VMTranslator.py', 'VMCommand.py', 'VMOptimizer.py',
+                   'PeepholeOptimizer.py', 'AsmEmitter.py', 'CallGraph.py',
+                   'Inliner.py', 'CallCounters.py', 'SourceMap.py'):
+        with open(os.path.join(directory, module), 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()[:16]
+
+
+def translate_fragment(job):
+    """
+    Worker of the process pool used by Parser.parse(jobs=N).
+
+    Translate a single .vm file into an assembly fragment and return
+    it together with the statistics collected while translating it.
+    """
+    source, file_, options = job
+    parser = Parser(source, **options)
+    fragment = io.StringIO()
+    output = fragment
+    if parser.peephole:
+        output = PeepholeOptimizer(fragment)
+    translator = Translator(output, parser.shared_frames,
+                            shared_compare=parser.shared_compare,
+                            source_map=parser.source_map,
+                            counters=parser.counters,
+                            top_of_stack=parser.top_of_stack,
+                            prologue=parser.prologue)
+    parser.translate_file(file_, translator, output)
+    peephole_stats = None
+    if parser.peephole:
+        peephole_stats = (output.hits, output.file_stats)
+    inlined = parser.inliner.inlined if parser.inliner else None
+    return (fragment.getvalue(), translator.stats(), parser.optimizer,
+            peephole_stats, inlined, parser.source_map)
 
-    with Parser(sys.argv[1]) as vmtranslator:
-        vmtranslator.parse()
-         
 
 class Parser:
 
-    def __init__(self, source):
+    # name used in place of the file name when reading stdin
+    STDIN_NAME = 'Stdin.vm'
+
+    def __init__(self, source, shared_frames=False, peephole=False,
+                 optimize=False, fuse_moves=False, output=None,
+                 use_mmap=False, bootstrap=False, eliminate_dead=False,
+                 dead_functions=(), inline=0, inline_functions=(),
+                 cache=None, shared_compare=False, fuse_branches=False,
+                 emit='asm', packed=False, source_map=False, profile=False,
+                 profile_base=None, profile_functions=(),
+                 top_of_stack=False, prologue=None, superinstructions=False,
+                 tail_calls=False, simplify_jumps=False):
         """
-        Initialize Parser instances with path to file/directory.
+        Initialize Parser instances with path to file/directory;
+        '-' reads the commands from stdin.
+
+        With eliminate_dead, functions unreachable from Sys.init
+        (see CallGraph) are left out of the output; dead_functions
+        names functions to leave out directly.
+
+        With inline > 0, calls to functions of at most 'inline'
+        commands are replaced with their bodies (see Inliner);
+        inline_functions passes bodies analysed by another Parser.
+
+        With a TranslationCache, files whose translation is cached
+        are spliced into the output instead of being translated.
+
+        With emit='hack', the assembly is assembled in-process (see
+        HackWriter) into a .hack file, or a .bin file of packed 16-bit
+        words with packed set.
+
+        With source_map, a SourceMap of the program is written to the
+        given path, or next to the output as <name>.map when True.
+
+        With profile, every function prologue and call site increments
+        a counter in RAM (see CallCounters); the function index is
+        written to the given path, or next to the output as
+        <name>.counters.json when True. profile_functions passes an
+        index built by another Parser.
+
+        With top_of_stack, the translator keeps the top of the stack
+        in the D register across straight-line code.
+
+        With prologue 'speed' or 'size', function prologues zero their
+        locals with the fastest or the smallest code.
+
+        With simplify_jumps, the control flow of every function is
+        simplified before translation (see VMOptimizer); a function is
+        held in memory while it is simplified.
+
+        With tail_calls, a call followed by return jumps to the called
+        function reusing the frame of the caller, so tail recursion
+        runs in constant stack space.
+
+        Input is streamed: files are read line by line (or through
+        a memory map with use_mmap) and every stage after the parser
+        works on a bounded window, so memory use does not grow
+        with the size of the input.
         """
         self.source = source
         self.is_dir = None
+        self.output = output
+        self.emit = emit
+        self.packed = packed and emit == 'hack'
+        self.extension = '.asm'
+        if emit == 'hack':
+            self.extension = '.bin' if packed else '.hack'
+        self.use_mmap = use_mmap
+        self.bootstrap = bootstrap
+        self.cache = cache
+        self.eliminate_dead = eliminate_dead
+        self.dead_functions = frozenset(dead_functions)
+        self.dead_code = None
+        self.options = {
+            'shared_frames': shared_frames,
+            'shared_compare': shared_compare,
+            'top_of_stack': top_of_stack,
+            'prologue': prologue,
+            'peephole': peephole,
+            'optimize': optimize,
+            'fuse_moves': fuse_moves,
+            'fuse_branches': fuse_branches,
+            'superinstructions': superinstructions,
+            'tail_calls': tail_calls,
+            'simplify_jumps': simplify_jumps,
+            'use_mmap': use_mmap,
+            'dead_functions': tuple(sorted(dead_functions)),
+            'inline': inline,
+            'inline_functions': tuple(inline_functions),
+            'source_map': bool(source_map),
+            'profile': bool(profile),
+            'profile_base': profile_base,
+            'profile_functions': tuple(profile_functions),
+        }
+        if source_map and peephole:
+            raise ValueError('source maps are not supported with the '
+                             'peephole optimizer')
+        self.source_map_path = source_map
+        self.source_map = SourceMap() if source_map else None
+        self.profile_path = profile
+        self.counters = None
+        if profile and profile_functions:
+            self.counters = CallCounters(profile_functions, profile_base)
+        self.shared_frames = shared_frames
+        self.shared_compare = shared_compare
+        self.top_of_stack = top_of_stack
+        self.prologue = prologue
+        self.peephole = peephole
+        self.optimizer = None
+        if optimize or fuse_moves or fuse_branches or superinstructions \
+                or tail_calls or simplify_jumps:
+            self.optimizer = VMOptimizer(
+                fold=optimize, fuse_moves=fuse_moves,
+                fuse_branches=fuse_branches,
+                superinstructions=superinstructions, tail_calls=tail_calls,
+                simplify_jumps=simplify_jumps)
+        self.inliner = None
+        if inline:
+            self.inliner = Inliner(inline, inline_functions)
 
-    def parse(self):
+    def parse(self, jobs=1):
         """
         Retrieve all commands from the source file(s);
         and all arguments.
+
+        With jobs > 1 the files are translated in a process pool;
+        the fragments are written in the same (sorted) order as the
+        serial path, so the output is identical.
         """
-        translator = Translator(self.target)
-        if len(self.files) > 1:
+        if self.inliner and not self.inliner.functions:
+            self.find_inline_functions()
+        if self.eliminate_dead:
+            self.find_dead_functions()
+        if self.profile_path and self.counters is None:
+            self.index_functions()
+        output = self.target
+        if self.peephole:
+            output = PeepholeOptimizer(self.target)
+        translator = Translator(output, self.shared_frames,
+                                shared_compare=self.shared_compare,
+                                source_map=self.source_map,
+                                counters=self.counters,
+                                top_of_stack=self.top_of_stack,
+                                prologue=self.prologue)
+        if len(self.files) > 1 or self.bootstrap:
             translator.write_init()
+        if self.shared_frames:
+            translator.write_shared_frames()
+        if self.shared_compare:
+            translator.write_shared_comparisons()
+        translator.flush()
+        if self.peephole:
+            output.end_file('bootstrap')
+        if self.cache or (jobs > 1 and len(self.files) > 1):
+            results = self.translate_fragments(jobs)
+            for (fragment, stats, optimizer, peephole_stats,
+                 inlined, source_map) in results:
+                self.target.write(fragment)
+                translator.add_stats(stats)
+                if self.source_map is not None:
+                    self.source_map.extend(source_map)
+                if self.inliner:
+                    self.inliner.merge(inlined)
+                if self.optimizer:
+                    self.optimizer.merge(optimizer)
+                if self.peephole:
+                    output.merge(*peephole_stats)
+        else:
+            for file_ in self.files:
+                self.translate_file(file_, translator, output)
+        if self.prologue is not None:
+            routine_size = translator.write_shared_locals()
+            translator.flush()
+            if self.peephole:
+                output.end_file('shared locals')
+        if self.shared_frames:
+            translator.report_shared_frames()
+        if self.shared_compare:
+            translator.report_shared_comparisons()
+        if self.prologue is not None:
+            translator.report_prologues(routine_size)
+        if self.peephole:
+            output.report()
+        if self.optimizer:
+            self.optimizer.report()
+        if self.cache:
+            self.cache.report()
+        if self.inliner:
+            self.report_inlining()
+        if self.eliminate_dead:
+            self.report_dead_code()
+        if self.emit == 'hack':
+            self.target.finish()
+            self.target.report()
+        if self.source_map is not None:
+            self.source_map.save(self.source_map_path)
+            print(f'source map: {len(self.source_map.entries)} ranges, '
+                  f'{self.source_map.size} ROM words')
+        if self.counters is not None:
+            self.counters.save(self.profile_path)
+            print(f'profile: {len(self.counters.functions)} functions, '
+                  f'counters at RAM[{self.counters.base}:'
+                  f'{self.counters.base + self.counters.size}]')
+
+    def index_functions(self) -> None:
+        """
+        Build the index of the call counters from every function
+        defined or called in the program (and by the bootstrap).
+        """
+        if '-' in self.files:
+            raise ValueError('call counters need a file or directory '
+                             'to index')
+        commands = [command for file_ in self.files
+                    for command in self.read_commands(file_)]
+        if len(self.files) > 1 or self.bootstrap:
+            commands.append(Command(Opcode.CALL, 'Sys.init', 0))
+        self.counters = CallCounters.from_commands(
+            commands, self.options['profile_base'])
+        self.options['profile_functions'] = self.counters.functions
+        self.options['profile_base'] = self.counters.base
+
+    def find_inline_functions(self) -> None:
+        """
+        Collect the bodies of the functions small enough to be inlined
+        from every file of the program.
+        """
+        if '-' in self.files:
+            return
         for file_ in self.files:
-            try:
-                counter = 0
-                translator.current_file = file_
-                fp = open(file_, 'rt')
-                for line in fp.readlines():
-                    if line[:2] in {'\n', '//'}:
-                        continue
-                    line_rstrip = line.rstrip('\n')
-                    arg_1 = ''
-                    arg_2 = ''
-                    command_type = self.get_command_type(line_rstrip)
-                    if command_type != 'C_RETURN':
-                        arg_1 = self.get_argument_1(line_rstrip)
-                    if command_type in {'C_PUSH', 'C_POP', 
-                                        'C_FUNCTION', 'C_CALL'}:
-                        arg_2 = self.get_argument_2(line_rstrip)
-                    translator.translate(command_type, arg_1, arg_2, counter,
-                                         self.source)
-                    counter += 1
-            finally:
-                fp.close()
-
-    def get_command_type(self, command: str) -> str:
-        """
-        Return command type based on the command received.
-        """
-        commands = {
-                'add': 'C_ARITHMETIC',
-                'sub': 'C_ARITHMETIC',
-                'neg': 'C_ARITHMETIC',
-                'eq': 'C_ARITHMETIC',
-                'gt': 'C_ARITHMETIC',
-                'lt': 'C_ARITHMETIC',
-                'and': 'C_ARITHMETIC',
-                'or': 'C_ARITHMETIC',
-                'not': 'C_ARITHMETIC',
-                'push': 'C_PUSH',
-                'pop': 'C_POP',
-                'label': 'C_LABEL',
-                'goto': 'C_GOTO',
-                'if-goto': 'C_IF',
-                'function': 'C_FUNCTION',
-                'return': 'C_RETURN',
-                'call': 'C_CALL',
-        }
-        command = command.split()[0]
-        return commands[command]
+            self.inliner.add_file(file_, self.read_commands(file_))
+        self.options['inline_functions'] = tuple(
+            sorted(self.inliner.functions.items()))
+
+    def report_inlining(self) -> None:
+        """
+        Print the inlined functions with the estimated number of cycles
+        saved by each inlined call: the frame protocol of call/return
+        (straight-line code, one cycle per word) minus the glue code
+        of the inlined body.
+        """
+        frame = Translator.INLINE_CALL_SIZE + Translator.INLINE_RETURN_SIZE
+        total = 0
+        for name, sites in sorted(self.inliner.inlined.items()):
+            file_ = self.inliner.functions[name][0]
+            glue = self._instruction_count(file_, self.inliner.glue(name))
+            saved = frame - glue
+            total += saved * sites
+            print(f'inline: {name}: {sites} call sites, '
+                  f'~{saved} cycles saved per call')
+        print(f'inline: {len(self.inliner.inlined)} functions inlined, '
+              f'~{total} cycles saved if every site runs once')
+
+    def _instruction_count(self, file_, commands) -> int:
+        """
+        Return the number of instructions 'commands' of 'file_'
+        translate to.
+        """
+        fragment = io.StringIO()
+        translator = Translator(fragment, self.shared_frames,
+                                shared_compare=self.shared_compare,
+                                top_of_stack=self.top_of_stack,
+                                prologue=self.prologue)
+        translator.current_file = file_
+        for counter, command in enumerate(commands):
+            translator.translate(command, counter, self.source)
+        translator.flush()
+        return sum(1 for line in fragment.getvalue().splitlines()
+                   if not line.startswith('('))
+
+    def find_dead_functions(self) -> None:
+        """
+        Build the call graph of the whole program and mark the functions
+        unreachable from Sys.init as dead; measure the ROM words their
+        translation would take.
+        """
+        if '-' in self.files:
+            return
+        graph = CallGraph()
+        for file_ in self.files:
+            commands = self.read_commands(file_)
+            if self.inliner:
+                # a separate inliner keeps the call site counts intact
+                inliner = Inliner(self.inliner.threshold,
+                                  self.inliner.functions)
+                commands = inliner.inline(commands, file_)
+            graph.add_file(file_, commands)
+        if CallGraph.ENTRY_POINT not in graph.calls:
+            return
+        self.dead_functions = frozenset(graph.dead())
+        self.options['dead_functions'] = tuple(sorted(self.dead_functions))
+        self.dead_code = []
+        for file_ in self.files:
+            names = {name for name in self.dead_functions
+                     if graph.files[name] == file_}
+            if names:
+                self.dead_code.extend(self._function_sizes(file_, names))
+
+    def _function_sizes(self, file_, names) -> list:
+        """
+        Translate the functions 'names' of 'file_' on their own;
+        return a (function name, ROM words) pair for each of them.
+        """
+        fragment = io.StringIO()
+        translator = Translator(fragment, self.shared_frames,
+                                shared_compare=self.shared_compare,
+                                top_of_stack=self.top_of_stack,
+                                prologue=self.prologue)
+        translator.current_file = file_
+        commands = CallGraph.select(self.read_commands(file_), names)
+        for counter, command in enumerate(commands):
+            translator.translate(command, counter, self.source)
+        translator.flush()
+        sizes = []
+        for line in fragment.getvalue().splitlines():
+            if line[1:-1] in names:
+                sizes.append([line[1:-1], 0])
+            elif not line.startswith('('):
+                sizes[-1][1] += 1
+        return [tuple(size) for size in sizes]
+
+    def report_dead_code(self) -> None:
+        """
+        Print the functions left out by dead function elimination.
+        """
+        if self.dead_code is None:
+            print('dead code: no Sys.init in the program, nothing removed')
+            return
+        words = 0
+        for name, size in self.dead_code:
+            words += size
+            print(f'dead code: {name}: {size} ROM words')
+        print(f'dead code: {len(self.dead_code)} functions removed, '
+              f'{words} ROM words ({words * 2} bytes) saved')
+
+    def translate_fragments(self, jobs=1) -> list:
+        """
+        Translate every file into a separate fragment (see
+        translate_fragment); return the results in file order.
 
-    def get_argument_1(self, command: str) -> str:
+        Cached fragments are taken from the cache, the others are
+        translated (in a process pool when jobs > 1) and stored.
         """
-        Return first argument of the command received;
-        return command itself if C_ARITHMETIC.
+        results = [None] * len(self.files)
+        keys = [None] * len(self.files)
+        missing = []
+        for position, file_ in enumerate(self.files):
+            if self.cache and file_ != '-':
+                keys[position] = self.cache.key(file_, self.source,
+                                                self.options)
+                results[position] = self.cache.get(keys[position])
+            if results[position] is None:
+                missing.append(position)
+        job_list = [(self.source, self.files[position], self.options)
+                    for position in missing]
+        if jobs > 1 and len(job_list) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                translated = list(executor.map(translate_fragment, job_list))
+        else:
+            translated = [translate_fragment(job) for job in job_list]
+        for position, result in zip(missing, translated):
+            results[position] = result
+            if keys[position] is not None:
+                self.cache.put(keys[position], result)
+        return results
+
+    def translate_file(self, file_, translator, output) -> None:
         """
-        argument = command.split()
-        if argument[0] in {'add', 'sub', 'lt', 'eq', 'gt', 'not'}:
-            return argument[0]
+        Translate every command of a single file. Label and return
+        address names only depend on the file itself, hence files
+        can be translated independently of each other.
+        """
+        source = self.source
+        if file_ == '-':
+            source = self.STDIN_NAME
+        translator.current_file = self.STDIN_NAME if file_ == '-' else file_
+        translator.current_function = None
+        translator.last_line = 0
+        if self.source_map is not None:
+            commands = self.read_traced_commands(file_)
         else:
-            return argument[1]
+            commands = self.read_commands(file_)
+        if self.inliner:
+            commands = self.inliner.inline(commands, file_)
+        if self.dead_functions:
+            commands = CallGraph.select(commands, self.dead_functions,
+                                        keep=False)
+        if self.optimizer:
+            commands = self.optimizer.optimize(commands)
+        translate = translator.translate
+        for counter, command in enumerate(commands):
+            translate(command, counter, source)
+        translator.flush()
+        if self.peephole:
+            output.end_file(file_)
+
+    def read_commands(self, file_):
+        """
+        Yield a pre-decoded Command for every command of the file.
+
+        Every line is split exactly once; its keyword selects the opcode
+        and the layout of the arguments from the COMMANDS table.
+        """
+        commands = COMMANDS
+        segments = SEGMENTS
+        no_arg_commands = NO_ARG_COMMANDS
+        with self.open_lines(file_) as lines:
+            for line in lines:
+                parts = line.split()
+                if not parts or parts[0].startswith('//'):
+                    continue
+                opcode, layout = commands[parts[0]]
+                if layout == SEGMENT_ARGS:
+                    yield Command(opcode, segments[parts[1]], int(parts[2]))
+                elif layout == NO_ARGS:
+                    yield no_arg_commands[opcode]
+                elif layout == LABEL_ARG:
+                    yield Command(opcode, parts[1], '')
+                else:
+                    yield Command(opcode, parts[1], int(parts[2]))
+
+    def read_traced_commands(self, file_):
+        """
+        Yield the commands of read_commands as TracedCommand records
+        carrying their line number.
+        """
+        self.line_number = 0
+        for command in self.read_commands(file_):
+            yield TracedCommand(command, self.line_number)
+
+    def _numbered(self, lines):
+        """
+        Pass 'lines' on, keeping the number of the last one
+        in line_number.
+        """
+        for self.line_number, line in enumerate(lines, 1):
+            yield line
 
-    def get_argument_2(self, command: str) -> int:
+    @contextlib.contextmanager
+    def open_lines(self, file_):
         """
-        Return second argument of the command received;
-        converted to int.
+        Context manager yielding an iterator over the lines of 'file_'
+        ('-' for stdin); lines are read lazily.
         """
-        SECOND_ARGUMENT = 2
-        argument = command.split()[SECOND_ARGUMENT]
-        return int(argument)
+        if self.source_map is not None:
+            with self._open_lines(file_) as lines:
+                yield self._numbered(lines)
+        else:
+            with self._open_lines(file_) as lines:
+                yield lines
+
+    @contextlib.contextmanager
+    def _open_lines(self, file_):
+        if file_ == '-':
+            yield sys.stdin
+        elif self.use_mmap:
+            with open(file_, 'rb') as fp:
+                if os.fstat(fp.fileno()).st_size == 0:
+                    yield iter(())
+                    return
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    yield (line.decode() for line in iter(mm.readline, b''))
+        else:
+            with open(file_, 'rt') as fp:
+                yield fp
 
     def __enter__(self):
         self.files = []
-        if os.path.isdir(self.source):
+        if self.source == '-':
+            self.files.append('-')
+            output = '-'
+        elif os.path.isdir(self.source):
             self.is_dir = True
-            for file_ in os.listdir(self.source):
+            for file_ in sorted(os.listdir(self.source)):
                 if '.vm' in file_:
                     file_ = os.path.join(self.source, file_)
                     self.files.append(file_)
-            filepath = os.path.join('.', self.source, f'{self.source}.asm')
-            self.target = open(f'{filepath}', 'wt')
+            name = os.path.basename(os.path.normpath(self.source))
+            output = os.path.join(self.source, f'{name}{self.extension}')
         elif '.vm' in self.source:
             self.files.append(self.source)
-            name, extension = self.source.split('.')
-            self.target = open(f'{name}.asm', 'wt')
+            name, extension = os.path.splitext(self.source)
+            output = f'{name}{self.extension}'
         else:
             print('Problem opening input file.')
             print('Only .vm files are accepted')
             sys.exit(1)
+        output = self.output or output
+        self.to_stdout = output == '-'
+        if self.to_stdout:
+            self.output_file = sys.stdout.buffer if self.packed else sys.stdout
+        else:
+            self.output_file = open(output, 'wb' if self.packed else 'wt')
+        self.target = self.output_file
+        if self.emit == 'hack':
+            self.target = HackWriter(self.output_file, self.packed)
+        if self.source_map_path is True:
+            if self.to_stdout:
+                print('A source map file is needed when writing to stdout.')
+                sys.exit(1)
+            self.source_map_path = f'{os.path.splitext(output)[0]}.map'
+        if self.profile_path is True:
+            if self.to_stdout:
+                print('A counter index file is needed when writing to stdout.')
+                sys.exit(1)
+            self.profile_path = \
+                f'{os.path.splitext(output)[0]}.counters.json'
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.to_stdout:
+            self.output_file.flush()
+            return
         if exc_value is None:
-            print('.asm file created succesfully')
-        self.target.close()
+            print(f'{self.extension} file created succesfully')
+        self.output_file.close()
 
 
 class Translator:
 
-    def __init__(self, fp):
+    # size (in ROM words) of the inlined call/return sequences
+    INLINE_CALL_SIZE = 47
+    INLINE_RETURN_SIZE = 51
+    # size (in ROM words) of the inlined eq/gt/lt sequence and of a
+    # call site of the shared comparison routines
+    INLINE_COMPARE_SIZE = 22
+    SHARED_COMPARE_SITE_SIZE = 4
+    # largest segment index reached with A=A+1 steps in write_move
+    MOVE_UNROLL_LIMIT = 6
+    # most locals zeroed by the shared $LOCALS routine
+    SHARED_LOCALS_LIMIT = 16
+    # ROM words (and cycles) of the unrolled 'push constant 0' per local
+    PUSH_ZERO_SIZE = 7
+    # most arguments a tail call moves into place; larger ones are
+    # translated as a plain call and return
+    TAIL_CALL_ARGS_LIMIT = MOVE_UNROLL_LIMIT + 1
+    SEGMENT_POINTERS = {
+        Segment.LOCAL: 'LCL',
+        Segment.ARGUMENT: 'ARG',
+        Segment.THIS: 'THIS',
+        Segment.THAT: 'THAT',
+    }
+
+    def __init__(self, fp, shared_frames=False, buffered=True,
+                 shared_compare=False, source_map=None, counters=None,
+                 top_of_stack=False, prologue=None):
         """
         Initialize Translator instance. Receive file pointer to output file.
+
+        When shared_frames is set, call and return commands jump into
+        a single $CALL/$RETURN routine (see write_shared_frames)
+        instead of inlining the whole frame protocol at every site.
+
+        When shared_compare is set, eq/gt/lt jump into a shared $EQ,
+        $GT or $LT routine (see write_shared_comparisons) instead of
+        inlining a branch-and-label sequence at every site.
+
+        When buffered is set (default), output goes through an AsmEmitter
+        which caches the text of context-free commands and writes to
+        'fp' in large chunks; call flush() once done.
+
+        With a SourceMap (buffered output only), the ROM range of every
+        command is recorded in it. Commands made up by the optimizer
+        or the inliner are attributed to the line of the last command
+        read from the file.
+
+        With CallCounters, function prologues and call sites increment
+        the counters of the function (see write_counter).
+
+        When top_of_stack is set, the top of the stack is kept in the
+        D register across straight-line code (see
+        _build_top_of_stack_handlers).
+
+        With prologue 'speed' or 'size', the locals of every function
+        are zeroed by the strategy taking the fewest cycles or ROM
+        words (see write_locals) instead of one push per local.
         """
-        self.fp = fp
+        if source_map is not None and not buffered:
+            raise ValueError('source maps need buffered output')
+        self.buffered = buffered
+        self.fp = AsmEmitter(fp, source_map=source_map) if buffered else fp
+        self.source_map = source_map
+        self.counters = counters
+        self.last_line = 0
         self.current_file = None
+        self.current_function = None
+        # rendered text of commands that do not depend on the counter;
+        # commands touching the static segment depend on the file too
+        self.templates = {}
+        self.file_templates = {}
+        self.templates_file = None
+        self.cacheable = {Opcode.ADD, Opcode.SUB, Opcode.NEG, Opcode.AND,
+                          Opcode.OR, Opcode.NOT, Opcode.PUSH, Opcode.POP,
+                          Opcode.MOVE, Opcode.INLINE_RETURN,
+                          Opcode.INCREMENT, Opcode.ARRAY_READ,
+                          Opcode.ARRAY_WRITE}
+        if not shared_frames:
+            # shared returns update the ROM statistics, keep them uncached
+            self.cacheable.add(Opcode.RETURN)
+        self.shared_frames = shared_frames
+        self.shared_frames_size = 0
+        self.rom_saved = 0
+        self.call_sites = 0
+        self.return_sites = 0
+        self.shared_compare = shared_compare
+        self.shared_compare_size = 0
+        self.compare_sites = 0
+        self.prologue = prologue
+        # strategy -> [functions, ROM words, cycles] of the prologues
+        self.prologues = {strategy: [0, 0, 0]
+                          for strategy in ('unrolled', 'loop', 'shared')}
+        self.prologue_locals = 0
+        self.shared_locals = 0
+        self.top_of_stack = top_of_stack
+        # True while the top of the stack lives in D instead of RAM
+        self.top_in_d = False
+        # (command, top_in_d) -> top_in_d after a cached command
+        self.top_after = {}
+        self.handlers = self._build_handlers()
+        if top_of_stack:
+            self._build_top_of_stack_handlers()
+        self.push_handlers = {
+            Segment.CONSTANT: lambda index, counter, filename:
+                self.handle_constant_push(index),
+            Segment.LOCAL: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_push(Segment.LOCAL, index),
+            Segment.ARGUMENT: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_push(Segment.ARGUMENT, index),
+            Segment.THIS: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_push(Segment.THIS, index),
+            Segment.THAT: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_push(Segment.THAT, index),
+            Segment.TEMP: lambda index, counter, filename:
+                self.handle_temp_push(Segment.TEMP, index),
+            Segment.POINTER: lambda index, counter, filename:
+                self.handle_pointer_push(Segment.POINTER, index),
+            Segment.STATIC: lambda index, counter, filename:
+                self.handle_static_push(Segment.STATIC, index, counter,
+                                        filename),
+            Segment.STACK: lambda index, counter, filename:
+                self.handle_stack_push(Segment.STACK, index),
+        }
+        self.pop_handlers = {
+            Segment.LOCAL: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_pop(Segment.LOCAL, index),
+            Segment.ARGUMENT: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_pop(Segment.ARGUMENT, index),
+            Segment.THIS: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_pop(Segment.THIS, index),
+            Segment.THAT: lambda index, counter, filename:
+                self.handle_lcl_arg_this_that_pop(Segment.THAT, index),
+            Segment.TEMP: lambda index, counter, filename:
+                self.handle_temp_pop(Segment.TEMP, index),
+            Segment.POINTER: lambda index, counter, filename:
+                self.handle_pointer_pop(Segment.POINTER, index),
+            Segment.STATIC: lambda index, counter, filename:
+                self.handle_static_pop(Segment.STATIC, index, counter,
+                                       filename),
+            Segment.STACK: lambda index, counter, filename:
+                self.handle_stack_pop(Segment.STACK, index),
+        }
 
-    def translate(self, command_type, arg_1, arg_2, counter, filename) -> None:
-        """
-        Delegate translation of commands based on their command type.
-        """
-        if command_type == 'C_ARITHMETIC':
-            self.write_arithmetic(arg_1, counter)
-        elif command_type in {'C_PUSH', 'C_POP'}:
-            self.write_push_pop(command_type, arg_1, arg_2, counter, filename)
-        elif command_type == 'C_LABEL':
-            self.write_label(command_type, arg_1, filename)
-        elif command_type == 'C_IF':
-            self.write_if(command_type, arg_1, filename)
-        elif command_type == 'C_GOTO':
-            self.write_goto(command_type, arg_1, filename)
-        elif command_type == 'C_CALL':
-            self.write_call(arg_1, arg_2, counter)
-        elif command_type == 'C_FUNCTION':
-            self.write_function(arg_1, arg_2)
-        elif command_type == 'C_RETURN':
-            self.write_return()
+    def _build_handlers(self) -> list:
+        """
+        Return the handler table, indexed by Opcode. Every handler
+        receives (arg_1, arg_2, counter, filename).
+        """
+        handlers = [None] * len(Opcode)
+        for opcode, command in ARITHMETIC.items():
+            handlers[opcode] = (
+                lambda arg_1, arg_2, counter, filename, command=command:
+                self.write_arithmetic(command, counter))
+        handlers[Opcode.PUSH] = self.write_push
+        handlers[Opcode.POP] = self.write_pop
+        handlers[Opcode.LABEL] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_label(Opcode.LABEL, arg_1, filename))
+        handlers[Opcode.GOTO] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_goto(Opcode.GOTO, arg_1, filename))
+        handlers[Opcode.IF] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_if(Opcode.IF, arg_1, filename))
+        handlers[Opcode.FUNCTION] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_function(arg_1, arg_2))
+        handlers[Opcode.CALL] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_call(arg_1, arg_2, counter))
+        handlers[Opcode.RETURN] = (
+            lambda arg_1, arg_2, counter, filename: self.write_return())
+        handlers[Opcode.MOVE] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_move(arg_1, arg_2, filename))
+        handlers[Opcode.INLINE_RETURN] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_inline_return(arg_2))
+        handlers[Opcode.COMPARE_IF] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_compare_if(arg_1, arg_2, filename))
+        handlers[Opcode.INCREMENT] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_increment(arg_1, *arg_2, filename))
+        handlers[Opcode.ARRAY_READ] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_array_read(arg_1, arg_2, filename))
+        handlers[Opcode.ARRAY_WRITE] = (
+            lambda arg_1, arg_2, counter, filename: self.write_array_write())
+        handlers[Opcode.CALL_DISCARD] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_call_discard(arg_1, arg_2, counter))
+        handlers[Opcode.TAIL_CALL] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_tail_call(arg_1, arg_2, counter))
+        return handlers
+
+    def translate(self, command, counter, filename) -> None:
+        """
+        Delegate translation of a Command through the handler table.
+        """
+        opcode, arg_1, arg_2 = command
+        handler = self.handlers[opcode]
+        if not self.buffered:
+            handler(arg_1, arg_2, counter, filename)
+            return
+        if self.source_map is not None:
+            self._mark_source(command)
+        if self.current_file != self.templates_file:
+            self.file_templates.clear()
+            self.templates_file = self.current_file
+        templates = self.templates
+        if opcode not in self.cacheable:
+            command = None
+        elif arg_1 == Segment.STATIC or (
+                opcode in (Opcode.MOVE, Opcode.ARRAY_READ)
+                and Segment.STATIC in (arg_1[0], arg_2[0])):
+            templates = self.file_templates
+        if self.top_of_stack and command is not None:
+            # the text depends on where the top of the stack is
+            command = (command, self.top_in_d)
+        self.fp.emit(templates, command, handler, arg_1, arg_2, counter,
+                     filename)
+        if self.top_of_stack and command is not None:
+            # a cache hit does not run the handler; replay its effect
+            self.top_in_d = self.top_after.setdefault(command, self.top_in_d)
+
+    def _mark_source(self, command) -> None:
+        """
+        Start the source map range of 'command'.
+        """
+        line = getattr(command, 'line', None)
+        if line is None:
+            line = self.last_line
+        self.last_line = line
+        function = self.current_function
+        if command.opcode == Opcode.FUNCTION:
+            function = command.arg_1
+        self.fp.mark((self.current_file, line, function or '',
+                      self.source_map.text(command)))
+
+    def _mark_routine(self, name) -> None:
+        """
+        Start the source map range of code not coming from a command.
+        """
+        if self.source_map is not None:
+            self.fp.mark(('', 0, '', name))
+
+    def flush(self) -> None:
+        """
+        Write out everything buffered by the emission engine.
+        """
+        self.spill_top()
+        if self.buffered:
+            self.fp.flush()
+
+    def _build_top_of_stack_handlers(self) -> None:
+        """
+        Replace the handlers with ones keeping the top of the stack
+        in D. While top_in_d is set, RAM[SP] is where the top would be
+        stored, i.e. SP does not count it.
+
+        push loads its value straight into D; arithmetic, comparisons,
+        pop and if-goto consume D instead of reading RAM[SP - 1]. The
+        stack is materialized (see spill_top) before every other
+        command: labels, branches, calls, function entries, returns and
+        the moves and glue of the optimizer and the inliner, so they
+        all see the usual stack layout.
+        """
+        handlers = self.handlers
+        for opcode in (Opcode.LABEL, Opcode.GOTO, Opcode.FUNCTION,
+                       Opcode.CALL, Opcode.RETURN, Opcode.MOVE,
+                       Opcode.INLINE_RETURN, Opcode.INCREMENT,
+                       Opcode.ARRAY_READ, Opcode.ARRAY_WRITE,
+                       Opcode.CALL_DISCARD, Opcode.TAIL_CALL):
+            handlers[opcode] = (
+                lambda arg_1, arg_2, counter, filename, handler=handlers[opcode]:
+                self._spilled(handler, arg_1, arg_2, counter, filename))
+        for opcode, command in ARITHMETIC.items():
+            handlers[opcode] = (
+                lambda arg_1, arg_2, counter, filename, command=command:
+                self.write_top_arithmetic(command, counter))
+        handlers[Opcode.PUSH] = self.write_top_push
+        handlers[Opcode.POP] = self.write_top_pop
+        handlers[Opcode.IF] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_top_if(arg_1, None, filename))
+        handlers[Opcode.COMPARE_IF] = (
+            lambda arg_1, arg_2, counter, filename:
+            self.write_top_if(arg_1, arg_2, filename))
+
+    def _spilled(self, handler, arg_1, arg_2, counter, filename) -> None:
+        """
+        Run a handler of the plain translation on the materialized stack.
+        """
+        self.spill_top()
+        handler(arg_1, arg_2, counter, filename)
+
+    def spill_top(self) -> None:
+        """
+        Push the top of the stack held in D back onto the RAM stack.
+        """
+        if not self.top_in_d:
+            return
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M+1\n')
+        self.fp.write('A=A-1\n')
+        self.fp.write('M=D\n')
+        self.top_in_d = False
+
+    def load_top(self) -> None:
+        """
+        Pop the top of the RAM stack into D unless it is there already.
+        """
+        if self.top_in_d:
+            return
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('D=M\n')
+        self.top_in_d = True
+
+    def write_top_push(self, segment, index, counter, filename) -> None:
+        """
+        Translate PUSH command into a load of D.
+        """
+        self.spill_top()
+        if segment == Segment.CONSTANT and index in (0, 1):
+            self.fp.write(f'D={index}\n')
+        elif segment == Segment.STACK:
+            self.fp.write(f'@{index}\n')
+            self.fp.write('D=A\n')
+            self.fp.write('@SP\n')
+            self.fp.write('A=M-D\n')
+            self.fp.write('D=M\n')
+        else:
+            self._load_d(segment, index, filename)
+        self.top_in_d = True
+
+    def write_top_pop(self, segment, index, counter, filename) -> None:
+        """
+        Translate POP command into a store of D.
+        """
+        if segment == Segment.STACK:
+            self.spill_top()
+            self.pop_handlers[segment](index, counter, filename)
+            return
+        self.load_top()
+        self.top_in_d = False
+        if segment not in self.SEGMENT_POINTERS:
+            self.fp.write(f'@{self._fixed_address(segment, index, filename)}\n')
+        elif index <= self.MOVE_UNROLL_LIMIT:
+            self.fp.write(f'@{self.SEGMENT_POINTERS[segment]}\n')
+            if index == 0:
+                self.fp.write('A=M\n')
+            else:
+                self.fp.write('A=M+1\n')
+                for _ in range(index - 1):
+                    self.fp.write('A=A+1\n')
+        else:
+            # the address needs D; keep the value in R13 meanwhile
+            self.fp.write('@R13\n')
+            self.fp.write('M=D\n')
+            self.fp.write(f'@{self.SEGMENT_POINTERS[segment]}\n')
+            self.fp.write('D=M\n')
+            self.fp.write(f'@{index}\n')
+            self.fp.write('D=D+A\n')
+            self.fp.write('@R14\n')
+            self.fp.write('M=D\n')
+            self.fp.write('@R13\n')
+            self.fp.write('D=M\n')
+            self.fp.write('@R14\n')
+            self.fp.write('A=M\n')
+        self.fp.write('M=D\n')
+
+    def write_top_if(self, arg_1, jump, filename) -> None:
+        """
+        Translate if-goto (jump=None: jump if the popped value is not
+        zero) or a fused comparison and if-goto ('jump' on the
+        difference of the two popped values).
+        """
+        self.load_top()
+        self.top_in_d = False
+        if jump is None:
+            jump = 'JNE'
+        else:
+            self.fp.write('@SP\n')
+            self.fp.write('AM=M-1\n')
+            self.fp.write('D=M-D\n')
+        self.fp.write(f'@{self._label(arg_1, filename)}\n')
+        self.fp.write(f'D;{jump}\n')
+
+    def write_top_arithmetic(self, command, counter) -> None:
+        """
+        Translate arithmetic and logical commands on the top of the
+        stack. Binary commands combine D with RAM[SP - 1] when the top
+        is in D, and work in place in RAM otherwise.
+        """
+        if command in ('neg', 'not'):
+            operator = '-' if command == 'neg' else '!'
+            if self.top_in_d:
+                self.fp.write(f'D={operator}D\n')
+            else:
+                self.fp.write('@SP\n')
+                self.fp.write('A=M-1\n')
+                self.fp.write(f'M={operator}M\n')
+            return
+        if command in ('eq', 'gt', 'lt'):
+            if self.shared_compare:
+                self.spill_top()
+                self.handle_lt_gt_eq(command, counter)
+                return
+            self.write_top_comparison(command, counter)
+            return
+        expression = {'add': 'D+M', 'sub': 'M-D', 'and': 'D&M',
+                      'or': 'D|M'}[command]
+        if self.top_in_d:
+            self.fp.write('@SP\n')
+            self.fp.write('AM=M-1\n')
+            self.fp.write(f'D={expression}\n')
+        else:
+            self.fp.write('@SP\n')
+            self.fp.write('AM=M-1\n')
+            self.fp.write('D=M\n')
+            self.fp.write('A=A-1\n')
+            self.fp.write(f'M={expression}\n')
+
+    def write_top_comparison(self, command, counter) -> None:
+        """
+        Translate eq/gt/lt into a branch setting D to true (-1)
+        or false (0).
+        """
+        label_id = f'.{self._file_stem()}.{counter}'
+        self.load_top()
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('D=M-D\n')
+        self.fp.write(f'@TRUE{label_id}\n')
+        self.fp.write(f'D;J{command.upper()}\n')
+        self.fp.write('D=0\n')
+        self.fp.write(f'@END{label_id}\n')
+        self.fp.write('0;JMP\n')
+        self.fp.write(f'(TRUE{label_id})\n')
+        self.fp.write('D=-1\n')
+        self.fp.write(f'(END{label_id})\n')
 
     def write_init(self) -> None:
         """
         Change later.
         """
+        self._mark_routine('bootstrap')
         self.fp.write('@256\n')
         self.fp.write('D=A\n')
         self.fp.write('@SP\n')
@@ -175,10 +1164,7 @@ class Translator:
         Writes assembly code that effects
         the label command.
         """
-        filename = filename.split('.')[0]
-        if '/' in filename:
-            filename = filename.split('/')[-1]
-        label = f'({filename}${arg_1})\n'
+        label = f'({self._label(arg_1, filename)})\n'
         self.fp.write(label)
 
     def write_if(self, command_type, arg_1, filename) -> None:
@@ -186,35 +1172,277 @@ class Translator:
         Writes assembly code that effects
         the if-goto command.
         """
-        filename = filename.split('.')[0]
-        if '/' in filename:
-            filename = filename.split('/')[-1]
-        label = f'@{filename}${arg_1}\n'
+        label = f'@{self._label(arg_1, filename)}\n'
         self.fp.write('@SP\n')
         self.fp.write('AM=M-1\n')
         self.fp.write('D=M\n')
         self.fp.write(label)
         self.fp.write('D;JNE\n')
 
+    def write_compare_if(self, arg_1, jump, filename) -> None:
+        """
+        Writes assembly code that effects a comparison followed
+        by if-goto: pop both operands and jump on their difference.
+        """
+        label = f'@{self._label(arg_1, filename)}\n'
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('D=M-D\n')
+        self.fp.write(label)
+        self.fp.write(f'D;{jump}\n')
+
     def write_goto(self, command_type, arg_1, filename) -> None:
         """
         Writes assembly code that effects
         the goto command.
         """
+        label = f'@{self._label(arg_1, filename)}\n'
+        self.fp.write(label)
+        self.fp.write('0;JMP\n')
+
+    def _label(self, label, filename) -> str:
+        """
+        Return the assembly symbol of a VM label; labels are scoped
+        by the enclosing function (functionName$label).
+        """
+        if self.current_function:
+            return f'{self.current_function}${label}'
         filename = filename.split('.')[0]
         if '/' in filename:
             filename = filename.split('/')[-1]
-        label = f'@{filename}${arg_1}\n'
-        self.fp.write(label)
+        return f'{filename}${label}'
+
+    def _file_stem(self) -> str:
+        """
+        Return name of the file being translated, without extension.
+        """
+        return os.path.basename(self.current_file).split('.')[0]
+
+    def write_shared_frames(self) -> None:
+        """
+        Write the shared $CALL and $RETURN routines. Both are
+        emitted once per program, guarded by a jump so that
+        execution never falls through into them.
+
+        $CALL expects the return address in R13, nArgs in R14 and
+        the address of the called function in D.
+        $RETURN expects nothing; it uses R14 (endFrame) and
+        R15 (retAddr) as scratch registers.
+        """
+        self._mark_routine('shared frames')
+        lines = [
+            '@$FRAMES.END',
+            '0;JMP',
+            # $CALL: keep the target in R15; push retAddr LCL ARG THIS THAT
+            '($CALL)',
+            '@R15',
+            'M=D',
+            '@R13',
+            'D=M',
+            '@SP',
+            'A=M',
+            'M=D',
+        ]
+        for segment_pointer in ('LCL', 'ARG', 'THIS', 'THAT'):
+            lines += [
+                f'@{segment_pointer}',
+                'D=M',
+                '@SP',
+                'AM=M+1',
+                'M=D',
+            ]
+        lines += [
+            # LCL = SP; ARG = SP - nArgs - 5; goto target
+            '@SP',
+            'MD=M+1',
+            '@LCL',
+            'M=D',
+            '@R14',
+            'D=D-M',
+            '@5',
+            'D=D-A',
+            '@ARG',
+            'M=D',
+            '@R15',
+            'A=M',
+            '0;JMP',
+            # $RETURN: endFrame = LCL; retAddr = *(endFrame - 5)
+            '($RETURN)',
+            '@LCL',
+            'D=M',
+            '@R14',
+            'M=D',
+            '@5',
+            'A=D-A',
+            'D=M',
+            '@R15',
+            'M=D',
+            # *ARG = pop(); SP = ARG + 1
+            '@SP',
+            'AM=M-1',
+            'D=M',
+            '@ARG',
+            'A=M',
+            'M=D',
+            'D=A+1',
+            '@SP',
+            'M=D',
+        ]
+        # restore THAT THIS ARG LCL of the caller
+        for segment_pointer in ('THAT', 'THIS', 'ARG', 'LCL'):
+            lines += [
+                '@R14',
+                'AM=M-1',
+                'D=M',
+                f'@{segment_pointer}',
+                'M=D',
+            ]
+        lines += [
+            '@R15',
+            'A=M',
+            '0;JMP',
+            '($FRAMES.END)',
+        ]
+        for line in lines:
+            self.fp.write(f'{line}\n')
+        self.shared_frames_size = sum(1 for line in lines
+                                      if not line.startswith('('))
+
+    def write_shared_comparisons(self) -> None:
+        """
+        Write the shared $EQ, $GT and $LT routines, guarded by a jump
+        like the shared frames.
+
+        Each routine expects the return address in D; it replaces the
+        two topmost stack entries with the result of the comparison,
+        using R13 to keep the return address.
+        """
+        self._mark_routine('shared comparisons')
+        lines = [
+            '@$COMPARE.END',
+            '0;JMP',
+        ]
+        for command, jump in (('EQ', 'JEQ'), ('GT', 'JGT'), ('LT', 'JLT')):
+            lines += [
+                f'(${command})',
+                '@R13',
+                'M=D',
+                # D = x - y; assume true
+                '@SP',
+                'AM=M-1',
+                'D=M',
+                'A=A-1',
+                'D=M-D',
+                'M=-1',
+                f'@${command}.TRUE',
+                f'D;{jump}',
+                '@SP',
+                'A=M-1',
+                'M=0',
+                f'(${command}.TRUE)',
+                '@R13',
+                'A=M',
+                '0;JMP',
+            ]
+        lines.append('($COMPARE.END)')
+        for line in lines:
+            self.fp.write(f'{line}\n')
+        self.shared_compare_size = sum(1 for line in lines
+                                       if not line.startswith('('))
+
+    def stats(self) -> tuple:
+        """
+        Return statistics collected by this translator.
+        """
+        return (self.call_sites, self.return_sites, self.rom_saved,
+                self.compare_sites, self.prologues, self.prologue_locals,
+                self.shared_locals)
+
+    def add_stats(self, stats) -> None:
+        """
+        Add statistics returned by stats() of another translator.
+        """
+        (call_sites, return_sites, rom_saved, compare_sites, prologues,
+         prologue_locals, shared_locals) = stats
+        self.call_sites += call_sites
+        self.return_sites += return_sites
+        self.rom_saved += rom_saved
+        self.compare_sites += compare_sites
+        for strategy, counts in prologues.items():
+            for position, count in enumerate(counts):
+                self.prologues[strategy][position] += count
+        self.prologue_locals += prologue_locals
+        self.shared_locals = max(self.shared_locals, shared_locals)
+
+    def report_shared_comparisons(self) -> None:
+        """
+        Print ROM savings achieved by the shared comparison routines.
+        """
+        saved = (self.compare_sites * (self.INLINE_COMPARE_SIZE
+                                       - self.SHARED_COMPARE_SITE_SIZE)
+                 - self.shared_compare_size)
+        print(f'shared compare: {self.compare_sites} comparison sites, '
+              f'routines {self.shared_compare_size} words, '
+              f'{saved} ROM words saved')
+
+    def report_shared_frames(self) -> None:
+        """
+        Print ROM savings achieved by the shared call/return routines.
+        """
+        saved = self.rom_saved - self.shared_frames_size
+        print(f'shared frames: {self.call_sites} call sites, '
+              f'{self.return_sites} return sites, '
+              f'routines {self.shared_frames_size} words, '
+              f'{saved} ROM words saved')
+
+    def write_shared_call(self, function_name, num_args, return_label) -> None:
+        """
+        Load return address, nArgs and the target into R13, R14 and D;
+        then jump into the shared $CALL routine.
+        """
+        self.fp.write(f'@{return_label}\n')
+        self.fp.write('D=A\n')
+        self.fp.write('@R13\n')
+        self.fp.write('M=D\n')
+        if num_args in {0, 1}:
+            self.fp.write('@R14\n')
+            self.fp.write(f'M={num_args}\n')
+            site_size = 10
+        else:
+            self.fp.write(f'@{num_args}\n')
+            self.fp.write('D=A\n')
+            self.fp.write('@R14\n')
+            self.fp.write('M=D\n')
+            site_size = 12
+        self.fp.write(f'@{function_name}\n')
+        self.fp.write('D=A\n')
+        self.fp.write('@$CALL\n')
         self.fp.write('0;JMP\n')
+        self.fp.write(f'({return_label})\n')
+        self.call_sites += 1
+        self.rom_saved += self.INLINE_CALL_SIZE - site_size
 
     def write_call(self, function_name, num_args, counter) -> None:
         """
         Write later.
         """
-        # generate return label
-        return_label = function_name.split('.')[0]
-        return_label = f'{return_label}$ret.{counter + 1}'
+        # generate return label; unique as counter is unique per file
+        if self.current_function:
+            return_label = f'{self.current_function}$ret.{counter + 1}'
+        else:
+            return_label = function_name.split('.')[0]
+            return_label = f'{return_label}$ret.{counter + 1}'
+
+        if self.counters is not None:
+            self.write_counter(self.counters.calls(function_name),
+                               f'{return_label}.count')
+
+        if self.shared_frames:
+            self.write_shared_call(function_name, num_args, return_label)
+            return
 
         # push return address onto the stack
         self.fp.write(f'@{return_label}\n')
@@ -278,15 +1506,167 @@ class Translator:
         """
         Change later
         """
+        self.current_function = arg_1
         self.fp.write(f'({arg_1})\n')
+        if self.counters is not None:
+            self.write_counter(self.counters.entries(arg_1),
+                               f'{arg_1}$count')
+        if self.prologue is not None:
+            self.write_locals(arg_1, arg_2)
+            return
         while arg_2 > 0:
             self.handle_constant_push(0)
             arg_2 -= 1
 
+    @classmethod
+    def prologue_costs(cls, num_locals) -> dict:
+        """
+        Return strategy -> (ROM words, cycles) of zeroing 'num_locals'
+        locals with every strategy available for that many.
+        """
+        if num_locals == 1:
+            unrolled = 4
+        else:
+            unrolled = 2 * num_locals + 4
+        costs = {'unrolled': (unrolled, unrolled),
+                 'loop': (8, 6 * num_locals + 2)}
+        if num_locals <= cls.SHARED_LOCALS_LIMIT:
+            costs['shared'] = (4, 4 * num_locals + 6)
+        return costs
+
+    def write_locals(self, function_name, num_locals) -> None:
+        """
+        Push 'num_locals' zeros with the cheapest strategy: fewest
+        cycles (then words) for prologue 'speed', fewest ROM words
+        (then cycles) for 'size'.
+
+        unrolled  zero the words above SP one after the other, then
+                  advance SP once
+        loop      push one zero per iteration, counting down in D
+        shared    jump into the $LOCALS routine at the entry zeroing
+                  the right number of words (see write_shared_locals)
+        """
+        if num_locals == 0:
+            return
+        costs = self.prologue_costs(num_locals)
+        if self.prologue == 'speed':
+            strategy = min(costs, key=lambda name: costs[name][::-1])
+        else:
+            strategy = min(costs, key=lambda name: costs[name])
+        stats = self.prologues[strategy]
+        stats[0] += 1
+        stats[1] += costs[strategy][0]
+        stats[2] += costs[strategy][1]
+        self.prologue_locals += num_locals
+        label = f'{function_name}$locals'
+        if strategy == 'shared':
+            self.shared_locals = max(self.shared_locals, num_locals)
+            self.fp.write(f'@{label}\n')
+            self.fp.write('D=A\n')
+            self.fp.write(f'@$LOCALS.{num_locals}\n')
+            self.fp.write('0;JMP\n')
+            self.fp.write(f'({label})\n')
+        elif strategy == 'loop':
+            self.fp.write(f'@{num_locals}\n')
+            self.fp.write('D=A\n')
+            self.fp.write(f'({label})\n')
+            self.fp.write('@SP\n')
+            self.fp.write('AM=M+1\n')
+            self.fp.write('A=A-1\n')
+            self.fp.write('M=0\n')
+            self.fp.write(f'@{label}\n')
+            self.fp.write('D=D-1;JGT\n')
+        elif num_locals == 1:
+            self.fp.write('@SP\n')
+            self.fp.write('AM=M+1\n')
+            self.fp.write('A=A-1\n')
+            self.fp.write('M=0\n')
+        else:
+            self.fp.write('@SP\n')
+            self.fp.write('A=M\n')
+            self.fp.write('M=0\n')
+            for _ in range(num_locals - 1):
+                self.fp.write('A=A+1\n')
+                self.fp.write('M=0\n')
+            self.fp.write('D=A+1\n')
+            self.fp.write('@SP\n')
+            self.fp.write('M=D\n')
+
+    def write_shared_locals(self) -> int:
+        """
+        Write the shared $LOCALS routine for the most locals zeroed
+        through it, guarded by a jump like the shared frames; return
+        its size in ROM words.
+
+        The routine has one entry point $LOCALS.n per count; each entry
+        pushes a zero and falls through to the next smaller one. The
+        return address stays in D, which the pushes do not touch.
+        """
+        if not self.shared_locals:
+            return 0
+        self._mark_routine('shared locals')
+        lines = [
+            '@$LOCALS.END',
+            '0;JMP',
+        ]
+        for num_locals in range(self.shared_locals, 0, -1):
+            lines += [
+                f'($LOCALS.{num_locals})',
+                '@SP',
+                'AM=M+1',
+                'A=A-1',
+                'M=0',
+            ]
+        lines += [
+            'A=D',
+            '0;JMP',
+            '($LOCALS.END)',
+        ]
+        for line in lines:
+            self.fp.write(f'{line}\n')
+        return sum(1 for line in lines if not line.startswith('('))
+
+    def report_prologues(self, routine_size) -> None:
+        """
+        Print the prologue strategies chosen and their ROM and cycle
+        costs against one push per local.
+        """
+        words = routine_size
+        cycles = 0
+        counts = []
+        for strategy, (functions, size, time) in self.prologues.items():
+            words += size
+            cycles += time
+            counts.append(f'{functions} {strategy}')
+        pushes = self.prologue_locals * self.PUSH_ZERO_SIZE
+        print(f'prologue ({self.prologue}): {", ".join(counts)}; '
+              f'{words} ROM words (routine {routine_size}) instead of '
+              f'{pushes}, {cycles} cycles instead of {pushes} '
+              f'if every function runs once')
+
+    def write_counter(self, address, label) -> None:
+        """
+        Writes assembly code that increments the 32-bit counter
+        at RAM[address] (low word) and RAM[address + 1] (high word).
+        """
+        self.fp.write(f'@{address}\n')
+        self.fp.write('MD=M+1\n')
+        self.fp.write(f'@{label}\n')
+        self.fp.write('D;JNE\n')
+        self.fp.write(f'@{address + 1}\n')
+        self.fp.write('M=M+1\n')
+        self.fp.write(f'({label})\n')
+
     def write_return(self) -> None:
         """
         Change later.
         """
+        if self.shared_frames:
+            self.fp.write('@$RETURN\n')
+            self.fp.write('0;JMP\n')
+            self.return_sites += 1
+            self.rom_saved += self.INLINE_RETURN_SIZE - 2
+            return
         # copy LCL to endFrame
         self.fp.write('@LCL\n')
         self.fp.write('D=M\n')
@@ -348,30 +1728,17 @@ class Translator:
         self.fp.write('A=M\n')
         self.fp.write('0;JMP\n')
 
-    def write_push_pop(self, command_type, segment, index, counter, filename) -> None:
-        """
-        Translate commands for PUSH/POP operations.
-        """
-        if command_type == 'C_PUSH':
-            if segment in {'local', 'argument', 'this', 'that'}:
-                self.handle_lcl_arg_this_that_push(segment, index);
-            elif segment == 'constant':
-                self.handle_constant_push(index)
-            elif segment == 'pointer':
-                self.handle_pointer_push(segment, index)
-            elif segment == 'static':
-                self.handle_static_push(segment, index, counter, filename)
-            elif segment == 'temp':
-                self.handle_temp_push(segment, index);
-        elif command_type == 'C_POP':
-            if segment in {'local', 'argument', 'this', 'that'}:
-                self.handle_lcl_arg_this_that_pop(segment, index);
-            elif segment == 'pointer':
-                self.handle_pointer_pop(segment, index)
-            elif segment == 'static':
-                self.handle_static_pop(segment, index, counter, filename)
-            elif segment == 'temp':
-                self.handle_temp_pop(segment, index)
+    def write_push(self, segment, index, counter, filename) -> None:
+        """
+        Translate PUSH command through the push handler table.
+        """
+        self.push_handlers[segment](index, counter, filename)
+
+    def write_pop(self, segment, index, counter, filename) -> None:
+        """
+        Translate POP command through the pop handler table.
+        """
+        self.pop_handlers[segment](index, counter, filename)
 
     def handle_constant_push(self, index) -> None:
         """
@@ -390,15 +1757,7 @@ class Translator:
         Handle translation of push commands for
         LOCAL/ARGUMENT/THIS/THAT memory segments.
         """
-        segment_pointer = ''
-        if segment == 'local':
-            segment_pointer = 'LCL'
-        elif segment == 'argument':
-            segment_pointer = 'ARG'
-        elif segment == 'this':
-            segment_pointer = 'THIS'
-        elif segment == 'that':
-            segment_pointer = 'THAT'
+        segment_pointer = self.SEGMENT_POINTERS[segment]
 
         self.fp.write(f'@{segment_pointer}\n')
         self.fp.write('D=M\n')
@@ -416,15 +1775,7 @@ class Translator:
         Handle translation of pop commands for
         LOCAL/ARGUMENT/THIS/THAT memory segments.
         """
-        segment_pointer = ''
-        if segment == 'local':
-            segment_pointer = 'LCL'
-        elif segment == 'argument':
-            segment_pointer = 'ARG'
-        elif segment == 'this':
-            segment_pointer = 'THIS'
-        elif segment == 'that':
-            segment_pointer = 'THAT'
+        segment_pointer = self.SEGMENT_POINTERS[segment]
 
         self.fp.write(f'@{segment_pointer}\n')
         self.fp.write('D=M\n')
@@ -545,12 +1896,392 @@ class Translator:
         self.fp.write(f'@{variable_name}\n')
         self.fp.write('M=D\n')
 
+    def handle_stack_push(self, segment, index) -> None:
+        """
+        Handle push of the SP-relative entry at address SP - index
+        (used by inlined function bodies).
+        """
+        self.fp.write(f'@{index}\n')
+        self.fp.write('D=A\n')
+        self.fp.write('@SP\n')
+        self.fp.write('A=M-D\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@SP\n')
+        self.fp.write('A=M\n')
+        self.fp.write('M=D\n')
+        self.fp.write('@SP\n')
+        self.fp.write('M=M+1\n')
+
+    def handle_stack_pop(self, segment, index) -> None:
+        """
+        Handle pop into the SP-relative entry at address SP - index,
+        SP taken before the pop (used by inlined function bodies).
+        """
+        self.fp.write(f'@{index}\n')
+        self.fp.write('D=A\n')
+        self.fp.write('@SP\n')
+        self.fp.write('D=M-D\n')
+        self.fp.write('@ADDRESS\n')
+        self.fp.write('M=D\n')
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@ADDRESS\n')
+        self.fp.write('A=M\n')
+        self.fp.write('M=D\n')
+
+    def write_inline_return(self, size) -> None:
+        """
+        Return from an inlined function body: move the result over the
+        'size' stack entries below it and drop them.
+        """
+        if size == 0:
+            return
+        if size == 1:
+            self.fp.write('@SP\n')
+            self.fp.write('AM=M-1\n')
+            self.fp.write('D=M\n')
+            self.fp.write('A=A-1\n')
+            self.fp.write('M=D\n')
+            return
+        # SP -= size; result is now at SP + size - 1
+        self.fp.write(f'@{size}\n')
+        self.fp.write('D=A\n')
+        self.fp.write('@SP\n')
+        self.fp.write('M=M-D\n')
+        self.fp.write(f'@{size - 1}\n')
+        self.fp.write('D=A\n')
+        self.fp.write('@SP\n')
+        self.fp.write('A=D+M\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@SP\n')
+        self.fp.write('A=M-1\n')
+        self.fp.write('M=D\n')
+
+    def write_move(self, source, destination, filename) -> None:
+        """
+        Translate an adjacent 'push source' / 'pop destination' pair
+        into a direct move through the D register, with no SP traffic.
+        Both arguments are (segment, index) tuples.
+        """
+        segment, index = destination
+        # destinations at a large offset need their address computed
+        # before D is loaded with the value
+        spill = (segment in self.SEGMENT_POINTERS
+                 and index > self.MOVE_UNROLL_LIMIT)
+        if spill:
+            self.fp.write(f'@{self.SEGMENT_POINTERS[segment]}\n')
+            self.fp.write('D=M\n')
+            self.fp.write(f'@{index}\n')
+            self.fp.write('D=D+A\n')
+            self.fp.write('@R13\n')
+            self.fp.write('M=D\n')
+
+        self._load_d(*source, filename)
+
+        # destination = D
+        segment, index = destination
+        if spill:
+            self.fp.write('@R13\n')
+            self.fp.write('A=M\n')
+        elif segment in self.SEGMENT_POINTERS:
+            self.fp.write(f'@{self.SEGMENT_POINTERS[segment]}\n')
+            if index == 0:
+                self.fp.write('A=M\n')
+            else:
+                self.fp.write('A=M+1\n')
+                for _ in range(index - 1):
+                    self.fp.write('A=A+1\n')
+        else:
+            self.fp.write(f'@{self._fixed_address(segment, index, filename)}\n')
+        self.fp.write('M=D\n')
+
+    def _load_d(self, segment, index, filename) -> None:
+        """
+        Writes assembly code that loads a constant or segment
+        entry (not of the stack segment) into D.
+        """
+        if segment == Segment.CONSTANT:
+            self.fp.write(f'@{index}\n')
+            self.fp.write('D=A\n')
+        elif segment in self.SEGMENT_POINTERS:
+            self.fp.write(f'@{self.SEGMENT_POINTERS[segment]}\n')
+            if index == 0:
+                self.fp.write('A=M\n')
+            elif index == 1:
+                self.fp.write('A=M+1\n')
+            else:
+                self.fp.write('D=M\n')
+                self.fp.write(f'@{index}\n')
+                self.fp.write('A=D+A\n')
+            self.fp.write('D=M\n')
+        else:
+            self.fp.write(f'@{self._fixed_address(segment, index, filename)}\n')
+            self.fp.write('D=M\n')
+
+    def _address_a(self, segment, index, filename) -> None:
+        """
+        Writes assembly code that points A at a segment entry (not of
+        the constant or stack segment). Only base pointer offsets above
+        MOVE_UNROLL_LIMIT use D.
+        """
+        if segment not in self.SEGMENT_POINTERS:
+            self.fp.write(f'@{self._fixed_address(segment, index, filename)}\n')
+            return
+        self.fp.write(f'@{self.SEGMENT_POINTERS[segment]}\n')
+        if index > self.MOVE_UNROLL_LIMIT:
+            self.fp.write('D=M\n')
+            self.fp.write(f'@{index}\n')
+            self.fp.write('A=D+A\n')
+        elif index == 0:
+            self.fp.write('A=M\n')
+        else:
+            self.fp.write('A=M+1\n')
+            for _ in range(index - 1):
+                self.fp.write('A=A+1\n')
+
+    def write_increment(self, segment, index, delta, filename) -> None:
+        """
+        Translate the increment superinstruction: add 'delta' to
+        a segment entry in place.
+        """
+        if delta in (1, -1):
+            self._address_a(segment, index, filename)
+            self.fp.write('M=M+1\n' if delta == 1 else 'M=M-1\n')
+            return
+        if segment in self.SEGMENT_POINTERS \
+                and index > self.MOVE_UNROLL_LIMIT:
+            # the address needs D; keep it in R13
+            self._address_a(segment, index, filename)
+            self.fp.write('D=A\n')
+            self.fp.write('@R13\n')
+            self.fp.write('M=D\n')
+            self.fp.write(f'@{abs(delta)}\n')
+            self.fp.write('D=A\n')
+            self.fp.write('@R13\n')
+            self.fp.write('A=M\n')
+        else:
+            self.fp.write(f'@{abs(delta)}\n')
+            self.fp.write('D=A\n')
+            self._address_a(segment, index, filename)
+        self.fp.write('M=D+M\n' if delta > 0 else 'M=M-D\n')
+
+    def write_array_read(self, array, offset, filename) -> None:
+        """
+        Translate the array read superinstruction: point THAT at
+        array + offset and push that 0. Both arguments are (segment,
+        index) tuples.
+        """
+        self._load_d(*array, filename)
+        segment, index = offset
+        if segment == Segment.CONSTANT:
+            self.fp.write(f'@{index}\n')
+            self.fp.write('D=D+A\n')
+        elif segment in self.SEGMENT_POINTERS \
+                and index > self.MOVE_UNROLL_LIMIT:
+            self.fp.write('@R13\n')
+            self.fp.write('M=D\n')
+            self._load_d(segment, index, filename)
+            self.fp.write('@R13\n')
+            self.fp.write('D=D+M\n')
+        else:
+            self._address_a(segment, index, filename)
+            self.fp.write('D=D+M\n')
+        self.fp.write('@THAT\n')
+        self.fp.write('M=D\n')
+        self.fp.write('A=D\n')
+        self.fp.write('D=M\n')
+        if self.top_of_stack:
+            self.top_in_d = True
+            return
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M+1\n')
+        self.fp.write('A=A-1\n')
+        self.fp.write('M=D\n')
+
+    def write_array_write(self) -> None:
+        """
+        Translate the array write superinstruction: pop the value
+        into temp 0 and the address into pointer 1, then store the
+        value at that 0.
+        """
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@5\n')
+        self.fp.write('M=D\n')
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('A=M\n')
+        self.fp.write('M=D\n')
+        # the popped address is still in RAM[SP]
+        self.fp.write('@SP\n')
+        self.fp.write('A=M\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@THAT\n')
+        self.fp.write('M=D\n')
+
+    def write_call_discard(self, function_name, num_args, counter) -> None:
+        """
+        Translate the call_discard superinstruction: a call whose
+        result is popped into temp 0.
+        """
+        self.write_call(function_name, num_args, counter)
+        self.fp.write('@SP\n')
+        self.fp.write('AM=M-1\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@5\n')
+        self.fp.write('M=D\n')
+
+    def write_tail_call(self, function_name, num_args, counter) -> None:
+        """
+        Writes assembly code that calls 'function_name' in place of
+        the current function, reusing its frame: the new arguments
+        replace the ones of the current function and the called
+        function returns straight to the caller of the current one.
+
+        When the current function has exactly 'num_args' arguments
+        (e.g. self-recursion), its frame is already where the new one
+        belongs and only the arguments are moved. Otherwise the saved
+        frame is read into registers first, then rebuilt above the
+        moved arguments.
+        """
+        if num_args > self.TAIL_CALL_ARGS_LIMIT:
+            self.write_call(function_name, num_args, counter)
+            self.write_return()
+            return
+        if self.current_function:
+            label = f'{self.current_function}$tail.{counter + 1}'
+        else:
+            label = function_name.split('.')[0]
+            label = f'{label}$tail.{counter + 1}'
+        if self.counters is not None:
+            self.write_counter(self.counters.calls(function_name),
+                               f'{label}.count')
+        # same frame size when LCL - ARG == nArgs + 5
+        self.fp.write('@LCL\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@ARG\n')
+        self.fp.write('D=D-M\n')
+        self.fp.write(f'@{num_args + 5}\n')
+        self.fp.write('D=D-A\n')
+        self.fp.write(f'@{label}\n')
+        self.fp.write('D;JNE\n')
+        self._move_tail_arguments(num_args)
+        # SP = LCL; goto function
+        self.fp.write('@LCL\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@SP\n')
+        self.fp.write('M=D\n')
+        self.fp.write(f'@{function_name}\n')
+        self.fp.write('0;JMP\n')
+        self.fp.write(f'({label})\n')
+        # keep THAT, THIS and ARG of the caller in R15, R14 and R13,
+        # the return address in RAM[SP]; LCL = LCL of the caller
+        self.fp.write('@LCL\n')
+        self.fp.write('A=M-1\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@R15\n')
+        self.fp.write('M=D\n')
+        self.fp.write('@LCL\n')
+        self.fp.write('A=M-1\n')
+        self.fp.write('A=A-1\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@R14\n')
+        self.fp.write('M=D\n')
+        for offset, destination in ((3, 'R13'), (5, None), (4, 'LCL')):
+            self.fp.write('@LCL\n')
+            self.fp.write('D=M\n')
+            self.fp.write(f'@{offset}\n')
+            self.fp.write('A=D-A\n')
+            self.fp.write('D=M\n')
+            if destination is None:
+                self.fp.write('@SP\n')
+                self.fp.write('A=M\n')
+            else:
+                self.fp.write(f'@{destination}\n')
+            self.fp.write('M=D\n')
+        self._move_tail_arguments(num_args)
+        # rebuild the frame above the arguments: *(ARG + nArgs) = retAddr
+        self.fp.write('@SP\n')
+        self.fp.write('A=M\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@ARG\n')
+        self.fp.write('A=M\n')
+        for _ in range(num_args):
+            self.fp.write('A=A+1\n')
+        self.fp.write('M=D\n')
+        # SP = ARG + nArgs + 1; push LCL ARG THIS THAT of the caller
+        self.fp.write('@ARG\n')
+        self.fp.write('D=M\n')
+        self.fp.write(f'@{num_args + 1}\n')
+        self.fp.write('D=D+A\n')
+        self.fp.write('@SP\n')
+        self.fp.write('M=D\n')
+        for register in ('LCL', 'R13', 'R14', 'R15'):
+            self.fp.write(f'@{register}\n')
+            self.fp.write('D=M\n')
+            self.fp.write('@SP\n')
+            self.fp.write('AM=M+1\n')
+            self.fp.write('A=A-1\n')
+            self.fp.write('M=D\n')
+        # LCL = SP; goto function
+        self.fp.write('@SP\n')
+        self.fp.write('D=M\n')
+        self.fp.write('@LCL\n')
+        self.fp.write('M=D\n')
+        self.fp.write(f'@{function_name}\n')
+        self.fp.write('0;JMP\n')
+
+    def _move_tail_arguments(self, num_args) -> None:
+        """
+        Writes assembly code that copies the top 'num_args' stack
+        entries to argument 0..num_args - 1, lowest first; the
+        destination never lies above the source.
+        """
+        for position in range(num_args):
+            self.fp.write('@SP\n')
+            self.fp.write('A=M-1\n')
+            for _ in range(num_args - 1 - position):
+                self.fp.write('A=A-1\n')
+            self.fp.write('D=M\n')
+            self.fp.write('@ARG\n')
+            self.fp.write('A=M\n')
+            for _ in range(position):
+                self.fp.write('A=A+1\n')
+            self.fp.write('M=D\n')
+
+    def _fixed_address(self, segment, index, filename) -> str:
+        """
+        Return the symbol/address of a temp, pointer or static
+        segment entry; these do not depend on a base pointer.
+        """
+        if segment == Segment.TEMP:
+            return str(5 + index)
+        if segment == Segment.POINTER:
+            return 'THIS' if index == 0 else 'THAT'
+        if '/' in self.current_file:
+            filename = self.current_file.split('/')[-1]
+        else:
+            filename = filename.split('.')[0]
+        return f'{filename}.{index}'
+
     def handle_lt_gt_eq(self, command, counter) -> None:
         """
         Handle lt/gt/eq operations. All three commands are
-        translated in a similar way. Use f-strings and counter
-        to create unique loops and variables.
+        translated in a similar way. Use f-strings, file name and
+        counter to create unique loops and variables.
         """
+        label_id = f'.{self._file_stem()}.{counter}'
+        if self.shared_compare:
+            return_label = f'RETURN{label_id}'
+            self.fp.write(f'@{return_label}\n')
+            self.fp.write('D=A\n')
+            self.fp.write(f'@${command.upper()}\n')
+            self.fp.write('0;JMP\n')
+            self.fp.write(f'({return_label})\n')
+            self.compare_sites += 1
+            return
         action_if_true = ''
         action_if_false = ''
         jump_condition = ''
@@ -573,23 +2304,23 @@ class Translator:
         self.fp.write('@SP\n')
         self.fp.write('AM=M-1\n')
         self.fp.write('MD=M-D\n')
-        self.fp.write(f'@{action_if_true}{counter}\n')
+        self.fp.write(f'@{action_if_true}{label_id}\n')
         self.fp.write(f'D;{jump_condition}\n')
-        self.fp.write(f'@{action_if_false}{counter}\n')
+        self.fp.write(f'@{action_if_false}{label_id}\n')
         self.fp.write('0;JMP\n')
-        self.fp.write(f'({action_if_true}{counter})\n')
+        self.fp.write(f'({action_if_true}{label_id})\n')
         self.fp.write('@SP\n')
         self.fp.write('A=M\n')
         self.fp.write('M=-1\n')
-        self.fp.write(f'@END{counter}\n')
+        self.fp.write(f'@END{label_id}\n')
         self.fp.write('0;JMP\n')
-        self.fp.write(f'({action_if_false}{counter})\n')
+        self.fp.write(f'({action_if_false}{label_id})\n')
         self.fp.write('@SP\n')
         self.fp.write('A=M\n')
         self.fp.write('M=0\n')
-        self.fp.write(f'@END{counter}\n')
+        self.fp.write(f'@END{label_id}\n')
         self.fp.write('0;JMP\n')
-        self.fp.write(f'(END{counter})\n')
+        self.fp.write(f'(END{label_id})\n')
         self.fp.write('@SP\n')
         self.fp.write('M=M+1\n')
 